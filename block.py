@@ -0,0 +1,174 @@
+import os, time, json, yaml
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from course import *
+from course_library import CourseLibrary
+
+# a block is a list of trials, one course each; the next trial's course is
+# compiled (path, scoring index, outline vertices) in a worker thread while
+# the current one runs, so the swap between trials is only a reference change
+
+TRIAL_DEFAULTS = {
+    'targets': [25,-35,15,-15,30], # degrees
+    'target_time_spacing': 1.0, # seconds
+    'start_end_time_spacing': 0.5, # seconds
+    'course_angle_width': 15, # degrees
+}
+
+def library_trials(library, trial, rng):
+    # {'difficulty': [lo,hi], 'count': n}: n courses drawn from the library
+    min_difficulty, max_difficulty = trial['difficulty']
+    return [library.trial(library.pick(min_difficulty, max_difficulty, rng))
+        for count in range(trial.get('count',1))]
+
+def load_block(name, block_dir=os.path.join('config','blocks')):
+    # trial keys not given fall back to the block's defaults, then TRIAL_DEFAULTS;
+    # trials given by difficulty come from the block's course library
+    with open(os.path.join(block_dir,name+'.yml')) as f:
+        block = yaml.load(f, Loader=yaml.FullLoader)
+    defaults = dict(TRIAL_DEFAULTS)
+    defaults.update(block.get('defaults') or {})
+    library = None
+    if block.get('library'):
+        library = CourseLibrary(os.path.join('config',block['library']+'.courses'))
+    rng = np.random.default_rng(block.get('seed'))
+    block_trials = []
+    for trial in block['trials']:
+        if 'difficulty' in trial and 'targets' not in trial:
+            if library is None:
+                raise ValueError('Block '+name+' picks courses by difficulty but has no library')
+            block_trials += library_trials(library, trial, rng)
+        else:
+            block_trials.append(trial)
+    trials = []
+    for idx, trial in enumerate(block_trials):
+        full_trial = dict(defaults)
+        full_trial.update(trial)
+        full_trial.setdefault('name', 'trial_'+str(idx))
+        trials.append(full_trial)
+    block['name'] = name
+    block['trials'] = trials
+    return block
+
+def compile_course(trial, trough_speed, course_rads, shape_details=((0.01,10),)):
+    # everything about a course that doesn't touch opengl; course_rads are the
+    # trough radii to build outlines for (one per distinct lane scale),
+    # shape_details the (course_step, endcap_points) of every detail level
+    course_targets, course_times = build_course(trial['targets'],
+        trial['target_time_spacing'], trial['start_end_time_spacing'])
+    if (trial.get('library_speed') == trough_speed and trial.get('library_step') == 0.01):
+        course_y_raw, course_angle_raw = trial['library_path'] # sampled at generation
+    else:
+        course_y_raw, course_angle_raw = gen_course_path(course_targets,
+            course_times, trough_speed)
+    width = trial['course_angle_width']
+    shapes = {}
+    for course_step, endcap_points in shape_details:
+        if course_step == 0.01:
+            shape_y, shape_angle = course_y_raw, course_angle_raw
+        else:
+            shape_y, shape_angle = gen_course_path(course_targets, course_times,
+                trough_speed, step_size=course_step)
+        shapes[(course_step, endcap_points)] = [gen_course_vertices(shape_y, shape_angle,
+            course_rad, width, endcap_points) for course_rad in course_rads]
+    return {
+        'trial': trial,
+        'targets': list(trial['targets']),
+        'course_targets': course_targets,
+        'course_times': course_times,
+        'course_angle_width': width,
+        'course_y_raw': course_y_raw,
+        'course_angle_raw': course_angle_raw,
+        'course_index': CourseIndex(course_y_raw, course_angle_raw, width),
+        'target_ys': trough_speed*course_times[2:-2],
+        'shapes': shapes,
+    }
+
+class BlockEngine(object):
+    def __init__(self, trials, compile_fn, iti=1.0, frame_rate=60.0):
+        self.trials = trials
+        self.compile_fn = compile_fn # trial -> compiled course, runs in the worker
+        self.iti = iti # seconds between the end of one course and the next
+        self.dropped_time = 1.5/frame_rate # frame time that counts as dropped
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.trial_idx = -1
+        self.trial_log = []
+        self.current = None
+        self.finished = False
+        self.prefetch(0)
+
+    @property
+    def num_trials(self):
+        return len(self.trials)
+
+    def prefetch(self, idx):
+        if idx < self.num_trials:
+            self.pending = (idx, self.pool.submit(self.timed_compile, self.trials[idx]))
+        else:
+            self.pending = None
+
+    def timed_compile(self, trial):
+        start_time = time.perf_counter()
+        compiled = self.compile_fn(trial)
+        compiled['compile_s'] = time.perf_counter()-start_time
+        return compiled
+
+    @property
+    def has_next(self):
+        return self.pending is not None
+
+    def next_ready(self):
+        return self.pending is not None and self.pending[1].done()
+
+    def next_trial(self):
+        # compiled course for the next trial; only blocks if the worker is behind
+        idx, future = self.pending
+        wait_start = time.perf_counter()
+        compiled = future.result()
+        self.trial_idx = idx
+        self.current = {
+            'trial': idx,
+            'name': self.trials[idx]['name'],
+            'compile_s': compiled['compile_s'],
+            'wait_s': time.perf_counter()-wait_start,
+        }
+        self.prefetch(idx+1)
+        return compiled
+
+    def start_trial(self, start_time, swap_s=0.0):
+        self.current['swap_s'] = swap_s
+        self.current['start_time'] = start_time
+        self.num_frames = 0
+        self.frame_time_sum = 0.0
+        self.frame_time_max = 0.0
+        self.num_dropped = 0
+
+    def update(self, frame_time):
+        self.num_frames += 1
+        self.frame_time_sum += frame_time
+        if frame_time > self.frame_time_max:
+            self.frame_time_max = frame_time
+        if frame_time > self.dropped_time:
+            self.num_dropped += 1
+
+    def end_trial(self, end_time, score=None):
+        record = self.current
+        record['end_time'] = end_time
+        record['duration'] = end_time-record['start_time']
+        record['num_frames'] = self.num_frames
+        record['mean_frame_ms'] = 1000*self.frame_time_sum/self.num_frames if self.num_frames else None
+        record['max_frame_ms'] = 1000*self.frame_time_max
+        record['dropped_frames'] = self.num_dropped
+        record['score'] = score
+        self.trial_log.append(record)
+        self.current = None
+        if not(self.has_next):
+            self.finished = True
+        return record
+
+    def save(self, fname):
+        with open(fname,'w') as f:
+            json.dump(self.trial_log, f, indent=2, default=float)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
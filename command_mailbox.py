@@ -0,0 +1,79 @@
+import time
+import numpy as np
+
+# keyboard commands through shared memory: a ring of fixed-size records and a
+# shared write count, so the servo loop's check is one integer comparison and
+# no syscall; payloads that don't fit a record (dicts, tables, file names) go
+# through a pipe that the loop only reads when a record says so
+#
+# single producer (the game) and single consumer (the keyboard process)
+
+COMMAND_DTYPE = np.dtype([
+    ('command','u2'), # index into the config's command list
+    ('kind','u1'), # payload: 0 none, 1 int, 2 float, 3 piped
+    ('value','f8'), # int/float payload, e.g. stop_recording's ms
+])
+NO_DATA, INT_DATA, FLOAT_DATA, PIPED_DATA = range(4)
+
+class CommandMailbox(object):
+    def __init__(self, mp_context, commands, capacity=64):
+        self.commands = list(commands)
+        self.command_ids = {command: idx for idx, command in enumerate(self.commands)}
+        self.capacity = capacity
+        self.buffer = mp_context.RawArray('b', capacity*COMMAND_DTYPE.itemsize)
+        self.write_seq = mp_context.RawValue('Q', 0) # records published
+        self.read_seq_shared = mp_context.RawValue('Q', 0) # records consumed
+        self.pipe_recv, self.pipe_send = mp_context.Pipe(duplex=False)
+        self.attach()
+
+    def attach(self):
+        self.records = np.frombuffer(self.buffer, dtype=COMMAND_DTYPE)
+        self.read_seq = self.read_seq_shared.value # consumer's own copy
+
+    def __getstate__(self):
+        # to the child process without the numpy view, rebuilt on arrival
+        state = dict(self.__dict__)
+        del state['records']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    def send(self, command, data=None):
+        # producer: record and count first, then the payload (if piped); the
+        # loop only reads the pipe after the record, so a payload larger than
+        # the pipe buffer written first would block here forever
+        if command not in self.command_ids:
+            return False
+        if data is None:
+            kind, value = NO_DATA, 0.0
+        elif type(data) in [int, float]:
+            kind, value = (INT_DATA if type(data) == int else FLOAT_DATA), data
+        else:
+            kind, value = PIPED_DATA, 0.0
+        seq = self.write_seq.value
+        while seq-self.read_seq_shared.value >= self.capacity:
+            time.sleep(0.0005) # ring full, the keyboard loop is behind
+        self.records[seq%self.capacity] = (self.command_ids[command], kind, value)
+        self.write_seq.value = seq+1
+        if kind == PIPED_DATA:
+            self.pipe_send.send(data) # drained by the loop's recv as it goes
+        return True
+
+    def receive(self):
+        # consumer: only after write_seq.value != read_seq
+        record = self.records[self.read_seq%self.capacity]
+        kind = record['kind']
+        if kind == NO_DATA:
+            data = None
+        elif kind == INT_DATA:
+            data = int(record['value'])
+        elif kind == FLOAT_DATA:
+            data = float(record['value'])
+        else:
+            data = self.pipe_recv.recv() # waits for a payload still being sent
+        command = self.commands[record['command']]
+        self.read_seq += 1
+        self.read_seq_shared.value = self.read_seq
+        return command, data
@@ -0,0 +1,61 @@
+import os, time, yaml, queue, threading
+
+# polls config files from a background thread: a stat per file per interval,
+# a yaml parse only when the mtime moved; changed keys are handed over as
+# (name, {key: value}) for the game to apply between frames
+
+class ConfigWatcher(object):
+    def __init__(self, interval=0.5):
+        self.interval = interval # s between polls
+        self.files = {}
+        self.changes = queue.Queue()
+        self.running = False
+
+    def watch(self, name, path, config):
+        self.files[name] = {'path': path, 'mtime': self.mtime(path), 'config': dict(config)}
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None # mid-save (editors that rename over the file)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.watch_loop, name='config_watch', daemon=True)
+        self.thread.start()
+
+    def watch_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            for name in self.files:
+                self.check(name)
+
+    def check(self, name):
+        watched = self.files[name]
+        mtime = self.mtime(watched['path'])
+        if mtime is None or mtime == watched['mtime']:
+            return
+        watched['mtime'] = mtime
+        try:
+            with open(watched['path']) as f:
+                config = yaml.load(f, Loader=yaml.FullLoader)
+        except (OSError, yaml.YAMLError) as error:
+            print('Config '+watched['path']+' not reloaded: '+str(error).splitlines()[0])
+            return
+        if not(isinstance(config, dict)):
+            return
+        diff = {key: value for key, value in config.items() if watched['config'].get(key) != value}
+        watched['config'] = config
+        if diff:
+            self.changes.put((name, diff))
+
+    def get_changes(self):
+        # render thread: cheap when nothing changed
+        changes = []
+        while not(self.changes.empty()):
+            changes.append(self.changes.get_nowait())
+        return changes
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,204 @@
+import numpy as np
+from scipy.interpolate import PchipInterpolator as pci
+
+def gen_course_path(targets=[0,0,25,-35,15,-15,0,0],
+        times=[0,0.5,2,3.5,5,6.5,8,8.5], speed=0.25, step_size=0.01):
+    ypos = speed*np.array(times)
+    course_interp = pci(ypos,targets)
+    ypos_out = np.arange(ypos[0],ypos[-1]+step_size,step_size)
+    angle_out = course_interp(ypos_out)
+    return ypos_out, angle_out
+
+def build_course(targets=[25,-35,15,-15,30], target_time_spacing=1.0,
+        start_end_time_spacing=0.5):
+    # pad the targets with neutral lead-in/lead-out points, as MarbleGame does
+    target_times = np.arange(target_time_spacing,
+        target_time_spacing*(len(targets)+1),
+        target_time_spacing)[:len(targets)]
+    course_start_end_targets = [0,0]
+    course_start_times = [0,start_end_time_spacing]
+    course_end_times = [target_time_spacing,target_time_spacing+start_end_time_spacing]
+    course_targets = np.concatenate([course_start_end_targets,
+        targets,course_start_end_targets])
+    course_times = np.concatenate([course_start_times,
+        course_start_times[1]+np.array(target_times),
+        target_times[-1]+np.array(course_end_times)])
+    return course_targets, course_times
+
+def gen_course_vertices(course_y_raw, course_angle_raw, course_rad,
+        course_angle_width=15, endcap_points=10):
+    # outline of the course band on the trough, with rounded end caps
+    course_angles_lh = np.deg2rad(course_angle_raw-0.5*course_angle_width)
+    course_xs_lh = course_rad*np.sin(course_angles_lh)
+    course_angles_rh = np.deg2rad(course_angle_raw+0.5*course_angle_width)
+    course_xs_rh = course_rad*np.sin(course_angles_rh)
+    endcap_angles_bottom = np.linspace(course_angles_rh[0],course_angles_lh[0],endcap_points)[1:-1]
+    endcap_angles_top = np.linspace(course_angles_lh[-1],course_angles_rh[-1],endcap_points)[1:-1]
+    endcap_xs_bottom = course_rad*np.sin(endcap_angles_bottom)
+    endcap_xs_top = course_rad*np.sin(endcap_angles_top)
+
+    endcap_ys_bottom = np.linspace(course_y_raw[0],course_y_raw[0],endcap_points)[1:-1]
+    endcap_ys_top = np.linspace(course_y_raw[-1],course_y_raw[-1],endcap_points)[1:-1]
+
+    xs = np.concatenate([endcap_xs_bottom,course_xs_lh,endcap_xs_top,course_xs_rh[::-1]])
+    ys = np.concatenate([endcap_ys_bottom,course_y_raw,endcap_ys_top,course_y_raw[::-1]])
+    ys += course_rad*(1-np.cos(np.concatenate([endcap_angles_bottom,course_angles_lh,
+        endcap_angles_top,course_angles_rh[::-1]])))
+    return np.vstack([xs,ys]).T
+
+# uniformly sampled course table: constant-time angle/width at any course y
+class CourseIndex(object):
+    def __init__(self, course_y_raw, course_angle_raw, course_angle_width=15,
+            resolution=0.001):
+        course_y_raw = np.asarray(course_y_raw, dtype=float)
+        self.y_start = float(course_y_raw[0])
+        self.y_end = float(course_y_raw[-1])
+        self.num_samples = max(2, int(round((self.y_end-self.y_start)/resolution))+1)
+        self.resolution = (self.y_end-self.y_start)/(self.num_samples-1)
+        self.inv_resolution = 1/self.resolution if self.resolution > 0 else 0.0
+        self.ys = np.linspace(self.y_start,self.y_end,self.num_samples)
+        self.angles = np.interp(self.ys, course_y_raw, course_angle_raw)
+        self.widths = np.interp(self.ys, course_y_raw,
+            np.broadcast_to(course_angle_width, course_y_raw.shape))
+        # plain lists are faster than numpy for single lookups
+        self.angle_list = self.angles.tolist()
+        self.width_list = self.widths.tolist()
+
+    def contains(self, course_y):
+        return self.y_start <= course_y <= self.y_end
+
+    def lookup(self, course_y):
+        # linear interpolation between the two neighbouring samples
+        pos = (course_y-self.y_start)*self.inv_resolution
+        idx = int(pos)
+        if idx < 0:
+            return self.angle_list[0], self.width_list[0]
+        if idx >= self.num_samples-1:
+            return self.angle_list[-1], self.width_list[-1]
+        frac = pos-idx
+        angle = self.angle_list[idx]+frac*(self.angle_list[idx+1]-self.angle_list[idx])
+        width = self.width_list[idx]+frac*(self.width_list[idx+1]-self.width_list[idx])
+        return angle, width
+
+    def lookup_array(self, course_ys):
+        pos = np.clip((np.asarray(course_ys)-self.y_start)*self.inv_resolution,
+            0, self.num_samples-1)
+        idx = np.minimum(pos.astype(int), self.num_samples-2)
+        frac = pos-idx
+        angles = self.angles[idx]+frac*(self.angles[idx+1]-self.angles[idx])
+        widths = self.widths[idx]+frac*(self.widths[idx+1]-self.widths[idx])
+        return angles, widths
+
+# per-frame/per-sample scoring of a marble against a CourseIndex
+class CourseScorer(object):
+    def __init__(self, course_index, target_ys, target_window=0.05):
+        self.index = course_index
+        self.target_ys = [float(y) for y in target_ys]
+        self.num_targets = len(self.target_ys)
+        self.target_window = target_window # course y either side of a target
+        self.reset()
+
+    def reset(self):
+        self.time = 0.0
+        self.time_in_course = 0.0
+        self.time_on_course = 0.0
+        self.error = 0.0
+        self.on_course = False
+        self.sq_error_sum = 0.0
+        self.num_samples = 0
+        self.target_errors = [None]*self.num_targets
+        self.target_hits = [None]*self.num_targets
+        self.next_target = 0
+        self.events = []
+        self.finished = False
+
+    def update(self, course_y, marble_angle, dt):
+        # returns the signed angle error, None while outside the course
+        self.time += dt
+        if self.next_target < self.num_targets:
+            self.check_targets(course_y)
+        if course_y < self.index.y_start:
+            return None
+        if course_y > self.index.y_end:
+            if not(self.finished):
+                self.finished = True
+                self.events.append(('finish', None, self.time, None))
+            return None
+        angle, width = self.index.lookup(course_y)
+        self.error = marble_angle-angle
+        self.on_course = abs(self.error) <= 0.5*width
+        self.time_in_course += dt
+        if self.on_course:
+            self.time_on_course += dt
+        self.sq_error_sum += self.error*self.error
+        self.num_samples += 1
+
+        # closest approach while inside the current target window
+        if self.next_target < self.num_targets:
+            if course_y >= self.target_ys[self.next_target]-self.target_window:
+                abs_error = abs(self.error)
+                best = self.target_errors[self.next_target]
+                if best is None or abs_error < best[0]:
+                    self.target_errors[self.next_target] = (abs_error, width)
+        return self.error
+
+    def check_targets(self, course_y):
+        # close every target window the course has scrolled past
+        while (self.next_target < self.num_targets and
+                course_y > self.target_ys[self.next_target]+self.target_window):
+            best = self.target_errors[self.next_target]
+            hit = best is not None and best[0] <= 0.5*best[1]
+            self.target_hits[self.next_target] = hit
+            self.events.append(('hit' if hit else 'miss', self.next_target, self.time,
+                None if best is None else best[0]))
+            self.next_target += 1
+
+    def pop_events(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def summary(self):
+        return {
+            'rms_error': np.sqrt(self.sq_error_sum/self.num_samples) if self.num_samples else None,
+            'time_in_course': self.time_in_course,
+            'time_on_course': self.time_on_course,
+            'fraction_on_course': self.time_on_course/self.time_in_course if self.time_in_course else None,
+            'target_errors': [None if best is None else best[0] for best in self.target_errors],
+            'target_hits': list(self.target_hits),
+            'num_hits': sum([1 for hit in self.target_hits if hit]),
+        }
+
+def score_samples(course_index, course_ys, marble_angles, dts, target_ys, target_window=0.05):
+    # vectorized scoring of a whole trace (e.g. keyboard-rate samples)
+    course_ys = np.asarray(course_ys, dtype=float)
+    marble_angles = np.asarray(marble_angles, dtype=float)
+    dts = np.broadcast_to(np.asarray(dts, dtype=float), course_ys.shape)
+    inside = (course_ys >= course_index.y_start)&(course_ys <= course_index.y_end)
+    angles, widths = course_index.lookup_array(course_ys)
+    errors = np.where(inside, marble_angles-angles, np.nan)
+    on_course = inside&(np.abs(marble_angles-angles) <= 0.5*widths)
+    target_errors = []
+    target_hits = []
+    for target_y in target_ys:
+        window = inside&(np.abs(course_ys-target_y) <= target_window)
+        if window.any():
+            abs_errors = np.abs(errors[window])
+            best = np.argmin(abs_errors)
+            target_errors.append(abs_errors[best])
+            target_hits.append(bool(abs_errors[best] <= 0.5*widths[window][best]))
+        else:
+            target_errors.append(None)
+            target_hits.append(False)
+    time_in_course = dts[inside].sum()
+    return {
+        'errors': errors,
+        'on_course': on_course,
+        'rms_error': np.sqrt(np.nanmean(errors**2)) if inside.any() else None,
+        'time_in_course': time_in_course,
+        'time_on_course': dts[on_course].sum(),
+        'fraction_on_course': dts[on_course].sum()/time_in_course if time_in_course else None,
+        'target_errors': target_errors,
+        'target_hits': target_hits,
+        'num_hits': sum(target_hits),
+    }
@@ -0,0 +1,200 @@
+import os, time, yaml, argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from course import *
+from frame_log import HEADER_SIZE, write_log_header, read_log_header
+
+# a library of generated courses in one file: fixed-size index records sorted
+# by difficulty, then every sampled path back to back; both memory-mapped, so
+# a query is a binary search on difficulty and a course is one slice
+#
+# file layout: magic, json header padded to HEADER_SIZE, index records, paths
+# (float32 angles at the library's step, y = step*sample from 0)
+
+MAGIC = b'MHCOURSE'
+MAX_TARGETS = 16
+
+INDEX_DTYPE = np.dtype([
+    ('seed','u8'),
+    ('num_targets','u2'),
+    ('targets','f4',(MAX_TARGETS,)), # degrees, first num_targets used
+    ('target_time_spacing','f4'), # seconds
+    ('start_end_time_spacing','f4'), # seconds
+    ('course_angle_width','f4'), # degrees
+    ('duration','f4'), # seconds
+    ('path_offset','u8'), # samples into the path section
+    ('path_len','u4'),
+    ('peak_speed','f4'), # deg/s along the path at trough speed
+    ('mean_speed','f4'), # deg/s
+    ('peak_accel','f4'), # deg/s^2, path curvature in time
+    ('reversals','u2'), # direction changes
+    ('amplitude','f4'), # degrees, max-min
+    ('difficulty','f4'), # 0-1, mean percentile of the features above
+])
+
+# generator ranges, per course drawn uniformly
+GEN_DEFAULTS = {
+    'num_targets': [4,10],
+    'max_angle': 35, # degrees either side
+    'target_time_spacing': [0.75,1.5], # seconds
+    'start_end_time_spacing': 0.5, # seconds
+    'course_angle_width': [10,20], # degrees
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate a course library')
+    parser.add_argument('-n','--courses', help='Number of courses', type=int, default=5000)
+    parser.add_argument('-c','--config', help='Game config (trough speed)', default='demo')
+    parser.add_argument('-s','--seed', help='Base seed, course i uses seed+i', type=int, default=0)
+    parser.add_argument('--step', help='Path sample step (screen heights)', type=float, default=0.01)
+    parser.add_argument('-j','--workers', help='Worker processes', type=int, default=os.cpu_count())
+    parser.add_argument('-o','--output', help='Library file', default=os.path.join('config','course_library.courses'))
+    return parser.parse_args()
+
+def random_course(seed, gen=GEN_DEFAULTS):
+    rng = np.random.default_rng(seed)
+    num_targets = int(rng.integers(gen['num_targets'][0], gen['num_targets'][1]+1))
+    return {
+        'targets': rng.uniform(-gen['max_angle'], gen['max_angle'], num_targets).round(1).tolist(),
+        'target_time_spacing': float(rng.uniform(*gen['target_time_spacing'])),
+        'start_end_time_spacing': float(gen['start_end_time_spacing']),
+        'course_angle_width': float(rng.uniform(*gen['course_angle_width'])),
+    }
+
+def course_features(angles, speed, step):
+    # along-path kinematics of the pchip path, in time at trough speed
+    angle_speed = np.gradient(angles, step)*speed
+    angle_accel = np.gradient(angle_speed, step)*speed
+    moving = angle_speed[np.abs(angle_speed) > 1e-3]
+    return {
+        'peak_speed': np.abs(angle_speed).max(),
+        'mean_speed': np.abs(angle_speed).mean(),
+        'peak_accel': np.abs(angle_accel).max(),
+        'reversals': int(np.count_nonzero(np.diff(np.sign(moving)))),
+        'amplitude': angles.max()-angles.min(),
+    }
+
+def generate_chunk(job):
+    # worker: index records (offsets local to the chunk) and the paths
+    seeds, speed, step, gen = job
+    records = np.zeros(len(seeds), dtype=INDEX_DTYPE)
+    paths = []
+    offset = 0
+    for idx, seed in enumerate(seeds):
+        course = random_course(seed, gen)
+        course_targets, course_times = build_course(course['targets'],
+            course['target_time_spacing'], course['start_end_time_spacing'])
+        ys, angles = gen_course_path(course_targets, course_times, speed, step_size=step)
+        record = records[idx]
+        record['seed'] = seed
+        record['num_targets'] = len(course['targets'])
+        record['targets'][:len(course['targets'])] = course['targets']
+        record['target_time_spacing'] = course['target_time_spacing']
+        record['start_end_time_spacing'] = course['start_end_time_spacing']
+        record['course_angle_width'] = course['course_angle_width']
+        record['duration'] = course_times[-1]
+        record['path_offset'] = offset
+        record['path_len'] = len(angles)
+        for name, value in course_features(angles, speed, step).items():
+            record[name] = value
+        paths.append(angles.astype(np.float32))
+        offset += len(angles)
+    return records, np.concatenate(paths)
+
+def rank_difficulty(records):
+    # mean percentile over the features, narrower courses count as harder
+    features = [records['peak_speed'], records['peak_accel'],
+        records['reversals']/records['duration'], -records['course_angle_width']]
+    ranks = [np.argsort(np.argsort(feature, kind='stable'))/max(len(records)-1,1) for feature in features]
+    return np.mean(ranks, axis=0)
+
+def generate_library(fname, num_courses, speed, step=0.01, seed=0, gen=GEN_DEFAULTS,
+        workers=1, chunk_size=256):
+    seeds = np.arange(seed, seed+num_courses, dtype=np.uint64)
+    jobs = [(seeds[start:start+chunk_size], speed, step, gen)
+        for start in range(0, num_courses, chunk_size)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(generate_chunk, jobs))
+    else:
+        results = [generate_chunk(job) for job in jobs]
+
+    # chunk-local offsets to global, then sort the index by difficulty
+    records = []
+    paths = []
+    offset = 0
+    for chunk_records, chunk_paths in results:
+        chunk_records['path_offset'] += offset
+        offset += len(chunk_paths)
+        records.append(chunk_records)
+        paths.append(chunk_paths)
+    records = np.concatenate(records)
+    records['difficulty'] = rank_difficulty(records)
+    records = records[np.argsort(records['difficulty'], kind='stable')]
+    with open(fname, 'wb') as f:
+        write_log_header(f, {'dtype': INDEX_DTYPE.descr, 'num_courses': len(records),
+            'num_path_samples': offset, 'trough_speed': speed, 'step': step, 'seed': seed,
+            'generator': gen, 'created': time.strftime('%Y-%m-%dT%H:%M:%S')}, magic=MAGIC)
+        f.write(records.tobytes())
+        for chunk_paths in paths:
+            f.write(chunk_paths.tobytes())
+    return len(records)
+
+class CourseLibrary(object):
+    def __init__(self, fname):
+        self.fname = fname
+        self.header = read_log_header(fname, magic=MAGIC)
+        self.num_courses = self.header['num_courses']
+        self.trough_speed = self.header['trough_speed']
+        self.step = self.header['step']
+        self.index = np.memmap(fname, dtype=INDEX_DTYPE, mode='r',
+            offset=HEADER_SIZE, shape=(self.num_courses,))
+        self.paths = np.memmap(fname, dtype=np.float32, mode='r',
+            offset=HEADER_SIZE+self.num_courses*INDEX_DTYPE.itemsize,
+            shape=(self.header['num_path_samples'],))
+        self.difficulty = self.index['difficulty'] # sorted
+
+    def __len__(self):
+        return self.num_courses
+
+    def query(self, min_difficulty=0.0, max_difficulty=1.0):
+        # course ranks in [min, max] difficulty, as a range
+        start = int(np.searchsorted(self.difficulty, min_difficulty, side='left'))
+        end = int(np.searchsorted(self.difficulty, max_difficulty, side='right'))
+        return range(start, end)
+
+    def pick(self, min_difficulty=0.0, max_difficulty=1.0, rng=None):
+        ranks = self.query(min_difficulty, max_difficulty)
+        if len(ranks) == 0:
+            raise ValueError('No course between difficulty '+str(min_difficulty)+' and '+str(max_difficulty))
+        rng = rng if rng is not None else np.random.default_rng()
+        return ranks[int(rng.integers(len(ranks)))]
+
+    def path(self, rank):
+        record = self.index[rank]
+        angles = self.paths[record['path_offset']:record['path_offset']+record['path_len']]
+        return self.step*np.arange(len(angles)), angles
+
+    def trial(self, rank):
+        # a block trial (see block.load_block), stored path included
+        record = self.index[rank]
+        return {
+            'name': 'library_'+str(int(record['seed'])),
+            'targets': [round(float(target),1) for target in record['targets'][:record['num_targets']]],
+            'target_time_spacing': float(record['target_time_spacing']),
+            'start_end_time_spacing': float(record['start_end_time_spacing']),
+            'course_angle_width': float(record['course_angle_width']),
+            'difficulty': float(record['difficulty']),
+            'library_path': self.path(rank),
+            'library_speed': self.trough_speed,
+            'library_step': self.step,
+        }
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(os.path.join('config',args.config+'.yml')) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    start_time = time.time()
+    num_courses = generate_library(args.output, args.courses, config['trough_speed'],
+        args.step, args.seed, workers=args.workers)
+    print(str(num_courses)+' courses in '+str(round(time.time()-start_time,2))+' s, written to '+args.output)
@@ -3,11 +3,14 @@ import numpy as np
 from psychopy import core, event, visual
 from psychopy.iohub.client import launchHubServer
 from keyboard import *
+from startup import *
+from static_layer import *
 
-parser = argparse.ArgumentParser(description='Marble game parameters')
-parser.add_argument('-c','--config', help='Configuration file',default='wedge_demo')
-parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
-args = parser.parse_args()
+def parse_args():
+    parser = argparse.ArgumentParser(description='Marble game parameters')
+    parser.add_argument('-c','--config', help='Configuration file',default='wedge_demo')
+    parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
+    return parser.parse_args()
 
 def gen_key_shape(win, width=0.1, height=0.05,
         corner_rad=0.02, line_width=2.5, corner_pts=5,
@@ -67,7 +70,7 @@ def gen_wedge_shape(win, task_rad=1.0, width=0.1, height=0.05,
 
 class WedgeGame:
 
-    def __init__(self):
+    def __init__(self, args, kb=None, win_options={}, config_overrides={}):
         # load command line args
         self.args = args
 
@@ -79,12 +82,18 @@ class WedgeGame:
         except:
             print('Configuration file '+self.args.config+'.yml not found')
             sys.exit(1)
+        self.config.update(config_overrides)
+
+        self.startup = StartupTimer()
+
+        # servo bring-up runs in the keyboard process while the window opens
+        self.kb = kb if kb is not None else KeyboardWrapper(wait=False)
+        self.startup.mark('keyboard_process')
 
         self.win = visual.Window(size=(self.config['screen_width'], self.config['screen_height']),
                      color=self.config['bg_color'], units='height',
-                     fullscr=self.args.fullscreen)
-
-        self.kb = KeyboardWrapper()
+                     fullscr=self.args.fullscreen, **win_options)
+        self.startup.mark('window')
 
         # add key controls
         event.globalKeys.add(key='q', modifiers=['alt'], func=self.quit)
@@ -124,6 +133,8 @@ class WedgeGame:
 
         self.target_oris = self.config['target_pos']
         self.num_targets = len(self.target_oris)
+        self.target_hit_color = self.config.get('target_hit_color',self.cue_color)
+        self.target_dwell_ms = self.config.get('target_dwell_ms',300)
 
         self.targets = [gen_wedge_shape(self.win, self.task_rad,
             width=self.target_width-2*self.target_corner_rad,
@@ -139,6 +150,13 @@ class WedgeGame:
             xpos = self.task_rad*np.sin(task_ori_rad)
             target.pos = (xpos,ypos)
 
+        # targets in their resting color, captured before any can be hit;
+        # acquired ones are drawn over the layer
+        self.static_layer = None
+        if self.config.get('static_layer', False):
+            self.static_layer = StaticLayer(self.win, self.targets)
+            self.static_layer.prepare()
+
         # game logic
         self.game_running = True
         # self.input_direction = 0
@@ -155,6 +173,38 @@ class WedgeGame:
         self.display_hand = 'lh' # lh or rh
         self.kb_neutral_angle = self.kb.config['neutral_angle']
 
+        # hit detection runs in the keyboard process at servo rate
+        self.target_events = []
+        self.target_hits = [False]*self.num_targets
+        self.kb.set_targets(self.target_table())
+        self.startup.mark('wedge')
+
+    def target_table(self):
+        # screen target oris to intervals of the displayed finger's angle
+        if self.display_hand == 'lh':
+            motor_idx = 1
+            sign = -1
+        else:
+            motor_idx = 0
+            sign = 1
+        half_width = 0.5*self.target_size
+        targets = [[self.kb_neutral_angle+sign*(ori-half_width)/self.angle_gain,
+                    self.kb_neutral_angle+sign*(ori+half_width)/self.angle_gain]
+                   for ori in self.target_oris]
+        return {'finger': motor_idx, 'targets': targets, 'dwell_ms': self.target_dwell_ms}
+
+    def update_targets(self):
+        # servo-timed events since the last frame; acquired targets highlighted
+        for target_event in self.kb.get_events():
+            self.target_events.append(target_event)
+            kind, target_idx, time_ms, value = target_event
+            if kind == 'acquire':
+                self.target_hits[target_idx] = True
+                self.targets[target_idx].fillColor = self.target_hit_color
+            elif kind == 'exit' and self.target_hits[target_idx]:
+                self.target_hits[target_idx] = False
+                self.targets[target_idx].fillColor = self.target_color
+
     # def check_keys(self):
     #     events = self.kb.getKeys()
     #     for kbe in events:
@@ -208,14 +258,31 @@ class WedgeGame:
         self.wedge.ori = self.task_ori
         self.wedge.pos = (task_xpos, task_ypos)
 
+    def draw_frame(self):
+        if self.static_layer is not None:
+            self.static_layer.draw()
+            for target_idx, target in enumerate(self.targets):
+                if self.target_hits[target_idx]:
+                    target.draw()
+        else:
+            for target in self.targets:
+                target.draw()
+        self.wedge.draw()
+
+    def finish_startup(self):
+        # the only wait on the keyboard, right before the first frame
+        self.kb.wait_ready()
+        self.startup.mark('keyboard_wait')
+        print(self.startup.report(self.kb.startup_report()))
+
     def run_main_loop(self):
+        self.finish_startup()
         while self.game_running:
             self.update_frame_time()
             # self.check_keys()
             self.update_wedge()
-            for target in self.targets:
-                target.draw()
-            self.wedge.draw()
+            self.update_targets()
+            self.draw_frame()
             self.win.flip()
 
     def quit(self):
@@ -223,5 +290,5 @@ class WedgeGame:
         core.quit()
 
 if __name__ == '__main__':
-    game = WedgeGame()
+    game = WedgeGame(parse_args())
     game.run_main_loop()
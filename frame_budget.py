@@ -0,0 +1,61 @@
+# geometry detail and fbo render scale per level, finest first
+DETAIL_LEVELS = [
+    {'num_pts': 30, 'endcap_points': 10, 'course_step': 0.01, 'grating_res': 1024, 'render_scale': 1.0},
+    {'num_pts': 20, 'endcap_points': 8, 'course_step': 0.02, 'grating_res': 512, 'render_scale': 1.0},
+    {'num_pts': 20, 'endcap_points': 8, 'course_step': 0.02, 'grating_res': 512, 'render_scale': 0.75},
+    {'num_pts': 12, 'endcap_points': 5, 'course_step': 0.04, 'grating_res': 256, 'render_scale': 0.5},
+]
+
+# watches recent frames: steps detail down when the work per frame nears the
+# budget or frames are dropped, back up after a long stretch of headroom
+class FrameBudget(object):
+    def __init__(self, frame_rate=60.0, levels=DETAIL_LEVELS, level=0, window=30,
+            high=0.85, low=0.5, dropped=1.5, cooldown=180):
+        self.budget = 1.0/frame_rate
+        self.levels = levels
+        self.level = min(max(level,0),len(levels)-1)
+        self.window = window
+        self.high = high*self.budget # mean work time that steps down
+        self.low = low*self.budget # mean work time that allows a step up
+        self.dropped = dropped*self.budget # frame time that counts as dropped
+        self.cooldown = cooldown # frames at a level before stepping up
+        self.work_history = [0.0]*window # ring buffer
+        self.reset()
+
+    def reset(self):
+        for idx in range(self.window):
+            self.work_history[idx] = 0.0
+        self.work_sum = 0.0
+        self.history_idx = 0
+        self.num_dropped = 0
+        self.frames_at_level = 0
+
+    @property
+    def detail(self):
+        return self.levels[self.level]
+
+    def update(self, work_time, frame_time):
+        # returns True when the level changed
+        idx = self.history_idx
+        self.work_sum += work_time-self.work_history[idx]
+        self.work_history[idx] = work_time
+        self.history_idx = (idx+1)%self.window
+        if frame_time > self.dropped:
+            self.num_dropped += 1
+        self.frames_at_level += 1
+        if self.frames_at_level < self.window:
+            return False
+
+        mean_work = self.work_sum/self.window
+        if (mean_work > self.high or self.num_dropped > 1) and self.level < len(self.levels)-1:
+            self.level += 1
+            self.reset()
+            return True
+        if (mean_work < self.low and self.num_dropped == 0 and self.level > 0
+                and self.frames_at_level >= self.cooldown):
+            self.level -= 1
+            self.reset()
+            return True
+        if self.frames_at_level%self.window == 0:
+            self.num_dropped = 0 # dropped frames count per window
+        return False
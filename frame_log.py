@@ -0,0 +1,134 @@
+import os, json, time, threading
+import numpy as np
+
+# per-frame game state: the render loop copies one fixed-size record into a
+# preallocated ring, a writer thread appends whole batches to a binary file
+#
+# file layout: magic, then a json header padded to HEADER_SIZE bytes (dtype,
+# record count, dropped count, game info), then the raw records
+
+MAGIC = b'MHFRAMES'
+HEADER_SIZE = 4096 # bytes, magic included; records start here
+
+def frame_dtype(num_fingers, num_lanes=0):
+    fields = [
+        ('frame','u4'), # frame count since logging started
+        ('time','f8'), # game clock (s) at the start of the frame
+        ('frame_time','f4'), # s
+        ('course_ypos','f4'), # screen heights
+        ('trial','i2'), # block trial, -1 outside a block
+        ('marble_angle','f4'), # screen degrees
+        ('marble_velocity','f4'), # screen degrees/s
+    ]
+    if num_fingers:
+        fields += [('kb_pos','f4',(num_fingers,)), # keyboard sample used this frame
+                   ('kb_vel','f4',(num_fingers,))]
+    if num_lanes:
+        fields.append(('lane_angles','f4',(num_lanes,)))
+    return np.dtype(fields)
+
+def write_log_header(f, header, magic=MAGIC):
+    header = json.dumps(header).encode()
+    if len(magic)+len(header) > HEADER_SIZE:
+        raise ValueError('Log header over '+str(HEADER_SIZE)+' bytes')
+    f.seek(0)
+    f.write(magic+header.ljust(HEADER_SIZE-len(magic)))
+
+def read_log_header(fname, magic=MAGIC):
+    with open(fname, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(fname+' is not a '+magic.decode()+' file')
+        return json.loads(f.read(HEADER_SIZE-len(magic)).decode())
+
+def save_records(fname, records, info={}):
+    # a whole record array in the same layout (e.g. a servo recording)
+    with open(fname, 'wb') as f:
+        write_log_header(f, {'dtype': records.dtype.descr, 'num_records': len(records),
+            'num_dropped': 0, 'capacity': len(records),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'info': dict(info)})
+        f.write(np.ascontiguousarray(records).tobytes())
+
+class FrameLogger(object):
+    def __init__(self, fname, dtype, capacity=4096, flush_interval=0.1, info={}):
+        self.fname = fname
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.flush_interval = flush_interval # s between writer batches
+        self.ring = np.zeros(capacity, dtype=self.dtype)
+        self.info = dict(info)
+        # single producer (render loop) and consumer (writer): each index is
+        # only ever advanced by its own side
+        self.write_idx = 0
+        self.read_idx = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self.file = open(fname, 'wb')
+        self.write_header()
+        self.running = True
+        self.wake = threading.Event()
+        self.writer = threading.Thread(target=self.writer_loop, name='frame_log', daemon=True)
+        self.writer.start()
+
+    def header(self):
+        return {
+            'dtype': self.dtype.descr,
+            'num_records': self.num_written,
+            'num_dropped': self.num_dropped,
+            'capacity': self.capacity,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'info': self.info,
+        }
+
+    def write_header(self):
+        write_log_header(self.file, self.header())
+
+    def log(self, record):
+        # render thread: one tuple in dtype field order, no i/o; drops (and
+        # counts) the record rather than overwrite what the writer hasn't saved
+        idx = self.write_idx
+        if idx-self.read_idx >= self.capacity:
+            self.num_dropped += 1
+            return False
+        self.ring[idx%self.capacity] = record
+        self.write_idx = idx+1
+        return True
+
+    def writer_loop(self):
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        # contiguous runs of the ring straight to the file
+        end = self.write_idx
+        start = self.read_idx
+        while start < end:
+            ring_start = start%self.capacity
+            count = min(end-start, self.capacity-ring_start)
+            self.file.write(self.ring[ring_start:ring_start+count].tobytes())
+            start += count
+            self.read_idx = start
+        self.num_written = self.read_idx
+
+    def close(self):
+        if not(self.running):
+            return
+        self.running = False
+        self.wake.set()
+        self.writer.join()
+        self.flush()
+        self.write_header()
+        self.file.close()
+        if self.num_dropped:
+            print('Frame log: '+str(self.num_dropped)+' records dropped, writer fell behind')
+
+def load_frame_log(fname):
+    # header and a read-only memmap of the records; an unclosed log (crash)
+    # is sized from the file instead of the header count
+    header = read_log_header(fname)
+    dtype = np.dtype([tuple(field) for field in header['dtype']])
+    num_records = (os.path.getsize(fname)-HEADER_SIZE)//dtype.itemsize
+    if num_records == 0:
+        return header, np.zeros(0, dtype=dtype)
+    records = np.memmap(fname, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(num_records,))
+    return header, records
@@ -0,0 +1,20 @@
+import gc
+
+# keep the cyclic garbage collector out of the frame loop: everything alive
+# at trial start is frozen (never rescanned) and collection is deferred to
+# the inter-trial interval, or a timer when there are no trials; refcounting
+# still frees most per-frame garbage
+
+def freeze_gc():
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+
+def release_gc():
+    gc.unfreeze()
+    gc.enable()
+    gc.collect()
+
+def collect_between_trials():
+    release_gc()
+    freeze_gc()
@@ -0,0 +1,94 @@
+import numpy as np
+from frame_log import *
+from marbles import *
+
+# a recorded demonstration replayed as a translucent marble beside the live one;
+# the frame log stays memory-mapped and is read through a cursor that only
+# moves forward, so a frame touches two records and a long log costs no memory
+
+SEEK_CHUNK = 4096 # records scanned at a time when seeking a block trial
+
+class GhostMarble(object):
+    def __init__(self, win, fname, radius=0.03, trough_rad=0.5, base_ypos=-0.35,
+            color=[0.3,0.3,0.6], border_color=[0.0,0.0,0.6], opacity=0.4, rota_coef=1):
+        self.header, records = load_frame_log(fname)
+        if self.header['info'].get('multi_marble') or len(records) < 2:
+            raise ValueError(fname+' has no single-marble recording to replay')
+        # field views of the memmap, nothing is copied
+        self.times = records['time']
+        self.angles = records['marble_angle']
+        self.velocities = records['marble_velocity']
+        self.trials = records['trial']
+        self.last = len(records)-1
+        self.sprite = MarbleSprite(win, radius=radius, trough_rad=trough_rad,
+            base_ypos=base_ypos, color=color, border_color=border_color,
+            rota_coef=rota_coef, opacity=opacity, shadow=False)
+        self.cursor = 0
+        self.offset = 0.0 # game clock minus recording clock
+        self.end_time = float(self.times[self.last])
+        self.visible = False
+
+    def restart(self, now, trial=-1):
+        # course (re)started at game time now: play the recording from where its
+        # own course started, the clock origin or the first frame of the trial
+        if trial < 0:
+            self.cursor = 0
+            self.offset = now
+            self.end_time = float(self.times[self.last])
+            self.visible = True
+            return
+        start = self.seek_trial(trial)
+        self.visible = start is not None
+        if self.visible:
+            self.cursor = start
+            self.offset = now-float(self.times[start])
+            end = self.seek_trial_end(trial, start)
+            self.end_time = float(self.times[end])
+
+    def seek_trial(self, trial):
+        # forward from the cursor (trials run in order), wrapping once
+        for start in [self.cursor, 0]:
+            for chunk_start in range(start, self.last+1, SEEK_CHUNK):
+                hits = np.flatnonzero(self.trials[chunk_start:chunk_start+SEEK_CHUNK] == trial)
+                if len(hits):
+                    return chunk_start+int(hits[0])
+        return None
+
+    def seek_trial_end(self, trial, start):
+        for chunk_start in range(start, self.last+1, SEEK_CHUNK):
+            misses = np.flatnonzero(self.trials[chunk_start:chunk_start+SEEK_CHUNK] != trial)
+            if len(misses):
+                return chunk_start+int(misses[0])-1
+        return self.last
+
+    def update(self, now, frame_time, trough_speed):
+        if not(self.visible):
+            return
+        t = now-self.offset
+        if t > self.end_time:
+            self.visible = False
+            return
+        # usually one record per frame; a long jump (frame drop) searches
+        times = self.times
+        cursor = self.cursor
+        steps = 0
+        while cursor < self.last and times[cursor+1] <= t:
+            cursor += 1
+            steps += 1
+            if steps == 8:
+                cursor = min(cursor+int(np.searchsorted(times[cursor:], t, side='right'))-1, self.last)
+                break
+        self.cursor = cursor
+        if cursor == self.last or t <= times[cursor]:
+            angle = float(self.angles[cursor])
+            velocity = float(self.velocities[cursor])
+        else:
+            t0 = times[cursor]
+            frac = (t-t0)/(times[cursor+1]-t0)
+            angle = float(self.angles[cursor]+frac*(self.angles[cursor+1]-self.angles[cursor]))
+            velocity = float(self.velocities[cursor]+frac*(self.velocities[cursor+1]-self.velocities[cursor]))
+        self.sprite.update(angle, velocity, frame_time, trough_speed)
+
+    def draw(self):
+        if self.visible:
+            self.sprite.draw()
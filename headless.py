@@ -0,0 +1,46 @@
+import os, time, shutil, subprocess
+
+# offscreen rendering helpers; call before psychopy/pyglet are imported
+
+def use_software_gl():
+    # force Mesa's llvmpipe rasterizer (GPU-less machines, reproducible numbers)
+    os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+    os.environ.setdefault('GALLIUM_DRIVER','llvmpipe')
+
+def start_virtual_display(width=1280, height=720, timeout=10.0):
+    # start Xvfb if there is no display to open a window on
+    if os.environ.get('DISPLAY') or os.name == 'nt':
+        return None
+    if shutil.which('Xvfb') is None:
+        print('No DISPLAY and Xvfb not found, install xvfb for headless rendering')
+        return None
+    display_num = 99
+    while os.path.exists('/tmp/.X11-unix/X'+str(display_num)):
+        display_num += 1
+    xvfb = subprocess.Popen(['Xvfb', ':'+str(display_num),
+        '-screen', '0', str(width)+'x'+str(height)+'x24', '-nolisten', 'tcp'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start_time = time.time()
+    while not os.path.exists('/tmp/.X11-unix/X'+str(display_num)):
+        if xvfb.poll() is not None or time.time()-start_time > timeout:
+            print('Xvfb failed to start')
+            return None
+        time.sleep(0.05)
+    os.environ['DISPLAY'] = ':'+str(display_num)
+    return xvfb
+
+def stop_virtual_display(xvfb):
+    if xvfb is not None:
+        xvfb.terminate()
+        xvfb.wait()
+
+def headless_win_options():
+    # no vsync and no refresh-rate probing, frames run as fast as they render
+    return {'waitBlanking': False, 'checkTiming': False, 'allowGUI': False}
+
+def gl_renderer():
+    try:
+        from pyglet.gl import gl_info
+        return gl_info.get_renderer()
+    except Exception:
+        return None
@@ -0,0 +1,66 @@
+import time
+from collections import namedtuple
+
+# key press/release sources for the spoof games, all returning KeyEvent
+# lists from getKeys() like the iohub keyboard device
+
+KeyEvent = namedtuple('KeyEvent', ['key','type','time'])
+
+# reads the window's own (pyglet) event queue in-process: no server process,
+# no ipc per poll; times are perf_counter at the moment the event is pulled
+class WindowKeys(object):
+    def __init__(self, win, keys=None, clock=time.perf_counter):
+        self.win = win
+        self.keys = keys # None: every key
+        self.clock = clock
+        self.events = []
+        # stacked above psychopy's own handlers, which still see every event
+        win.winHandle.push_handlers(on_key_press=self.on_key_press,
+            on_key_release=self.on_key_release)
+
+    def key_name(self, symbol):
+        from pyglet.window import key
+        return key.symbol_string(symbol).lower()
+
+    def on_key_press(self, symbol, modifiers):
+        name = self.key_name(symbol)
+        if self.keys is None or name in self.keys:
+            self.events.append(KeyEvent(name,'KEYBOARD_PRESS',self.clock()))
+
+    def on_key_release(self, symbol, modifiers):
+        name = self.key_name(symbol)
+        if self.keys is None or name in self.keys:
+            self.events.append(KeyEvent(name,'KEYBOARD_RELEASE',self.clock()))
+
+    def getKeys(self):
+        # pump the os queue now rather than waiting for the next flip
+        self.win.winHandle.dispatch_events()
+        events = self.events
+        self.events = []
+        return events
+
+    def close(self):
+        self.win.winHandle.remove_handlers(on_key_press=self.on_key_press,
+            on_key_release=self.on_key_release)
+
+# the previous input path: an iohub server process, polled over ipc
+class IohubKeys(object):
+    def __init__(self):
+        from psychopy.iohub.client import launchHubServer
+        self.io = launchHubServer()
+        self.keyboard = self.io.devices.keyboard
+
+    def getKeys(self):
+        return self.keyboard.getKeys()
+
+    def close(self):
+        self.io.quit()
+
+KEY_BACKENDS = ['window','iohub']
+
+def open_key_input(win, backend='window', keys=None):
+    if backend == 'window':
+        return WindowKeys(win, keys)
+    elif backend == 'iohub':
+        return IohubKeys()
+    raise ValueError('Unknown key backend '+str(backend)+', use one of '+str(KEY_BACKENDS))
@@ -0,0 +1,113 @@
+import time, json, ctypes, argparse, platform
+import numpy as np
+from headless import *
+from key_input import *
+
+# startup time, empty-poll cost and press-to-getKeys latency per key backend;
+# key events are injected through the X server (XTest), so X11 only
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Key input backend benchmark')
+    parser.add_argument('-b','--backends', help='Backends to compare', nargs='+',
+        default=KEY_BACKENDS, choices=KEY_BACKENDS)
+    parser.add_argument('-n','--presses', help='Injected presses per backend', type=int, default=100)
+    parser.add_argument('-o','--output', help='Results file (json)', default='key_input_benchmark.json')
+    return parser.parse_args()
+
+# synthetic key presses at the X server, as a real keyboard would arrive
+class XKeyInjector(object):
+    def __init__(self, win):
+        self.xlib = ctypes.cdll.LoadLibrary('libX11.so.6')
+        self.xtst = ctypes.cdll.LoadLibrary('libXtst.so.6')
+        self.xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self.xlib.XStringToKeysym.restype = ctypes.c_ulong
+        self.display = ctypes.c_void_p(self.xlib.XOpenDisplay(None))
+        # keyboard focus to the game window
+        self.xlib.XSetInputFocus(self.display, ctypes.c_ulong(win.winHandle._window), 1, 0)
+        self.xlib.XFlush(self.display)
+
+    def keycode(self, key):
+        keysym = self.xlib.XStringToKeysym(key.encode())
+        return self.xlib.XKeysymToKeycode(self.display, ctypes.c_ulong(keysym))
+
+    def send(self, key, press):
+        self.xtst.XTestFakeKeyEvent(self.display, self.keycode(key), press, 0)
+        self.xlib.XFlush(self.display)
+
+    def close(self):
+        self.xlib.XCloseDisplay(self.display)
+
+def wait_for(key_input, key, event_type, timeout=1.0):
+    # busy-poll getKeys, returns the time the event was first seen
+    start_time = time.perf_counter()
+    while time.perf_counter()-start_time < timeout:
+        for kbe in key_input.getKeys():
+            if kbe.key == key and kbe.type == event_type:
+                return time.perf_counter()
+    return None
+
+def run_backend(backend, presses=100, key='d'):
+    from psychopy import visual
+    win = visual.Window(size=(400,300), **headless_win_options())
+    win.flip()
+    start_time = time.perf_counter()
+    key_input = open_key_input(win, backend)
+    startup = time.perf_counter()-start_time
+
+    # cost of a poll with nothing queued, paid every frame
+    key_input.getKeys()
+    poll_times = np.zeros(1000)
+    for idx in range(len(poll_times)):
+        poll_start = time.perf_counter()
+        key_input.getKeys()
+        poll_times[idx] = time.perf_counter()-poll_start
+
+    injector = XKeyInjector(win)
+    time.sleep(0.2)
+    key_input.getKeys()
+    press_latency = []
+    release_latency = []
+    for press in range(presses):
+        inject_time = time.perf_counter()
+        injector.send(key, True)
+        seen_time = wait_for(key_input, key, 'KEYBOARD_PRESS')
+        if seen_time is not None:
+            press_latency.append(seen_time-inject_time)
+        inject_time = time.perf_counter()
+        injector.send(key, False)
+        seen_time = wait_for(key_input, key, 'KEYBOARD_RELEASE')
+        if seen_time is not None:
+            release_latency.append(seen_time-inject_time)
+        win.flip()
+    injector.close()
+    key_input.close()
+    win.close()
+
+    press_latency = np.array(press_latency)
+    return {
+        'startup_s': startup,
+        'poll_us': {'mean': 1e6*poll_times.mean(), 'p95': 1e6*np.percentile(poll_times,95)},
+        'detected': len(press_latency),
+        'presses': presses,
+        'press_latency_ms': {'mean': 1000*press_latency.mean(),
+                             'median': 1000*np.median(press_latency),
+                             'p95': 1000*np.percentile(press_latency,95),
+                             'max': 1000*press_latency.max()} if len(press_latency) else None,
+        'release_latency_ms': 1000*np.mean(release_latency) if len(release_latency) else None,
+    }
+
+if __name__ == '__main__':
+    args = parse_args()
+    xvfb = start_virtual_display()
+    try:
+        results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'platform': platform.platform(),
+                   'python': platform.python_version(),
+                   'backends': {}}
+        for backend in args.backends:
+            results['backends'][backend] = run_backend(backend, args.presses)
+            print(backend+': startup '+str(round(results['backends'][backend]['startup_s'],3))+' s')
+    finally:
+        stop_virtual_display(xvfb)
+    with open(args.output,'w') as f:
+        json.dump(results, f, indent=2)
@@ -1,6 +1,9 @@
 from dynamixel_sdk import *
 import numpy as np
-import os, yaml, multiprocessing
+import os, sys, time, yaml, queue, multiprocessing
+from target_tracker import *
+from frame_log import save_records
+from command_mailbox import CommandMailbox
 
 # unit conversions
 RAW_TO_DEG    = 0.087891 # conversion from raw units to degrees
@@ -65,9 +68,16 @@ LEN_SYNCREAD_POS_ONLY = LEN_TIME+LEN_POSITION
 ADDR_SYNCWRITE_START  = ADDR_SYNCREAD_START+LEN_SYNCREAD
 LEN_SYNCWRITE         = 4*LEN_GAIN
 
+# keyboard.yml keys the running child can take (update_config), the rest need a restart
+RELOAD_KEYS = ['neutral_angle','swing_angle','stiff_params','compliant_params','guide_params',
+    'velocity_gain']
+
+# child process startup stages, reported in seconds
+STARTUP_STAGES = ['process_start','port_open','indirect_addresses','sync_setup','first_read']
+
 # keyboard class to run in parent process
 class KeyboardWrapper(object):
-    def __init__(self, config_fname='keyboard'):
+    def __init__(self, config_fname='keyboard', wait=True, config_overrides={}):
         # load config
         self.config_dir = os.path.join('config',config_fname+'.yml')
         try:
@@ -76,37 +86,107 @@ class KeyboardWrapper(object):
         except:
             print('Configuration file '+self.args.config+'.yml not found')
             sys.exit(1)
+        self.config.update(config_overrides) # e.g. port and cpu_cores per station
 
         # fingers and positions
         self.map_to_screen = self.config['map_to_screen']
         self.num_fingers = len(self.map_to_screen)
-        self.all_pos = multiprocessing.Array('f',self.num_fingers)
-        self.all_vel = multiprocessing.Array('f',self.num_fingers)
+        self.mp_context = multiprocessing.get_context(self.config.get('start_method','spawn'))
+        self.all_pos = self.mp_context.Array('f',self.num_fingers)
+        self.all_vel = self.mp_context.Array('f',self.num_fingers)
 
-        # command logic
-        self.command_pipe_recv, self.command_pipe_send = multiprocessing.Pipe(duplex=False)
+        # command logic: shared-memory records, see command_mailbox.py
         self.valid_commands = self.config['commands']
-
-        # start async keyboard process
-        wait_for_start = multiprocessing.Event()
-        self.keyboard_process = multiprocessing.Process(target=main_keyboard_loop,
-            args=(self.config, self.all_pos, self.all_vel, self.command_pipe_recv, wait_for_start))
-        self.keyboard_process.start()
-        wait_for_start.wait()
-
-        # initialize basic state, turn on servos
+        self.mailbox = CommandMailbox(self.mp_context, self.valid_commands)
+        self.event_queue = self.mp_context.Queue() # target events from the child
+
+        # start async keyboard process, servo bring-up runs in the background
+        self.ready = self.mp_context.Event()
+        self.startup_times = self.mp_context.Array('d',len(STARTUP_STAGES))
+        self.loop_count = self.mp_context.RawValue('L',0) # child loop iterations
+        self.last_loop_count = 0
+        self.last_loop_time = time.perf_counter()
+        self.keyboard_process = self.mp_context.Process(target=main_keyboard_loop,
+            args=(self.config, self.all_pos, self.all_vel, self.mailbox, self.ready,
+                self.startup_times, time.time(), self.event_queue, self.loop_count))
+        start_lean_process(self.keyboard_process)
+
+        # initialize basic state, turn on servos (queued until the child is up)
         self.send_command('torque_on')
         self.send_command('mode_idle_compliant')
+        if wait:
+            self.wait_ready()
+
+    def wait_ready(self, timeout=None):
+        # block until the child has done its first read, fail if it died
+        start_time = time.time()
+        while not(self.ready.wait(0.05)):
+            if not(self.keyboard_process.is_alive()):
+                raise RuntimeError('Keyboard process exited during startup')
+            if timeout is not None and time.time()-start_time > timeout:
+                return False
+        return True
+
+    def startup_report(self):
+        return dict(zip(STARTUP_STAGES, self.startup_times[:]))
+
+    def loop_rate(self):
+        # keyboard loop iterations/s since the last call
+        now = time.perf_counter()
+        count = self.loop_count.value
+        rate = (count-self.last_loop_count)/(now-self.last_loop_time)
+        self.last_loop_count = count
+        self.last_loop_time = now
+        return rate
+
+    def set_targets(self, table):
+        # hit detection at servo rate, see TargetTracker.set_targets for the table
+        self.send_command({'command': 'set_targets', 'data': table})
+
+    def clear_targets(self):
+        self.send_command('clear_targets')
+
+    def start_guidance(self, table):
+        # haptic course guidance at servo rate, see KeyboardAsync.start_guidance
+        self.send_command({'command': 'mode_guide', 'data': table})
+
+    def set_guide_start(self, start):
+        # scroll clock moved (course reset), same table
+        self.send_command({'command': 'set_guide_start', 'data': start})
+
+    def update_config(self, changes):
+        # live keyboard.yml changes, see KeyboardAsync.update_config
+        self.config.update(changes)
+        live_changes = {key: value for key, value in changes.items() if key in RELOAD_KEYS}
+        for key in changes:
+            if key not in RELOAD_KEYS:
+                print('Keyboard config: '+key+' changed, applies after a restart')
+        if live_changes:
+            self.send_command({'command': 'update_config', 'data': live_changes})
+
+    def save_recording(self, fname):
+        # after stop_recording: the servo samples to file, see load_frame_log
+        self.send_command({'command': 'save_recording', 'data': fname})
+
+    def get_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.event_queue.get_nowait())
+            except queue.Empty:
+                return events
 
     def send_command(self, full_command):
+        command_data = None
         if type(full_command) == str:
             command = full_command
         elif type(full_command) == dict:
             command = full_command['command']
+            command_data = full_command['data']
         else:
             command = ''
         if command in self.valid_commands:
-            self.command_pipe_send.send(full_command)
+            self.mailbox.send(command, command_data)
 
     def shutdown(self):
         # put in safe control range for next startup
@@ -117,7 +197,9 @@ class KeyboardWrapper(object):
 
 # keyboard class to run in child process
 class KeyboardAsync(object):
-    def __init__(self, config_object, all_pos, all_vel, command_pipe_recv):
+    def __init__(self, config_object, all_pos, all_vel, mailbox, event_queue=None):
+        self.startup_marks = [time.perf_counter()]
+
         # load config
         self.config = config_object
 
@@ -137,6 +219,7 @@ class KeyboardAsync(object):
         self.max_angle = self.neutral_angle + self.swing_angle
         self.stiff_params = self.config['stiff_params']
         self.compliant_params = self.config['compliant_params']
+        self.guide_params = self.config.get('guide_params', self.stiff_params)
         self.velocity_gain = self.config['velocity_gain']
         self.valid_commands = self.config['commands']
 
@@ -149,15 +232,20 @@ class KeyboardAsync(object):
             print("Setting baudrate failed, quitting...")
             quit()
         self.packetHandler = PacketHandler(PROTOCOL_VERSION)
+        self.startup_marks.append(time.perf_counter())
 
         # init variables
         self.mode = ''
         self.keyboard_running = True
-        self.command_pipe_recv = command_pipe_recv
+        self.mailbox = mailbox
         self.all_pos = all_pos
         self.all_time = np.full(self.num_fingers, 0, dtype='i')
         self.all_vel = all_vel #np.full(self.num_fingers, 0, dtype='f')
 
+        # target hit detection
+        self.tracker = TargetTracker(tick_wrap=MAX_TIME_CORRECT)
+        self.event_queue = event_queue
+
         # recording
         self.recording = False
         self.reset_recording_data()
@@ -169,16 +257,14 @@ class KeyboardAsync(object):
         self.cumulative_replay_time = 0
         self.replay_hand = 'rh'
 
+        # course guidance
+        self.guide_ids = []
+        self.guide_angles = None
+
         # convert typical params to bytes
         self.neutral_angle_bytes = deg_to_byte(self.neutral_angle)
-        self.params_stiff_bytes = (convert2byte(self.stiff_params['P'])
-            +convert2byte(self.stiff_params['I'])
-            +convert2byte(self.stiff_params['D'])
-            +convert2byte(self.stiff_params['current']))
-        self.params_compliant_bytes = (convert2byte(self.compliant_params['P'])
-            +convert2byte(self.compliant_params['I'])
-            +convert2byte(self.compliant_params['D'])
-            +convert2byte(self.compliant_params['current']))
+        self.params_stiff_bytes = gain_bytes(self.stiff_params)
+        self.params_compliant_bytes = gain_bytes(self.compliant_params)
 
         # init indirect addresses
         # SyncRead: [REALTIME_TICK[2], PRESENT_POSITION[4], PRESENT_VELOCITY[4]]
@@ -189,6 +275,7 @@ class KeyboardAsync(object):
                 for addr in range(addr_dict['len']):
                     self.packetHandler.write2ByteTxRx(self.portHandler, dxl_id,
                         addr_dict['ind']+LEN_ADDR_INDIRECT*addr, addr_dict['addr']+addr)
+        self.startup_marks.append(time.perf_counter())
 
         # init syncread/syncwrite
         self.all_syncread = GroupSyncRead(self.portHandler, self.packetHandler,
@@ -226,8 +313,11 @@ class KeyboardAsync(object):
             self.lh_syncwrite_gain_stiff.addParam(dxl_id, self.params_stiff_bytes)
             self.lh_syncwrite_gain_compliant.addParam(dxl_id, self.params_compliant_bytes)
 
+        self.startup_marks.append(time.perf_counter())
+
         # init values from servos
         self.all_syncread.fastSyncRead()
+        self.startup_marks.append(time.perf_counter())
 
     def enable_torque_all(self):
         for dxl_id in self.all_ids:
@@ -238,14 +328,7 @@ class KeyboardAsync(object):
             self.packetHandler.write1ByteTxRx(self.portHandler, dxl_id, ADDR_TORQUE_ENABLE, 0)
 
     def handle_command(self):
-        full_command = self.command_pipe_recv.recv()
-        if type(full_command) == str:
-            command = full_command
-        elif type(full_command) == dict:
-            command = full_command['command']
-            command_data = full_command['data']
-        else:
-            command = ''
+        command, command_data = self.mailbox.receive()
         if command in self.valid_commands:
             # set mode if command is a mode switch
             if command.startswith('mode'):
@@ -279,6 +362,12 @@ class KeyboardAsync(object):
                 self.all_syncwrite_pos_neutral.txPacket()
                 self.rh_syncwrite_gain_stiff.txPacket()
                 self.lh_syncwrite_gain_compliant.txPacket()
+            elif command == 'mode_guide':
+                self.all_syncwrite_pos_neutral.txPacket()
+                self.all_syncwrite_gain_compliant.txPacket()
+                self.start_guidance(command_data)
+            elif command == 'set_guide_start':
+                self.guide_start = command_data
             elif command == 'start_recording':
                 self.reset_recording_data()
                 self.recording = True
@@ -298,9 +387,93 @@ class KeyboardAsync(object):
             elif command == 'stop_replay':
                 self.delayed_replay = False
                 self.replay_started = False
+            elif command == 'update_config':
+                self.update_config(command_data)
+            elif command == 'save_recording':
+                self.save_recording(command_data)
+            elif command == 'set_targets':
+                self.tracker.set_targets(command_data)
+            elif command == 'clear_targets':
+                self.tracker.clear()
             else:
                 pass
 
+    def update_config(self, changes):
+        # swap in only the syncwrite payloads the changed keys feed into, then
+        # resend what the current mode is holding
+        self.config.update(changes)
+        if 'velocity_gain' in changes:
+            self.velocity_gain = changes['velocity_gain']
+        if 'neutral_angle' in changes or 'swing_angle' in changes:
+            self.neutral_angle = self.config['neutral_angle']
+            self.swing_angle = self.config['swing_angle']
+            self.min_angle = self.neutral_angle - self.swing_angle
+            self.max_angle = self.neutral_angle + self.swing_angle
+        if 'neutral_angle' in changes:
+            self.neutral_angle_bytes = deg_to_byte(self.neutral_angle)
+            for dxl_id in self.all_ids:
+                self.all_syncwrite_pos_neutral.changeParam(dxl_id, self.neutral_angle_bytes)
+            self.all_syncwrite_pos_neutral.txPacket()
+        if 'stiff_params' in changes:
+            self.stiff_params = self.config['stiff_params']
+            self.params_stiff_bytes = gain_bytes(self.stiff_params)
+            self.change_gain_params([self.all_syncwrite_gain_stiff, self.rh_syncwrite_gain_stiff,
+                self.lh_syncwrite_gain_stiff], self.params_stiff_bytes)
+        if 'compliant_params' in changes:
+            self.compliant_params = self.config['compliant_params']
+            self.params_compliant_bytes = gain_bytes(self.compliant_params)
+            self.change_gain_params([self.all_syncwrite_gain_compliant, self.rh_syncwrite_gain_compliant,
+                self.lh_syncwrite_gain_compliant], self.params_compliant_bytes)
+        if 'guide_params' in changes:
+            self.guide_params = self.config['guide_params']
+            if self.mode == 'guide':
+                self.change_gain_params([self.guide_syncwrite_gain], gain_bytes(self.guide_params))
+        if 'stiff_params' in changes or 'compliant_params' in changes or 'guide_params' in changes:
+            for syncwrite in self.mode_gain_syncwrites():
+                syncwrite.txPacket()
+
+    def change_gain_params(self, syncwrites, params_bytes):
+        # each syncwrite keeps its own id list (all, rh or lh)
+        for syncwrite in syncwrites:
+            for dxl_id in list(syncwrite.data_dict):
+                syncwrite.changeParam(dxl_id, params_bytes)
+
+    def mode_gain_syncwrites(self):
+        # gain packets the current mode sent on entry
+        if self.mode == 'idle_stiff':
+            return [self.all_syncwrite_gain_stiff]
+        elif self.mode == 'idle_compliant':
+            return [self.all_syncwrite_gain_compliant]
+        elif self.mode in ['action_normal_rh','action_mirror_rh']:
+            return [self.rh_syncwrite_gain_compliant, self.lh_syncwrite_gain_stiff]
+        elif self.mode in ['action_normal_lh','action_mirror_lh']:
+            return [self.rh_syncwrite_gain_stiff, self.lh_syncwrite_gain_compliant]
+        elif self.mode == 'guide':
+            return [self.all_syncwrite_gain_compliant, self.guide_syncwrite_gain]
+        return []
+
+    def start_guidance(self, table):
+        # table: 'ids' (guided servos), 'angles' (samples x ids, finger degrees,
+        # uniform in time from course time 0), 'rate' (samples/s), 'start'
+        # (time.perf_counter() at course time 0, the clock is shared with the
+        # game process), optional 'params' (gains, default guide_params)
+        self.guide_ids = list(table['ids'])
+        angles = np.clip(np.asarray(table['angles'], dtype=float), self.min_angle, self.max_angle)
+        self.guide_angles = angles.reshape(len(angles), len(self.guide_ids)).tolist()
+        self.guide_last = len(self.guide_angles)-1
+        self.guide_rate = table['rate']
+        self.guide_start = table['start']
+        params_bytes = gain_bytes(table.get('params', self.guide_params))
+        self.guide_syncwrite_pos = GroupSyncWrite(self.portHandler, self.packetHandler,
+            ADDR_GOAL_POSITION, LEN_POSITION)
+        self.guide_syncwrite_gain = GroupSyncWrite(self.portHandler, self.packetHandler,
+            ADDR_SYNCWRITE_START, LEN_SYNCWRITE)
+        for col, dxl_id in enumerate(self.guide_ids):
+            self.guide_syncwrite_pos.addParam(dxl_id, deg_to_byte(self.guide_angles[0][col]))
+            self.guide_syncwrite_gain.addParam(dxl_id, params_bytes)
+        self.guide_syncwrite_pos.txPacket()
+        self.guide_syncwrite_gain.txPacket()
+
     def reset_recording_data(self):
         self.recorded_time_ms = []
         self.recorded_pos_deg = {}
@@ -315,6 +488,19 @@ class KeyboardAsync(object):
             self.recorded_pos_deg[dxl_id].append(raw_to_deg(self.all_syncread.getData(dxl_id,ADDR_POS_DATA,LEN_POSITION)))
             self.recorded_vel_rpm[dxl_id].append(raw_to_rpm(self.all_syncread.getData(dxl_id,ADDR_VEL_DATA,LEN_VELOCITY)))
 
+    def save_recording(self, fname):
+        # servo ticks unwrapped to a continuous ms count, one row per sample
+        num_samples = len(self.recorded_pos_deg[self.all_ids[0]])
+        time_ms = np.array(self.recorded_time_ms[-num_samples:], dtype=float)
+        time_ms[1:] += MAX_TIME_CORRECT*np.cumsum(np.diff(time_ms) < 0)
+        records = np.zeros(num_samples, dtype=[('time_ms','f8'),
+            ('pos','f4',(self.num_fingers,)), ('vel','f4',(self.num_fingers,))])
+        records['time_ms'] = time_ms
+        records['pos'] = np.array([self.recorded_pos_deg[dxl_id] for dxl_id in self.all_ids]).T
+        records['vel'] = np.array([self.recorded_vel_rpm[dxl_id] for dxl_id in self.all_ids]).T
+        save_records(fname, records, info={'source': 'keyboard', 'ids': list(self.all_ids),
+            'neutral_angle': self.neutral_angle})
+
     def prep_for_replay(self, correct_ms=0):
         # put into numpy array for easy math
         self.replay_time = np.array(self.recorded_time_ms)
@@ -341,6 +527,8 @@ class KeyboardAsync(object):
             self.assign_mirror_map('rh')
         elif self.mode == 'action_mirror_lh':
             self.assign_mirror_map('lh')
+        elif self.mode == 'guide':
+            self.assign_guidance(time.perf_counter())
         else:
             pass
 
@@ -404,23 +592,73 @@ class KeyboardAsync(object):
         else:
             pass
 
+    def assign_guidance(self, now):
+        # linear between table samples, held at either end of the course
+        t = (now-self.guide_start)*self.guide_rate
+        if t <= 0:
+            idx, frac = 0, 0.0
+        elif t >= self.guide_last:
+            idx, frac = self.guide_last, 0.0
+        else:
+            idx = int(t)
+            frac = t-idx
+        sample = self.guide_angles[idx]
+        next_sample = self.guide_angles[min(idx+1, self.guide_last)]
+        for col, dxl_id in enumerate(self.guide_ids):
+            angle = sample[col]+frac*(next_sample[col]-sample[col])
+            self.guide_syncwrite_pos.changeParam(dxl_id, deg_to_byte(angle))
+        self.guide_syncwrite_pos.txPacket()
+
+    def check_targets(self, ticks):
+        finger = self.tracker.finger
+        self.tracker.update(ticks[finger], self.all_pos[finger])
+        if self.tracker.events and self.event_queue is not None:
+            for target_event in self.tracker.pop_events():
+                self.event_queue.put(target_event)
+
     def mirror_angle(self, new_angle, new_velocity):
         return min(self.max_angle,max(self.min_angle,new_angle+new_velocity*self.velocity_gain))
 
     def shutdown(self):
         self.keyboard_running = False
 
-def main_keyboard_loop(config_object, all_pos, all_vel, command_pipe_recv, wait_for_start):
+def start_lean_process(process):
+    # spawn/forkserver children re-import the parent's __main__ (a game script,
+    # and psychopy with it); present this module as __main__ while starting so
+    # the child only imports keyboard.py and its few dependencies
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = sys.modules[__name__]
+    try:
+        process.start()
+    finally:
+        sys.modules['__main__'] = main_module
+
+def set_cpu_affinity(cores):
+    # pin this process (and children it starts later) to the given cores
+    if not(cores):
+        return
+    if not(hasattr(os, 'sched_setaffinity')):
+        print('CPU affinity not supported on this platform, cores '+str(cores)+' ignored')
+        return
+    os.sched_setaffinity(0, cores)
+
+def main_keyboard_loop(config_object, all_pos, all_vel, mailbox, wait_for_start,
+        startup_times=None, parent_start_time=None, event_queue=None, loop_count=None):
     # create keyboard object inside child process
-    kb = KeyboardAsync(config_object, all_pos, all_vel, command_pipe_recv)
+    process_start = time.time()-parent_start_time if parent_start_time is not None else 0.0
+    set_cpu_affinity(config_object.get('cpu_cores', None))
+    kb = KeyboardAsync(config_object, all_pos, all_vel, mailbox, event_queue)
+    if startup_times is not None:
+        startup_times[:] = [process_start]+list(np.diff(kb.startup_marks))
     wait_for_start.set()
 
     # init time
     next_time = [kb.all_syncread.getData(dxl_id,ADDR_TIME_DATA,LEN_TIME) for dxl_id in kb.all_ids]
 
-    # main keyboard loop until shutdown called
+    # main keyboard loop until shutdown called; a command check is one compare
+    write_seq = mailbox.write_seq
     while kb.keyboard_running:
-        while kb.command_pipe_recv.poll():
+        while write_seq.value != mailbox.read_seq:
             kb.handle_command()
         kb.all_syncread.fastSyncRead()
         kb.all_time[:] = [kb.all_syncread.getData(dxl_id,ADDR_TIME_DATA,LEN_TIME) for dxl_id in kb.all_ids]
@@ -429,10 +667,14 @@ def main_keyboard_loop(config_object, all_pos, all_vel, command_pipe_recv, wait_
         kb.all_time[:] = [next_time[idx] - last_time[idx] for idx in range(kb.num_fingers)]
         kb.all_pos[:] = [raw_to_deg(kb.all_syncread.getData(dxl_id,ADDR_POS_DATA,LEN_POSITION)) for dxl_id in kb.all_ids]
         kb.all_vel[:] = [raw_to_rpm(kb.all_syncread.getData(dxl_id,ADDR_VEL_DATA,LEN_VELOCITY)) for dxl_id in kb.all_ids]
+        if kb.tracker.active:
+            kb.check_targets(next_time)
         kb.check_run_active()
         kb.check_recording_replay()
+        if loop_count is not None:
+            loop_count.value += 1
     # handle any remaining cleanup/shutdown commands
-    while kb.command_pipe_recv.poll():
+    while write_seq.value != mailbox.read_seq:
         kb.handle_command()
     kb.portHandler.closePort()
 
@@ -457,6 +699,11 @@ def raw_to_rpm(input_raw):
 def rpm_to_raw(input_rpm):
     return round(input_rpm*RPM_TO_RAW)
 
+def gain_bytes(params):
+    # syncwrite payload: [P_GAIN[2], I_GAIN[2], D_GAIN[2], GOAL_CURRENT[2]]
+    return (convert2byte(params['P'])+convert2byte(params['I'])
+        +convert2byte(params['D'])+convert2byte(params['current']))
+
 def convert2byte(data):
     return [DXL_LOBYTE(data), DXL_HIBYTE(data)]
 
@@ -1,16 +1,59 @@
-import os, yaml, argparse
+import os, math, json, time, yaml, argparse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from scipy.interpolate import PchipInterpolator as pci
 from psychopy import core, event, visual
 from psychopy.iohub.client import launchHubServer
-from psychopy.visual.windowwarp import Warper
+from warper import *
+from course import *
+from block import *
+from frame_log import *
+from marbles import *
+from gc_control import *
+from frame_budget import *
 from keyboard import *
+from startup import *
+from config_watch import *
+from ghost import *
+from static_layer import *
 
-parser = argparse.ArgumentParser(description='Marble game parameters')
-parser.add_argument('-c','--config', help='Configuration file',default='demo')
-parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
-parser.add_argument('-p','--perspective', help='Perspective mode', action='store_false', default=True)
-args = parser.parse_args()
+# game config keys applied live (config_reload), by what has to be rebuilt
+RELOAD_GROUPS = {
+    'bg_color': 'window',
+    'course_color': 'course',
+    'trough_speed': 'course',
+    'trough_width': 'troughs',
+    'trough_edge_width': 'troughs',
+    'trough_full_angle': 'troughs',
+    'trough_color': 'troughs',
+    'trough_line_color': 'troughs',
+    'trough_edge_color': 'troughs',
+    'kb_angle_gain': 'marble',
+    'marble_rota_coef': 'marble',
+    'frame_budget': 'budget',
+    'detail_level': 'budget',
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Marble game parameters')
+    parser.add_argument('-c','--config', help='Configuration file',default='demo')
+    parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
+    parser.add_argument('-p','--perspective', help='Perspective mode', action='store_false', default=True)
+    parser.add_argument('-k','--keyboard', help='Keyboard configuration file', default='keyboard')
+    parser.add_argument('--port', help='Keyboard serial port (default: the keyboard config\'s)', default=None)
+    parser.add_argument('--screen', help='Screen index to open the window on', type=int, default=0)
+    parser.add_argument('--cores', help='CPU cores for the game (render) process', type=int, nargs='+', default=None)
+    parser.add_argument('--kb-cores', help='CPU cores for the keyboard process', type=int, nargs='+', default=None)
+    parser.add_argument('--status', help='Health file, rewritten every second (json)', default=None)
+    parser.add_argument('--run-name', help='Prefix for the frame log, block log and warp mesh cache', default=None)
+    return parser.parse_args()
+
+def run_path(fname, run_name):
+    # this run's copy of an output file, <dir>/<run_name>_<file>, so stations
+    # sharing a game config don't write over each other
+    if run_name is None:
+        return fname
+    head, tail = os.path.split(fname)
+    return os.path.join(head, run_name+'_'+tail)
 
 
 def gen_trough_shape(win, full_angle_deg=60, width=0.8, edge_width=0.04,
@@ -34,6 +77,30 @@ def gen_trough_shape(win, full_angle_deg=60, width=0.8, edge_width=0.04,
         pos=(xpos,ypos), interpolate=True)
     return shape
 
+def gen_lane_trough_shape(win, lane_xs, full_angle_deg=60, width=0.8, edge_width=0.04,
+        num_pts=30, line_width=5, line_color=[0.6,0.6,0.6],
+        xpos=0, ypos=0):
+    # one polyline through the troughs of all lanes, lanes joined at their edges
+    half_trough_angle = np.deg2rad(0.5*full_angle_deg)
+    circ_points = 3/2*np.pi+np.linspace(-half_trough_angle,half_trough_angle,num_pts)
+    circle_rad = 0.5*width/np.sin(half_trough_angle)
+    xs = circle_rad*np.cos(circ_points)
+    ys = circle_rad*np.sin(circ_points)+circle_rad
+
+    xs = np.concatenate([[xs[0]-edge_width],xs,[xs[-1]+edge_width]])
+    ys = np.concatenate([[ys[0]],ys,[ys[-1]]])
+    xs = (np.asarray(lane_xs)[:,None]+xs[None,:]).ravel()
+    ys = np.tile(ys,len(lane_xs))
+
+    vertices = np.vstack([xs,ys]).T
+    shape = visual.ShapeStim(win,
+        vertices=vertices,
+        lineWidth=line_width,
+        lineColor=line_color,
+        closeShape=False,
+        pos=(xpos,ypos), interpolate=True)
+    return shape
+
 def gen_semicirc_shape(win, radius=0.4,
         num_pts=30, line_width=1.5, line_color=[0.6,0.6,0.6],
         xpos=0, ypos=0):
@@ -69,35 +136,18 @@ def gen_shadow_shape(win, radius=0.4,
         pos=(xpos,ypos), interpolate=True)
     return shape
 
-def gen_course_path(targets=[0,0,25,-35,15,-15,0,0],
-        times=[0,0.5,2,3.5,5,6.5,8,8.5], speed=0.25, step_size=0.01):
-    ypos = speed*np.array(times)
-    course_interp = pci(ypos,targets)
-    ypos_out = np.arange(ypos[0],ypos[-1]+step_size,step_size)
-    angle_out = course_interp(ypos_out)
-    return ypos_out, angle_out
-
 def gen_course_shape(win, course_y_raw, course_angle_raw,
         course_rad, course_angle_width=15,
         line_width=1.5, fill_color=[0.6,0.6,0.6], line_color=[0.6,0.6,0.6],
         xpos=0, ypos=-0.35, endcap_points=10):
-    course_angles_lh = np.deg2rad(course_angle_raw-0.5*course_angle_width)
-    course_xs_lh = course_rad*np.sin(course_angles_lh)
-    course_angles_rh = np.deg2rad(course_angle_raw+0.5*course_angle_width)
-    course_xs_rh = course_rad*np.sin(course_angles_rh)
-    endcap_angles_bottom = np.linspace(course_angles_rh[0],course_angles_lh[0],endcap_points)[1:-1]
-    endcap_angles_top = np.linspace(course_angles_lh[-1],course_angles_rh[-1],endcap_points)[1:-1]
-    endcap_xs_bottom = course_rad*np.sin(endcap_angles_bottom)
-    endcap_xs_top = course_rad*np.sin(endcap_angles_top)
-
-    endcap_ys_bottom = np.linspace(course_y_raw[0],course_y_raw[0],endcap_points)[1:-1]
-    endcap_ys_top = np.linspace(course_y_raw[-1],course_y_raw[-1],endcap_points)[1:-1]
-
-    xs = np.concatenate([endcap_xs_bottom,course_xs_lh,endcap_xs_top,course_xs_rh[::-1]])
-    ys = np.concatenate([endcap_ys_bottom,course_y_raw,endcap_ys_top,course_y_raw[::-1]])
-    ys += course_rad*(1-np.cos(np.concatenate([endcap_angles_bottom,course_angles_lh,
-        endcap_angles_top,course_angles_rh[::-1]])))
-    vertices = np.vstack([xs,ys]).T
+    vertices = gen_course_vertices(course_y_raw, course_angle_raw, course_rad,
+        course_angle_width, endcap_points)
+    return gen_vertices_shape(win, vertices, line_width=line_width,
+        fill_color=fill_color, line_color=line_color, xpos=xpos, ypos=ypos)
+
+def gen_vertices_shape(win, vertices,
+        line_width=1.5, fill_color=[0.6,0.6,0.6], line_color=[0.6,0.6,0.6],
+        xpos=0, ypos=-0.35):
     shape = visual.ShapeStim(win,
         vertices=vertices,
         lineWidth=line_width,
@@ -106,9 +156,30 @@ def gen_course_shape(win, course_y_raw, course_angle_raw,
         pos=(xpos,ypos), interpolate=True)
     return shape
 
+def gen_lane_course_shape(win, course_y_raw, course_angle_raw,
+        course_rad, lane_xs, course_angle_width=15,
+        fill_color=[0.6,0.6,0.6], ypos=-0.35, endcap_points=10):
+    vertices = gen_course_vertices(course_y_raw, course_angle_raw, course_rad,
+        course_angle_width, endcap_points)
+    return gen_lane_vertices_shape(win, vertices, lane_xs,
+        fill_color=fill_color, ypos=ypos)
+
+def gen_lane_vertices_shape(win, vertices, lane_xs,
+        fill_color=[0.6,0.6,0.6], ypos=-0.35):
+    # the course of every lane in one shape, a loop per lane; fill only, psychopy
+    # draws no borders for multi-loop shapes
+    loops = [vertices+[lane_x,0] for lane_x in lane_xs]
+    shape = visual.ShapeStim(win,
+        vertices=loops,
+        lineWidth=0,
+        lineColor=None,
+        fillColor=fill_color,
+        pos=(0,ypos), interpolate=True)
+    return shape
+
 class MarbleGame:
 
-    def __init__(self):
+    def __init__(self, args, kb=None, win_options={}, config_overrides={}):
         # load command line args
         self.args = args
 
@@ -120,18 +191,47 @@ class MarbleGame:
         except:
             print('Configuration file '+self.args.config+'.yml not found')
             sys.exit(1)
+        self.config.update(config_overrides)
 
         self.perspective_on = self.args.perspective
+        self.run_name = getattr(self.args, 'run_name', None)
+        self.startup = StartupTimer()
 
-        self.win = visual.Window(size=(self.config['screen_width'], self.config['screen_height']),
-                     color=self.config['bg_color'], units='height',
-                     fullscr=self.args.fullscreen, useFBO=self.perspective_on)
+        # station placement (station_launcher.py): render cores for this process,
+        # port and cores for the keyboard process
+        set_cpu_affinity(getattr(self.args, 'cores', None))
+        kb_overrides = {}
+        if getattr(self.args, 'port', None) is not None:
+            kb_overrides['port'] = self.args.port
+        if getattr(self.args, 'kb_cores', None) is not None:
+            kb_overrides['cpu_cores'] = self.args.kb_cores
+
+        # servo bring-up (keyboard process) and the warp mesh (thread) run
+        # alongside window and geometry creation, joined before the first frame
+        self.kb = kb if kb is not None else KeyboardWrapper(getattr(self.args, 'keyboard', 'keyboard'),
+            wait=False, config_overrides=kb_overrides)
+        self.startup.mark('keyboard_process')
+        screen_size = (self.config['screen_width'], self.config['screen_height'])
+        perspective_corners = self.config.get('perspective_corners',PERSPECTIVE_CORNERS)
+        perspective_grid = self.config.get('perspective_grid',PERSPECTIVE_GRID)
+        mesh_cache = run_path(CACHE_FNAME, self.run_name)
+        startup_pool = ThreadPoolExecutor(max_workers=1)
+        mesh_future = startup_pool.submit(load_warp_mesh, screen_size[0]/screen_size[1],
+            perspective_corners, perspective_grid, mesh_cache)
 
-        self.kb = KeyboardWrapper()
+        self.win = visual.Window(size=screen_size,
+                     color=self.config['bg_color'], units='height',
+                     fullscr=self.args.fullscreen, useFBO=self.perspective_on,
+                     screen=getattr(self.args, 'screen', 0), **win_options)
+        self.startup.mark('window')
 
-        self.warper = Warper(self.win,
-            warp='warpfile',
-            warpfile = 'config/perspective.data')
+        mesh = mesh_future.result()
+        startup_pool.shutdown()
+        if tuple(self.win.size) != screen_size:
+            mesh = None # fullscreen at another aspect, rebuild for the real one
+        self.warper = MeshWarper(self.win, perspective_corners=perspective_corners,
+            grid=perspective_grid, cache_fname=mesh_cache, mesh=mesh)
+        self.startup.mark('warper')
 
         # add key controls
         event.globalKeys.add(key='q', modifiers=['alt'], func=self.quit)
@@ -148,10 +248,7 @@ class MarbleGame:
         self.trough_line_color = self.config['trough_line_color']
         self.trough_edge_color = self.config['trough_edge_color']
         self.course_color = self.config['course_color']
-        self.troughs = [gen_trough_shape(self.win, full_angle_deg=self.trough_full_angle,
-            width=self.trough_width, edge_width=self.trough_edge_width,
-            line_color=self.trough_line_color) for t in range(self.num_troughs)]
-        self.troughs_ypos = np.linspace(1,-1,self.num_troughs)
+        self.troughs_ypos = np.linspace(1,-1,self.num_troughs).tolist()
         self.bg_grating = visual.GratingStim(self.win, texRes=1024,
             color=self.trough_color,size=(self.trough_width,1.0),contrast=0.25)
         self.lh_trough_rect = visual.Rect(self.win, width=self.trough_edge_width, height=1,
@@ -159,6 +256,8 @@ class MarbleGame:
         self.rh_trough_rect = visual.Rect(self.win, width=self.trough_edge_width, height=1,
             pos=(-0.5*(self.trough_width+self.trough_edge_width),0),color=self.trough_edge_color)
 
+        self.startup.mark('troughs')
+
         # marble logic
         self.marble_base_ypos = self.config['marble_base_ypos']
         self.marble_color = self.config['marble_color']
@@ -183,11 +282,23 @@ class MarbleGame:
 
         self.marble_angle = self.marble_neutral_angle
         self.marble_velocity = 0
+        self.marble_roll_scale = 1/(0.4*self.marble_circ) # distance to semicirc phase
+        self.marble_roll_coef = 2*self.marble_trough_rad*math.pi/360 # deg/sec to distance/sec
         self.marble_xpos = 0
         self.marble_ypos = self.marble_base_ypos
         self.angle_gain = self.config['kb_angle_gain']
         self.marble_rota_coef = self.config['marble_rota_coef']
 
+        # pre-rendered marble textures instead of re-tessellated polygons
+        self.marble_sprite_on = self.config.get('marble_sprite', False)
+        if self.marble_sprite_on:
+            self.marble_sprite = MarbleSprite(self.win, radius=self.marble_rad,
+                trough_rad=self.marble_trough_rad, base_ypos=self.marble_base_ypos,
+                color=self.marble_color, border_color=self.marble_border_color,
+                shadow_color=self.marble_shadow_color, rota_coef=self.marble_rota_coef)
+
+        self.startup.mark('marble')
+
         # course example
         self.target_time_spacing = 1.0 #1.5
         self.start_end_time_spacing = 0.5
@@ -204,114 +315,734 @@ class MarbleGame:
         self.course_times = np.concatenate([self.course_start_times,
             self.course_start_times[1]+np.array(self.target_times),
             self.target_times[-1]+np.array(self.course_end_times)])
+        self.course_angle_width = 15 # degrees
         self.course_y_raw, self.course_angle_raw = gen_course_path(self.course_targets,
             self.course_times, self.trough_speed)
         self.course_example = gen_course_shape(self.win,
             self.course_y_raw, self.course_angle_raw,
-            self.marble_trough_rad,
+            self.marble_trough_rad, course_angle_width=self.course_angle_width,
             fill_color=self.course_color,
             line_color=self.course_color)
 
+        # on-course scoring
+        self.course_index = CourseIndex(self.course_y_raw, self.course_angle_raw,
+            self.course_angle_width)
+        self.course_target_ys = self.trough_speed*self.course_times[2:-2]
+        self.scorer = CourseScorer(self.course_index, self.course_target_ys)
+        self.course_ypos = float(self.course_example.pos[1])
+
+        self.startup.mark('course')
+
+        # multi-marble mode: one marble and trough lane per finger
+        self.multi_marble = self.config.get('multi_marble', False)
+        if self.multi_marble:
+            self.init_lanes()
+            self.startup.mark('lanes')
+
+        # recorded demonstration replayed beside the live marble (single marble)
+        self.ghost = None
+        ghost_log = self.config.get('ghost', None)
+        if ghost_log is not None and not(self.multi_marble):
+            self.ghost = GhostMarble(self.win, ghost_log, radius=self.marble_rad,
+                trough_rad=self.marble_trough_rad, base_ypos=self.marble_base_ypos,
+                color=self.marble_color, border_color=self.marble_border_color,
+                opacity=self.config.get('ghost_opacity', 0.4), rota_coef=self.marble_rota_coef)
+            self.ghost.restart(0.0) # same clock origin as the recording
+            self.startup.mark('ghost')
+
         # timing check
         self.clock = core.Clock()
         self.last_time = 0.0
         self.frame_time = 0.0
-        self.frame_history = np.zeros(100)
+        self.frame_history = [0.0]*100 # ring buffer
+        self.frame_history_idx = 0
+        self.frame_history_sum = 0.0
+        self.frame_count = 0
+        self.frame_msg_interval = 30 # frames between frame_msg text updates
         self.frame_msg = visual.TextBox2(win=self.win,
             text='16.6', pos=(-0.4,0.4),
             color=self.cue_color, letterHeight=0.08,
             units='height', autoDraw=False)#, autoDraw=True)
 
+        self.startup.mark('text')
+
+        # trough background and edges, unchanged between config edits
+        self.static_layer = None
+        if self.config.get('static_layer', False):
+            self.static_layer = StaticLayer(self.win,
+                [self.bg_grating, self.lh_trough_rect, self.rh_trough_rect])
+
+        # frame budget: geometry detail and fbo render scale follow the load
+        self.frame_budget_on = self.config.get('frame_budget', False)
+        self.frame_budget = FrameBudget(self.config.get('frame_rate',60),
+            level=self.config.get('detail_level',0))
+        self.render_scale = 1.0
+        self.full_viewport = [0,0,self.win.frameBufferSize[0],self.win.frameBufferSize[1]]
+        self.render_viewport = self.full_viewport
+        self.build_detail_sets()
+        self.apply_detail(self.frame_budget.detail)
+
+        # trial block: courses compiled in the background, swapped between trials
+        self.init_block()
+
         # self.debug_msg = visual.TextBox2(win=self.win,
         #     text='', pos=(-0.4,0.3),
         #     color=self.cue_color, letterHeight=0.08,
         #     units='height',
         #     autoDraw=True)
 
-        # keyboard setup
-        self.kb.send_command('mode_action_mirror_rh')
+        # keyboard setup: mirror, or the guided hand follows the course
+        self.guidance = self.config.get('guidance', None)
+        self.guide_table_rate = self.config.get('guide_table_rate', 100)
+        if self.guidance is None:
+            self.kb.send_command('mode_action_mirror_rh')
+        else:
+            self.start_guidance()
         self.display_hand = 'lh' # lh or rh
 
+        # per-frame state, written to file by a background thread
+        self.init_frame_log()
+
+        # freeze the garbage collector during trials, collect between them (or
+        # every gc_interval seconds without a block)
+        self.gc_control = self.config.get('gc_control', False)
+        self.gc_interval = self.config.get('gc_interval', 30.0)
+        self.gc_time = 0.0
+
+        # edits to the game and keyboard yml applied between frames
+        self.config_watcher = None
+        if self.config.get('config_reload', False):
+            self.config_watcher = ConfigWatcher()
+            self.config_watcher.watch('game', self.config_dir, self.config)
+            if hasattr(self.kb, 'config_dir'):
+                self.config_watcher.watch('keyboard', self.kb.config_dir, self.kb.config)
+            self.config_watcher.start()
+
+        # health report for the station launcher
+        self.status_file = getattr(self.args, 'status', None)
+        self.status_interval = 1.0 # s
+        self.status_time = 0.0
+
         self.game_running = True
+        self.startup.mark('detail')
+
+    def finish_startup(self):
+        # the only wait on the keyboard, right before the first frame
+        self.kb.wait_ready()
+        self.startup.mark('keyboard_wait')
+        print(self.startup.report(self.kb.startup_report()))
+
+    def init_block(self):
+        self.block_name = self.config.get('block', None)
+        self.block = None
+        if self.block_name is None:
+            return
+        block = load_block(self.block_name)
+        self.course_rads = [self.marble_trough_rad]
+        if self.multi_marble:
+            self.course_rads.append(self.lane_trough_rad)
+        self.block = BlockEngine(block['trials'], self.compile_trial,
+            iti=block.get('iti',1.0), frame_rate=self.config.get('frame_rate',60))
+        self.block_log = run_path(self.config.get('block_log', self.block_name+'_block_log.json'),
+            self.run_name)
+        self.next_course = None
+        self.block_state = 'iti'
+        self.iti_start = 0.0
+
+    def compile_trial(self, trial):
+        # worker thread: no opengl, only numpy/scipy
+        return compile_course(trial, self.trough_speed, self.course_rads,
+            shape_details=self.shape_details())
+
+    def build_next_course(self):
+        # main thread (stims need the gl context), done during the inter-trial gap
+        build_start = self.clock.getTime()
+        compiled = self.block.next_trial()
+        self.build_course_stims(compiled)
+        self.block.current['build_s'] = self.clock.getTime()-build_start
+        self.next_course = compiled
+
+    def build_course_stims(self, compiled):
+        # outlines for every detail level, the level in use picked at the swap
+        compiled['course_sets'] = {}
+        for key, vertices in compiled['shapes'].items():
+            course_example = gen_vertices_shape(self.win, vertices[0],
+                ypos=0.5, fill_color=self.course_color, line_color=self.course_color)
+            lane_course = None
+            if self.multi_marble:
+                lane_course = gen_lane_vertices_shape(self.win, vertices[1],
+                    self.lane_xs, ypos=0.5, fill_color=self.course_color)
+            compiled['course_sets'][key] = (course_example, lane_course)
+
+    def swap_course(self):
+        compiled = self.next_course
+        self.next_course = None
+        self.targets = compiled['targets']
+        self.course_targets = compiled['course_targets']
+        self.course_times = compiled['course_times']
+        self.course_angle_width = compiled['course_angle_width']
+        self.course_y_raw = compiled['course_y_raw']
+        self.course_angle_raw = compiled['course_angle_raw']
+        self.course_index = compiled['course_index']
+        self.course_target_ys = compiled['target_ys']
+        self.scorer = CourseScorer(self.course_index, self.course_target_ys)
+        if self.multi_marble:
+            self.lane_scorers = [CourseScorer(self.course_index, self.course_target_ys)
+                for lane_x in self.lane_xs]
+        self.course_sets = compiled['course_sets']
+        self.apply_detail(self.frame_budget.detail)
+        self.reset_course()
+        if self.guidance is not None:
+            self.start_guidance()
+
+    def start_trial(self):
+        swap_start = self.clock.getTime()
+        self.swap_course()
+        now = self.clock.getTime()
+        self.block.start_trial(now, swap_s=now-swap_start)
+        self.block_state = 'trial'
+
+    def start_block(self):
+        # first course compiled alongside startup, any wait is before frame one
+        self.build_next_course()
+        self.start_trial()
+
+    def update_block(self):
+        now = self.clock.getTime()
+        if self.block_state == 'trial':
+            self.block.update(self.frame_time)
+            scorer = self.lane_scorers[0] if self.multi_marble else self.scorer
+            if scorer.finished:
+                if self.multi_marble:
+                    score = [lane_scorer.summary() for lane_scorer in self.lane_scorers]
+                else:
+                    score = self.scorer.summary()
+                self.block.end_trial(now, score)
+                self.block_state = 'iti'
+                self.iti_start = now
+                if self.block.finished:
+                    self.end_block()
+                elif self.gc_control:
+                    collect_between_trials() # iti frame, not the next trial's first
+        elif self.next_course is None:
+            if self.block.next_ready():
+                self.build_next_course()
+        elif now-self.iti_start >= self.block.iti:
+            self.start_trial()
+
+    def update_gc(self):
+        # no trial gaps to collect in, collect what accumulated on a timer
+        if self.last_time-self.gc_time >= self.gc_interval:
+            self.gc_time = self.last_time
+            collect_between_trials()
+
+    def end_block(self):
+        self.block.save(self.block_log)
+        self.block.shutdown()
+        print('Block '+self.block_name+' done, '+str(len(self.block.trial_log))
+            +' trials logged to '+self.block_log)
+        self.quit()
+
+    def init_frame_log(self):
+        self.frame_log_name = self.config.get('frame_log', None)
+        self.frame_log = None
+        if self.frame_log_name is None:
+            return
+        self.frame_log_name = run_path(self.frame_log_name, self.run_name)
+        # read the shared keyboard arrays without the per-element lock
+        if hasattr(self.kb.all_pos, 'get_obj'):
+            self.log_kb_pos = np.frombuffer(self.kb.all_pos.get_obj(), dtype=np.float32)
+            self.log_kb_vel = np.frombuffer(self.kb.all_vel.get_obj(), dtype=np.float32)
+        else:
+            self.log_kb_pos = self.kb.all_pos
+            self.log_kb_vel = self.kb.all_vel
+        num_lanes = self.num_lanes if self.multi_marble else 0
+        self.frame_log = FrameLogger(self.frame_log_name,
+            frame_dtype(len(self.log_kb_pos), num_lanes),
+            info={'game': 'marble_game', 'config': self.args.config, 'run_name': self.run_name,
+                  'multi_marble': self.multi_marble, 'block': self.block_name,
+                  'display_hand': self.display_hand,
+                  'trough_speed': self.trough_speed, 'marble_base_ypos': self.marble_base_ypos,
+                  'kb_neutral_angle': self.kb_neutral_angle, 'angle_gain': self.angle_gain})
+
+    def log_frame(self):
+        if self.block is not None and self.block_state == 'trial':
+            trial = self.block.trial_idx
+        else:
+            trial = -1
+        if self.multi_marble:
+            self.frame_log.log((self.frame_count, self.last_time, self.frame_time,
+                self.course_ypos, trial, 0.0, 0.0, self.log_kb_pos, self.log_kb_vel,
+                self.marble_array.angles))
+        else:
+            self.frame_log.log((self.frame_count, self.last_time, self.frame_time,
+                self.course_ypos, trial, self.marble_angle, self.marble_velocity,
+                self.log_kb_pos, self.log_kb_vel))
+
+    def update_status(self):
+        # frame times over the history ring, keyboard loop rate since the last report
+        if self.last_time-self.status_time < self.status_interval:
+            return
+        self.status_time = self.last_time
+        frame_times = np.array(self.frame_history)
+        budget = 1.0/self.config.get('frame_rate',60)
+        status = {'pid': os.getpid(), 'time': self.last_time, 'frames': self.frame_count,
+            'mean_frame_ms': 1000*frame_times.mean(), 'max_frame_ms': 1000*frame_times.max(),
+            'dropped': int(np.count_nonzero(frame_times > 1.5*budget)),
+            'budget_ms': 1000*budget,
+            'kb_loop_hz': self.kb.loop_rate() if hasattr(self.kb, 'loop_rate') else None}
+        with open(self.status_file+'.tmp', 'w') as f:
+            json.dump(status, f)
+        os.replace(self.status_file+'.tmp', self.status_file)
+
+    def check_config(self):
+        for name, changes in self.config_watcher.get_changes():
+            if name == 'keyboard':
+                self.kb.update_config(changes)
+                if 'neutral_angle' in changes:
+                    self.kb_neutral_angle = changes['neutral_angle']
+                    if self.guidance is not None:
+                        self.start_guidance()
+            else:
+                self.apply_config(changes)
+
+    def apply_config(self, changes):
+        # only the groups the changed keys touch, geometry rebuilt once at the end
+        self.config.update(changes)
+        groups = set()
+        for key in changes:
+            if key in RELOAD_GROUPS:
+                groups.add(RELOAD_GROUPS[key])
+            else:
+                print('Game config: '+key+' changed, applies after a restart')
+        if 'window' in groups:
+            self.win.color = self.config['bg_color']
+        if 'troughs' in groups:
+            self.reload_troughs()
+        if 'course' in groups:
+            self.reload_course()
+        if 'marble' in groups:
+            self.reload_marble()
+        if 'budget' in groups:
+            self.frame_budget_on = self.config.get('frame_budget', False)
+            if 'detail_level' in changes:
+                self.frame_budget.level = min(max(self.config['detail_level'],0),
+                    len(self.frame_budget.levels)-1)
+                self.frame_budget.reset()
+        if groups & {'troughs','course','budget'}:
+            self.build_detail_sets()
+            self.apply_detail(self.frame_budget.detail)
+        if self.guidance is not None and groups & {'course','marble'}:
+            self.start_guidance()
+        if self.static_layer is not None:
+            self.static_layer.invalidate()
+        print('Game config: '+', '.join(sorted(changes))+' reloaded')
+
+    def reload_troughs(self):
+        self.trough_width = self.config['trough_width']
+        self.trough_edge_width = self.config['trough_edge_width']
+        self.trough_full_angle = self.config['trough_full_angle']
+        self.trough_color = self.config['trough_color']
+        self.trough_line_color = self.config['trough_line_color']
+        self.trough_edge_color = self.config['trough_edge_color']
+        self.marble_trough_rad = 0.5*self.trough_width/np.sin(np.deg2rad(0.5*self.trough_full_angle))
+        self.marble_roll_coef = 2*self.marble_trough_rad*math.pi/360
+        if self.marble_sprite_on:
+            self.marble_sprite.trough_rad = self.marble_trough_rad
+            self.marble_sprite.roll_coef = self.marble_roll_coef
+        if self.ghost is not None:
+            self.ghost.sprite.trough_rad = self.marble_trough_rad
+            self.ghost.sprite.roll_coef = self.marble_roll_coef
+        self.bg_grating.color = self.trough_color
+        self.lh_trough_rect.color = self.trough_edge_color
+        self.rh_trough_rect.color = self.trough_edge_color
+        if self.multi_marble:
+            self.init_lanes() # lane scale follows the trough width
+        else:
+            self.bg_grating.size = (self.trough_width,1.0)
+            self.lh_trough_rect.width = self.trough_edge_width
+            self.rh_trough_rect.width = self.trough_edge_width
+            self.lh_trough_rect.pos = (0.5*(self.trough_width+self.trough_edge_width),0)
+            self.rh_trough_rect.pos = (-0.5*(self.trough_width+self.trough_edge_width),0)
+        if self.block is not None:
+            self.course_rads = [self.marble_trough_rad]
+            if self.multi_marble:
+                self.course_rads.append(self.lane_trough_rad)
+
+    def reload_course(self):
+        # a new speed stretches the path; keep the marbles at the same course
+        # time and the scorers' running totals
+        old_speed = self.trough_speed
+        self.trough_speed = self.config['trough_speed']
+        self.course_color = self.config['course_color']
+        if self.trough_speed == old_speed:
+            return
+        course_y = self.marble_base_ypos-self.course_ypos
+        self.course_ypos = self.marble_base_ypos-course_y*self.trough_speed/old_speed
+        self.course_y_raw, self.course_angle_raw = gen_course_path(self.course_targets,
+            self.course_times, self.trough_speed)
+        self.course_index = CourseIndex(self.course_y_raw, self.course_angle_raw,
+            self.course_angle_width)
+        self.course_target_ys = self.trough_speed*np.asarray(self.course_times[2:-2])
+        scorers = self.lane_scorers if self.multi_marble else []
+        for scorer in [self.scorer]+scorers:
+            scorer.index = self.course_index
+            scorer.target_ys = [float(y) for y in self.course_target_ys]
+
+    def reload_marble(self):
+        self.angle_gain = self.config['kb_angle_gain']
+        self.marble_rota_coef = self.config['marble_rota_coef']
+        if self.multi_marble:
+            self.lane_gains = self.angle_gain*self.lane_signs
+            self.marble_array.rota_coef = self.marble_rota_coef
+        if self.marble_sprite_on:
+            self.marble_sprite.rota_coef = self.marble_rota_coef
+        if self.ghost is not None:
+            self.ghost.sprite.rota_coef = self.marble_rota_coef
+
+    def guide_start(self):
+        # perf_counter time at course time 0 under the marbles (course_ypos is
+        # as of last_time), shared with the keyboard process
+        course_time = (self.marble_base_ypos-self.course_ypos)/self.trough_speed
+        return time.perf_counter()-(self.clock.getTime()-self.last_time)-course_time
+
+    def start_guidance(self):
+        # the current course in finger degrees for the guided hand, sampled
+        # uniformly in time; the keyboard plays it back at servo rate
+        course_y, course_angle = gen_course_path(self.course_targets, self.course_times,
+            self.trough_speed, step_size=self.trough_speed/self.guide_table_rate)
+        sign = 1.0 if self.guidance == 'rh' else -1.0 # lh mirrored
+        ids = self.kb.config[self.guidance+'_ids']
+        finger_angles = self.kb_neutral_angle+sign*course_angle/self.angle_gain
+        self.kb.start_guidance({'ids': ids,
+            'angles': np.repeat(finger_angles[:,None], len(ids), axis=1),
+            'rate': self.guide_table_rate, 'start': self.guide_start()})
+
+    def init_lanes(self):
+        # lanes left-to-right follow map_to_screen, scaled down to fit the screen
+        self.num_lanes = len(self.kb.map_to_screen)
+        self.lane_fingers = np.argsort(self.kb.map_to_screen)
+        num_rh = len(self.kb.config['rh_ids'])
+        self.lane_signs = np.where(self.lane_fingers < num_rh, 1.0, -1.0) # lh mirrored
+        self.lane_gains = self.angle_gain*self.lane_signs
+        self.lane_angles = np.zeros(self.num_lanes, dtype=np.float32) # float32 like the shared arrays
+        self.lane_velocities = np.zeros(self.num_lanes, dtype=np.float32)
+        # zero-copy views of the shared keyboard arrays, if available
+        if hasattr(self.kb.all_pos, 'get_obj'):
+            self.kb_pos_view = np.frombuffer(self.kb.all_pos.get_obj(), dtype=np.float32)
+            self.kb_vel_view = np.frombuffer(self.kb.all_vel.get_obj(), dtype=np.float32)
+        else:
+            self.kb_pos_view = None
+            self.kb_vel_view = None
+        full_lane_width = self.trough_width+2*self.trough_edge_width
+        max_width = 0.95*self.win.size[0]/self.win.size[1]
+        self.lane_scale = min(1.0, max_width/(self.num_lanes*full_lane_width))
+        self.lane_width = self.lane_scale*full_lane_width
+        self.lane_xs = lane_positions(self.num_lanes, self.lane_width)
+        self.lane_trough_rad = self.lane_scale*self.marble_trough_rad
+
+        total_width = self.num_lanes*self.lane_width
+        self.bg_grating.size = (total_width-2*self.lane_scale*self.trough_edge_width,1.0)
+        self.lh_trough_rect.width = self.lane_scale*self.trough_edge_width
+        self.rh_trough_rect.width = self.lane_scale*self.trough_edge_width
+        self.lh_trough_rect.pos = (0.5*(total_width-self.lane_scale*self.trough_edge_width),0)
+        self.rh_trough_rect.pos = (-0.5*(total_width-self.lane_scale*self.trough_edge_width),0)
+
+        self.marble_array = MarbleArray(self.win, self.lane_xs,
+            radius=self.lane_scale*self.marble_rad, trough_rad=self.lane_trough_rad,
+            base_ypos=self.marble_base_ypos, color=self.marble_color,
+            border_color=self.marble_border_color, shadow_color=self.marble_shadow_color,
+            rota_coef=self.marble_rota_coef)
+        self.lane_scorers = [CourseScorer(self.course_index, self.course_target_ys)
+            for lane_x in self.lane_xs]
 
     def reset_course(self):
-        self.course_example.pos = (0,0.5)
+        self.course_ypos = 0.5
+        self.course_example.pos = (0,self.course_ypos)
+        self.scorer.reset()
+        if self.multi_marble:
+            self.lane_course.pos = (0,self.course_ypos)
+            for scorer in self.lane_scorers:
+                scorer.reset()
+        if self.guidance is not None:
+            self.kb.set_guide_start(self.guide_start())
+        if self.ghost is not None:
+            self.ghost.restart(self.last_time, self.block.trial_idx if self.block is not None else -1)
+
+    def update_score(self):
+        # course y currently under the marbles
+        course_y = self.marble_base_ypos-self.course_ypos
+        if self.multi_marble:
+            for idx, scorer in enumerate(self.lane_scorers):
+                scorer.update(course_y, self.marble_array.angles[idx], self.frame_time)
+        else:
+            self.scorer.update(course_y, self.marble_angle, self.frame_time)
 
     def update_frame_time(self):
-        self.frame_time = self.clock.getTime()-self.last_time
-        self.last_time = self.clock.getTime()
-        self.frame_history = np.roll(self.frame_history,1)
-        self.frame_history[0] = self.frame_time
-        self.frame_msg.text = str(np.round(1000*np.mean(self.frame_history),1))
+        now = self.clock.getTime()
+        self.frame_time = now-self.last_time
+        self.last_time = now
+        idx = self.frame_history_idx
+        self.frame_history_sum += self.frame_time-self.frame_history[idx]
+        self.frame_history[idx] = self.frame_time
+        self.frame_history_idx = (idx+1)%len(self.frame_history)
+        # text layout is expensive, only refresh it now and then
+        self.frame_count += 1
+        if self.frame_msg.autoDraw and self.frame_count%self.frame_msg_interval == 0:
+            self.frame_msg.text = '%.1f' % (1000*self.frame_history_sum/len(self.frame_history))
 
     def update_troughs(self):
-        self.course_example.pos = (0, self.course_example.pos[1]-self.frame_time*self.trough_speed)
-        self.troughs_ypos -= self.frame_time*self.trough_speed
+        scroll = self.frame_time*self.trough_speed
+        self.course_ypos -= scroll
+        self.course_example.pos = (0, self.course_ypos)
+        if self.multi_marble:
+            self.lane_course.pos = (0, self.course_ypos)
+        troughs_ypos = self.troughs_ypos
         for idx, trough in enumerate(self.troughs):
-            if self.troughs_ypos[idx] < -1:
-                self.troughs_ypos[idx] += 2
-            trough.pos = (0, self.troughs_ypos[idx])
+            ypos = troughs_ypos[idx]-scroll
+            if ypos < -1:
+                ypos += 2
+            troughs_ypos[idx] = ypos
+            trough.pos = (0, ypos)
+
+    def update_marbles(self):
+        # all lanes at once: finger angles to screen angles, lh mirrored
+        if self.kb_pos_view is not None:
+            np.take(self.kb_pos_view, self.lane_fingers, out=self.lane_angles)
+            np.take(self.kb_vel_view, self.lane_fingers, out=self.lane_velocities)
+        else:
+            for idx, finger in enumerate(self.lane_fingers):
+                self.lane_angles[idx] = self.kb.all_pos[finger]
+                self.lane_velocities[idx] = self.kb.all_vel[finger]
+        self.lane_angles -= self.kb_neutral_angle
+        self.lane_angles *= self.lane_gains
+        self.lane_velocities *= self.lane_gains
+        self.marble_array.update(self.lane_angles, self.lane_velocities,
+            self.frame_time, self.trough_speed)
 
     def update_marble(self):
+        if self.multi_marble:
+            self.update_marbles()
+            return
         # update angular position
-        all_angle_raw = self.kb.all_pos[:]
-        all_vel_raw = self.kb.all_vel[:]
         if self.display_hand == 'lh':
             motor_idx = 1
         else:
             motor_idx = 0
-        self.marble_angle = (all_angle_raw[motor_idx]-self.kb_neutral_angle)*self.angle_gain
-        self.marble_velocity = all_vel_raw[motor_idx]*self.angle_gain
+        self.marble_angle = (self.kb.all_pos[motor_idx]-self.kb_neutral_angle)*self.angle_gain
+        self.marble_velocity = self.kb.all_vel[motor_idx]*self.angle_gain
 
         if self.display_hand == 'lh':
             self.marble_angle = -self.marble_angle
             self.marble_velocity = -self.marble_velocity
 
-        self.marble_xpos = self.marble_trough_rad*np.sin(np.deg2rad(self.marble_angle))
-        self.marble_ypos = self.marble_base_ypos+self.marble_trough_rad*(1-np.cos(np.deg2rad(self.marble_angle)))
-        self.marble.pos = (self.marble_xpos,self.marble_ypos)
+        if self.ghost is not None:
+            self.ghost.update(self.last_time, self.frame_time, self.trough_speed)
+
+        if self.marble_sprite_on:
+            self.marble_sprite.update(self.marble_angle, self.marble_velocity,
+                self.frame_time, self.trough_speed)
+            self.marble_xpos = self.marble_sprite.xpos
+            self.marble_ypos = self.marble_sprite.ypos
+            return
+
+        angle_rad = math.radians(self.marble_angle)
+        cos_angle = math.cos(angle_rad)
+        self.marble_xpos = self.marble_trough_rad*math.sin(angle_rad)
+        self.marble_ypos = self.marble_base_ypos+self.marble_trough_rad*(1-cos_angle)
+        marble_pos = (self.marble_xpos,self.marble_ypos)
+        self.marble.pos = marble_pos
 
         # update marble shadow
-        self.marble_shadow.pos = (self.marble_xpos,self.marble_ypos)
-        self.marble_shadow.size = (1,1+(1-np.cos(np.deg2rad(self.marble_angle))))
+        self.marble_shadow.pos = marble_pos
+        self.marble_shadow.size = (1,2-cos_angle)
         self.marble_shadow.ori = 0.4*self.marble_angle
 
         # update rolling semicircs
-        y_distance_travelled = self.trough_speed*self.frame_time
-        yscale_travel_rough = y_distance_travelled/(0.4*self.marble_circ)
-        x_distance_travelled = 2*self.marble_trough_rad*np.pi*self.marble_velocity/360*self.frame_time
-        xscale_travel_rough = x_distance_travelled/(0.4*self.marble_circ)
+        yscale_travel_rough = self.trough_speed*self.frame_time*self.marble_roll_scale
+        xscale_travel_rough = (self.marble_roll_coef*self.marble_velocity
+            *self.frame_time*self.marble_roll_scale)
+        travel = math.sqrt(yscale_travel_rough*yscale_travel_rough
+            +xscale_travel_rough*xscale_travel_rough)
+        semicirc_ori = self.marble_rota_coef*self.marble_velocity
         for idx, marble_semicirc in enumerate(self.marble_semicircs):
-            # self.marble_yscales[idx] -= yscale_travel_rough
-            self.marble_yscales[idx] -= np.sqrt(yscale_travel_rough**2+xscale_travel_rough**2)
-            if self.marble_yscales[idx] < -1:
-                self.marble_yscales[idx] += 2
-            marble_semicirc.size = (1,np.sin(np.pi/2-(self.marble_yscales[idx]-1)*np.pi/2))
-            marble_semicirc.pos = (self.marble_xpos,self.marble_ypos)
-            marble_semicirc.ori = self.marble_rota_coef*self.marble_velocity
+            yscale = self.marble_yscales[idx]-travel
+            if yscale < -1:
+                yscale += 2
+            self.marble_yscales[idx] = yscale
+            marble_semicirc.size = (1,math.sin(0.5*math.pi-(yscale-1)*0.5*math.pi))
+            marble_semicirc.pos = marble_pos
+            marble_semicirc.ori = semicirc_ori
+
+    def detail_levels(self):
+        # levels the budget can move to, without it only the configured one
+        if self.frame_budget_on:
+            return self.frame_budget.levels
+        return [self.frame_budget.detail]
+
+    def shape_details(self):
+        return sorted(set([(detail['course_step'], detail['endcap_points'])
+            for detail in self.detail_levels()]))
+
+    def build_troughs(self, num_pts):
+        if self.multi_marble:
+            return [gen_lane_trough_shape(self.win, self.lane_xs,
+                full_angle_deg=self.trough_full_angle,
+                width=self.lane_scale*self.trough_width,
+                edge_width=self.lane_scale*self.trough_edge_width,
+                line_color=self.trough_line_color, num_pts=num_pts) for t in range(self.num_troughs)]
+        return [gen_trough_shape(self.win, full_angle_deg=self.trough_full_angle,
+            width=self.trough_width, edge_width=self.trough_edge_width,
+            line_color=self.trough_line_color, num_pts=num_pts) for t in range(self.num_troughs)]
+
+    def build_course_set(self, course_step, endcap_points):
+        # outlines of the current course at one level's vertex counts
+        course_y, course_angle = gen_course_path(self.course_targets,
+            self.course_times, self.trough_speed, step_size=course_step)
+        course_example = gen_course_shape(self.win,
+            course_y, course_angle,
+            self.marble_trough_rad, course_angle_width=self.course_angle_width,
+            ypos=self.course_ypos, endcap_points=endcap_points,
+            fill_color=self.course_color, line_color=self.course_color)
+        lane_course = None
+        if self.multi_marble:
+            lane_course = gen_lane_course_shape(self.win,
+                course_y, course_angle,
+                self.lane_trough_rad, self.lane_xs, course_angle_width=self.course_angle_width,
+                ypos=self.course_ypos, endcap_points=endcap_points,
+                fill_color=self.course_color)
+        return course_example, lane_course
+
+    def build_grating(self, grating_res):
+        return visual.GratingStim(self.win, texRes=grating_res,
+            color=self.trough_color, size=self.bg_grating.size, contrast=0.25)
+
+    def build_detail_sets(self):
+        # geometry, gratings and warp buffers for every level in reach, built at
+        # startup and on config edits (block courses between trials), so a level
+        # change in the frame that went over budget only swaps references
+        self.trough_sets = {}
+        self.course_sets = {}
+        self.bg_gratings = {self.bg_grating.texRes: self.bg_grating}
+        for detail in self.detail_levels():
+            if detail['num_pts'] not in self.trough_sets:
+                self.trough_sets[detail['num_pts']] = self.build_troughs(detail['num_pts'])
+            course_key = (detail['course_step'], detail['endcap_points'])
+            if course_key not in self.course_sets:
+                self.course_sets[course_key] = self.build_course_set(*course_key)
+            if self.static_layer is None and detail['grating_res'] not in self.bg_gratings:
+                self.bg_gratings[detail['grating_res']] = self.build_grating(detail['grating_res'])
+        if self.perspective_on:
+            self.warper.prepare_render_scales([detail['render_scale']
+                for detail in self.detail_levels()])
+
+    def apply_detail(self, detail):
+        # swap in the level's troughs, course outlines (scoring keeps the
+        # full-resolution course) and grating, and shrink/grow the fbo render
+        # area; only a level outside detail_levels (set directly) is built here
+        num_pts = detail['num_pts']
+        if num_pts not in self.trough_sets:
+            self.trough_sets[num_pts] = self.build_troughs(num_pts)
+        self.troughs = self.trough_sets[num_pts]
+        for idx, trough in enumerate(self.troughs):
+            trough.pos = (0, self.troughs_ypos[idx])
+        course_key = (detail['course_step'], detail['endcap_points'])
+        if course_key not in self.course_sets:
+            self.course_sets[course_key] = self.build_course_set(*course_key)
+        self.course_example, self.lane_course = self.course_sets[course_key]
+        self.course_example.pos = (0, self.course_ypos)
+        if self.multi_marble:
+            self.lane_course.pos = (0, self.course_ypos)
+        # a captured static layer draws the grating as one quad whatever its
+        # texture size; swapping it would only force a full-window recapture
+        if self.static_layer is None:
+            grating_res = detail['grating_res']
+            if grating_res not in self.bg_gratings:
+                self.bg_gratings[grating_res] = self.build_grating(grating_res)
+            self.bg_grating = self.bg_gratings[grating_res]
+        if self.perspective_on:
+            self.render_scale = detail['render_scale']
+            self.warper.set_render_scale(self.render_scale)
+            self.render_viewport = [0,0,int(self.render_scale*self.full_viewport[2]),
+                int(self.render_scale*self.full_viewport[3])]
+
+    def update_detail(self):
+        # work done this frame so far, against the budget
+        work_time = self.clock.getTime()-self.last_time
+        if self.frame_budget.update(work_time, self.frame_time):
+            self.apply_detail(self.frame_budget.detail)
+
+    def draw_frame(self):
+        if self.static_layer is not None:
+            self.static_layer.prepare()
+        if self.render_scale < 1.0:
+            self.win.viewport = self.win.scissor = self.render_viewport
+            self.draw_scene()
+            self.win.viewport = self.win.scissor = self.full_viewport
+        else:
+            self.draw_scene()
+
+    def draw_scene(self):
+        if self.static_layer is not None:
+            self.static_layer.draw()
+        else:
+            self.bg_grating.draw()
+            self.lh_trough_rect.draw()
+            self.rh_trough_rect.draw()
+        for trough in self.troughs:
+            trough.draw()
+        if self.multi_marble:
+            self.lane_course.draw()
+            self.marble_array.draw()
+            return
+        self.course_example.draw()
+        if self.ghost is not None:
+            self.ghost.draw()
+        if self.marble_sprite_on:
+            self.marble_sprite.draw()
+            return
+        self.marble_shadow.draw()
+        self.marble.draw()
+        for marble_semicirc in self.marble_semicircs:
+            marble_semicirc.draw()
 
     # main event loop
     def run_main_loop(self):
+        self.finish_startup()
+        if self.block is not None:
+            self.start_block()
+        if self.gc_control:
+            freeze_gc()
         while self.game_running:
             self.update_frame_time()
-            self.bg_grating.draw()
-            self.lh_trough_rect.draw()
-            self.rh_trough_rect.draw()
             self.update_troughs()
-            for trough in self.troughs:
-                trough.draw()
-            self.course_example.draw()
             self.update_marble()
-            self.marble_shadow.draw()
-            self.marble.draw()
-            for marble_semicirc in self.marble_semicircs:
-                marble_semicirc.draw()
+            self.update_score()
+            if self.block is not None:
+                self.update_block()
+            elif self.gc_control:
+                self.update_gc()
+            if self.frame_log is not None:
+                self.log_frame()
+            if self.config_watcher is not None:
+                self.check_config()
+            if self.status_file is not None:
+                self.update_status()
+            self.draw_frame()
+            if self.frame_budget_on:
+                self.update_detail()
             self.win.flip()
 
     def quit(self):
         self.game_running = False
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        if self.frame_log is not None:
+            self.frame_log.close()
+        if self.gc_control:
+            release_gc()
         core.quit()
 
 if __name__ == '__main__':
-    game = MarbleGame()
+    game = MarbleGame(parse_args())
     game.run_main_loop()
@@ -0,0 +1,256 @@
+import math
+import numpy as np
+from scipy.spatial import cKDTree
+from psychopy import visual
+
+def gen_arc_mask(res=64, line_width=0.08):
+    # lower semicircle outline at the element edge, for the rolling stripe
+    coords = np.linspace(-1,1,res)
+    xs, ys = np.meshgrid(coords,-coords)
+    dist = np.sqrt(xs**2+ys**2)
+    mask = np.where((np.abs(dist-(1-line_width))<line_width)&(ys<=0),1.0,-1.0)
+    return mask
+
+def lane_positions(num_lanes, lane_spacing):
+    return (np.arange(num_lanes)-0.5*(num_lanes-1))*lane_spacing
+
+# all marbles of a multi-finger course, one element per marble in each layer
+class MarbleArray(object):
+    def __init__(self, win, lane_xs, radius=0.03, trough_rad=0.5, base_ypos=-0.35,
+            color=[0.3,0.3,0.6], border_color=[0.0,0.0,0.6], shadow_color=[-0.2,-0.2,-0.2],
+            border_width=1.5, shadow_opacity=0.25, rota_coef=1):
+        self.win = win
+        self.lane_xs = np.asarray(lane_xs, dtype=float)
+        self.num_marbles = len(self.lane_xs)
+        self.radius = radius
+        self.circ = 2*np.pi*radius
+        self.trough_rad = trough_rad
+        self.base_ypos = base_ypos
+        self.rota_coef = rota_coef
+        border = border_width/win.size[1] # pixels to height units
+
+        # marble state, one entry per lane
+        self.angles = np.zeros(self.num_marbles)
+        self.velocities = np.zeros(self.num_marbles)
+        self.yscales = np.ones(self.num_marbles)
+        self.xys = np.zeros((self.num_marbles,2))
+        self.shadow_xys = np.zeros((self.num_marbles,2))
+        self.shadow_sizes = np.zeros((self.num_marbles,2))
+        self.semicirc_sizes = np.zeros((self.num_marbles,2))
+        self.semicirc_sizes[:,0] = 2*radius
+        self.shadow_sizes[:,0] = 1.8*radius
+        self.shadow_oris = np.zeros(self.num_marbles)
+        self.semicirc_oris = np.zeros(self.num_marbles)
+        self.scratch = np.zeros((4,self.num_marbles))
+
+        n = self.num_marbles
+        self.shadow = visual.ElementArrayStim(win, units='height', nElements=n,
+            xys=self.xys, sizes=1.8*radius, colors=shadow_color, opacities=shadow_opacity,
+            elementTex=None, elementMask='circle', fieldShape='sqr', texRes=64)
+        self.border = visual.ElementArrayStim(win, units='height', nElements=n,
+            xys=self.xys, sizes=2*radius+border, colors=border_color,
+            elementTex=None, elementMask='circle', fieldShape='sqr', texRes=64)
+        self.fill = visual.ElementArrayStim(win, units='height', nElements=n,
+            xys=self.xys, sizes=2*radius-border, colors=color,
+            elementTex=None, elementMask='circle', fieldShape='sqr', texRes=64)
+        self.semicircs = visual.ElementArrayStim(win, units='height', nElements=n,
+            xys=self.xys, sizes=2*radius, colors=border_color,
+            elementTex=None, elementMask=gen_arc_mask(), fieldShape='sqr', texRes=64)
+        self.update(self.angles, self.velocities, 0.0, 0.0)
+
+    def update(self, angles, velocities, frame_time, trough_speed):
+        # scratch buffers are reused, no per-frame numpy temporaries
+        self.angles[:] = angles
+        self.velocities[:] = velocities
+        angles_rad = np.deg2rad(self.angles, out=self.scratch[0])
+        drop = np.cos(angles_rad, out=self.scratch[1])
+        np.subtract(1, drop, out=drop)
+
+        # positions along each lane's trough
+        xs = self.xys[:,0]
+        ys = self.xys[:,1]
+        np.sin(angles_rad, out=xs)
+        xs *= self.trough_rad
+        xs += self.lane_xs
+        np.multiply(drop, self.trough_rad, out=ys)
+        ys += self.base_ypos
+
+        # shadows: offset ellipse stretched with angle, rotated about the marble centre
+        np.multiply(self.angles, 0.4, out=self.shadow_oris)
+        shadow_yscale = np.add(drop, 1, out=self.scratch[2])
+        np.multiply(shadow_yscale, 1.8*self.radius, out=self.shadow_sizes[:,1])
+        offset = np.multiply(shadow_yscale, -0.4*self.radius, out=self.scratch[3])
+        shadow_oris_rad = np.deg2rad(self.shadow_oris, out=self.scratch[0])
+        np.sin(shadow_oris_rad, out=self.shadow_xys[:,0])
+        self.shadow_xys[:,0] *= offset
+        self.shadow_xys[:,0] += xs
+        np.cos(shadow_oris_rad, out=self.shadow_xys[:,1])
+        self.shadow_xys[:,1] *= offset
+        self.shadow_xys[:,1] += ys
+
+        # rolling semicircs
+        yscale_travel = trough_speed*frame_time/(0.4*self.circ)
+        travel = np.multiply(self.velocities, 2*self.trough_rad*np.pi/360*frame_time/(0.4*self.circ),
+            out=self.scratch[0])
+        np.hypot(travel, yscale_travel, out=travel)
+        self.yscales -= travel
+        self.yscales[self.yscales < -1] += 2
+        phase = np.multiply(self.yscales, -0.5*np.pi, out=self.scratch[1])
+        phase += np.pi
+        np.sin(phase, out=self.semicirc_sizes[:,1])
+        self.semicirc_sizes[:,1] *= 2*self.radius
+        np.multiply(self.velocities, self.rota_coef, out=self.semicirc_oris)
+
+        self.shadow.xys = self.shadow_xys
+        self.shadow.sizes = self.shadow_sizes
+        self.shadow.oris = self.shadow_oris
+        self.border.xys = self.xys
+        self.fill.xys = self.xys
+        self.semicircs.xys = self.xys
+        self.semicircs.sizes = self.semicirc_sizes
+        self.semicircs.oris = self.semicirc_oris
+
+    def draw(self):
+        self.shadow.draw()
+        self.border.draw()
+        self.fill.draw()
+        self.semicircs.draw()
+
+def gen_marble_sprites(res=128, num_phases=32, color=[0.3,0.3,0.6], border_color=[0.0,0.0,0.6],
+        border_frac=0.05, stripe_frac=0.05, curve_pts=512):
+    # ball, border and rolling stripe pre-rendered for each roll phase, in units
+    # of the marble radius; rgb images in [-1,1] plus one shared alpha mask
+    extent = 1+border_frac
+    coords = np.linspace(-extent,extent,res)
+    xs, ys = np.meshgrid(coords,-coords)
+    dist = np.sqrt(xs**2+ys**2)
+    pixel = 2*extent/res
+    mask = np.clip((1+0.5*border_frac-dist)/pixel+0.5,0,1)
+    border = np.clip((0.5*border_frac-np.abs(dist-1))/pixel+0.5,0,1)
+
+    # stripe: lower semicircle squashed vertically by the phase, as the semicircs
+    curve_angles = np.linspace(np.pi,2*np.pi,curve_pts)
+    pts = np.stack([xs.ravel(),ys.ravel()],axis=1)
+    color = np.asarray(color, dtype=float)
+    border_color = np.asarray(border_color, dtype=float)
+    images = np.zeros((num_phases,res,res,3))
+    for phase in range(num_phases):
+        yscale = 1-2*phase/num_phases
+        squash = np.sin(0.5*np.pi-(yscale-1)*0.5*np.pi)
+        curve = np.stack([np.cos(curve_angles),squash*np.sin(curve_angles)],axis=1)
+        curve_dist = cKDTree(curve).query(pts, distance_upper_bound=stripe_frac+pixel)[0]
+        stripe = np.clip((0.5*stripe_frac-curve_dist.reshape(res,res))/pixel+0.5,0,1)
+        line = np.maximum(border,stripe)[:,:,None]
+        images[phase] = (1-line)*color+line*border_color
+    return images, 2*mask-1
+
+def gen_sprite_atlas(images):
+    # sprites side by side in one square power-of-two texture, plus a plain
+    # white cell last (tinted by element colour, for the shadow); returns the
+    # atlas, the grid size and each cell's element phase (texture offset)
+    num_cells = len(images)+1
+    res = images.shape[1]
+    cols = 2**int(math.ceil(math.log2(math.ceil(math.sqrt(num_cells)))))
+    atlas = np.ones((cols*res,cols*res,3))
+    cell_phases = np.zeros((num_cells,2))
+    for idx in range(num_cells):
+        row, col = divmod(idx, cols)
+        if idx < len(images):
+            atlas[row*res:(row+1)*res,col*res:(col+1)*res] = images[idx]
+        cell_phases[idx] = [0.5-(col+0.5)/cols, 0.5-(row+0.5)/cols]
+    return atlas, cols, cell_phases
+
+# single marble drawn from one atlas texture: shadow and ball are the two
+# elements of one array stim, the roll phase picks the ball's atlas cell
+class MarbleSprite(object):
+    def __init__(self, win, radius=0.03, trough_rad=0.5, base_ypos=-0.35,
+            color=[0.3,0.3,0.6], border_color=[0.0,0.0,0.6], shadow_color=[-0.2,-0.2,-0.2],
+            border_width=1.5, shadow_opacity=0.25, rota_coef=1, num_phases=32, res=128,
+            opacity=1.0, shadow=True):
+        self.win = win
+        self.radius = radius
+        self.circ = 2*math.pi*radius
+        self.trough_rad = trough_rad
+        self.base_ypos = base_ypos
+        self.rota_coef = rota_coef
+        self.num_phases = num_phases
+        self.roll_scale = 1/(0.4*self.circ) # distance to stripe phase
+        self.roll_coef = 2*trough_rad*math.pi/360 # deg/sec to distance/sec
+        border_frac = border_width/(win.size[1]*radius) # pixels to radius units
+
+        self.angle = 0.0
+        self.velocity = 0.0
+        self.yscale = 1.0
+        self.xpos = 0.0
+        self.ypos = base_ypos
+        self.phase = 0
+
+        # the atlas is uploaded once, each frame only moves the quads and
+        # their texture offsets
+        images, mask = gen_marble_sprites(res, num_phases, color, border_color,
+            border_frac, border_frac)
+        atlas, cols, self.cell_phases = gen_sprite_atlas(images)
+        self.shadow_on = shadow
+        n = 2 if shadow else 1
+        self.ball = n-1 # element index, drawn after the shadow
+        size = 2*radius*(1+border_frac)
+        self.xys = np.zeros((n,2))
+        self.xys[:,1] = base_ypos
+        self.sizes = np.full((n,2), size)
+        self.oris = np.zeros(n)
+        self.phases = np.tile(self.cell_phases[0], (n,1))
+        colors = [[1.0,1.0,1.0]]
+        opacities = [opacity]
+        if shadow:
+            self.sizes[0] = 1.8*radius
+            self.phases[0] = self.cell_phases[-1]
+            colors.insert(0, shadow_color)
+            opacities.insert(0, opacity*shadow_opacity)
+        self.stim = visual.ElementArrayStim(win, units='height', nElements=n,
+            xys=self.xys, sizes=self.sizes, oris=self.oris, sfs=1/cols, phases=self.phases,
+            colors=colors, opacities=opacities, elementTex=atlas, elementMask=mask,
+            fieldShape='sqr', texRes=atlas.shape[0], interpolate=True)
+
+    def update(self, angle, velocity, frame_time, trough_speed):
+        self.angle = angle
+        self.velocity = velocity
+        angle_rad = math.radians(angle)
+        drop = 1-math.cos(angle_rad)
+        self.xpos = self.trough_rad*math.sin(angle_rad)
+        self.ypos = self.base_ypos+self.trough_rad*drop
+        xys = self.xys
+        oris = self.oris
+        ball = self.ball
+
+        # shadow: offset ellipse stretched with angle, rotated about the marble centre
+        if self.shadow_on:
+            shadow_ori = 0.4*angle
+            shadow_yscale = 1+drop
+            offset = -0.4*self.radius*shadow_yscale
+            shadow_ori_rad = math.radians(shadow_ori)
+            xys[0,0] = self.xpos+offset*math.sin(shadow_ori_rad)
+            xys[0,1] = self.ypos+offset*math.cos(shadow_ori_rad)
+            self.sizes[0,1] = 1.8*self.radius*shadow_yscale
+            oris[0] = shadow_ori
+            self.stim.sizes = self.sizes
+
+        # roll phase picks the atlas cell, the stripe direction is a rotation
+        yscale_travel = trough_speed*frame_time*self.roll_scale
+        xscale_travel = self.roll_coef*velocity*frame_time*self.roll_scale
+        yscale = self.yscale-math.sqrt(yscale_travel*yscale_travel+xscale_travel*xscale_travel)
+        if yscale < -1:
+            yscale += 2
+        self.yscale = yscale
+        phase = int(0.5*(1-yscale)*self.num_phases)%self.num_phases
+        if phase != self.phase:
+            self.phase = phase
+            self.phases[ball] = self.cell_phases[phase]
+            self.stim.phases = self.phases
+        xys[ball,0] = self.xpos
+        xys[ball,1] = self.ypos
+        oris[ball] = self.rota_coef*velocity
+        self.stim.xys = xys
+        self.stim.oris = oris
+
+    def draw(self):
+        self.stim.draw()
@@ -0,0 +1,201 @@
+import os, sys, time, json, timeit, argparse, platform
+from functools import partial
+import numpy as np
+from headless import *
+from course import *
+from perspective import *
+from keyboard import *
+from render_benchmark import git_version
+
+# per-call timings of the numerical and servo codec functions on the hot and
+# startup paths, compared against a stored per-machine baseline
+#
+# groups: 'numeric' (numpy/scipy only) and 'shapes' (psychopy stims, opens a
+# headless window); a case regresses when its best time is over the baseline's
+# by more than the tolerance
+#
+# cases: name -> (call, fresh); fresh cases give a setup returning the call
+# instead, for functions that change their inputs, timed one call per repeat
+
+GROUPS = ['numeric','shapes']
+COURSE_LENGTHS = [5,20,80] # targets
+RECORDING_LENGTHS = [1000,10000,60000] # servo samples
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks with baseline comparison')
+    parser.add_argument('-g','--groups', help='Case groups', nargs='+', default=GROUPS, choices=GROUPS)
+    parser.add_argument('-k','--cases', help='Only cases containing one of these', nargs='+', default=None)
+    parser.add_argument('-n','--repeats', help='Timed repeats per case', type=int, default=7)
+    parser.add_argument('-o','--output', help='Results file (json)', default='micro_benchmark.json')
+    parser.add_argument('-b','--baseline', help='Baseline file (json)',
+        default=os.path.join('config','baselines',platform.node()+'.json'))
+    parser.add_argument('--save-baseline', help='Store this run as the baseline', action='store_true', default=False)
+    parser.add_argument('-t','--tolerance', help='Allowed slowdown before a case regresses', type=float, default=0.2)
+    parser.add_argument('--hardware-gl', help='Use the GPU driver instead of llvmpipe', action='store_true', default=False)
+    return parser.parse_args()
+
+def random_course(num_targets, seed=0):
+    rng = np.random.default_rng(seed)
+    return build_course(rng.uniform(-35,35,num_targets).round(1).tolist(), 1.0, 0.5)
+
+def bare_keyboard(num_fingers=2, num_samples=0, seed=0):
+    # KeyboardAsync state without the serial port, recording filled with a
+    # sweep whose servo tick wraps like a real one
+    kb = KeyboardAsync.__new__(KeyboardAsync)
+    kb.neutral_angle = 202.5
+    kb.min_angle = kb.neutral_angle-22.5
+    kb.max_angle = kb.neutral_angle+22.5
+    kb.velocity_gain = 0.15
+    kb.all_ids = list(range(101,101+num_fingers))
+    rng = np.random.default_rng(seed)
+    ticks = (np.cumsum(rng.integers(1,3,num_samples))+30000)%MAX_TIME_CORRECT
+    kb.recorded_time_ms = ticks.tolist()
+    kb.recorded_pos_deg = {dxl_id: (kb.neutral_angle+20*np.sin(0.002*np.arange(num_samples))).tolist()
+        for dxl_id in kb.all_ids}
+    kb.recorded_vel_rpm = {dxl_id: (5*np.cos(0.002*np.arange(num_samples))).tolist()
+        for dxl_id in kb.all_ids}
+    return kb
+
+def replay_case(num_samples):
+    # prep_for_replay trims the recording in place, time it on a fresh copy
+    source = bare_keyboard(num_samples=num_samples)
+    def setup():
+        kb = bare_keyboard()
+        kb.all_ids = source.all_ids
+        kb.recorded_time_ms = list(source.recorded_time_ms)
+        kb.recorded_pos_deg = {dxl_id: list(pos) for dxl_id, pos in source.recorded_pos_deg.items()}
+        kb.recorded_vel_rpm = {dxl_id: list(vel) for dxl_id, vel in source.recorded_vel_rpm.items()}
+        return partial(kb.prep_for_replay, 500)
+    return setup, True
+
+def numeric_cases():
+    cases = {}
+    for num_targets in COURSE_LENGTHS:
+        course_targets, course_times = random_course(num_targets)
+        cases['gen_course_path_'+str(num_targets)] = (partial(gen_course_path,
+            course_targets, course_times, 0.25), False)
+        course_y, course_angle = gen_course_path(course_targets, course_times, 0.25)
+        cases['gen_course_vertices_'+str(num_targets)] = (partial(gen_course_vertices,
+            course_y, course_angle, 0.53, 15, 10), False)
+    cases['raw_to_deg'] = (partial(raw_to_deg, 2304), False)
+    cases['raw_to_rpm'] = (partial(raw_to_rpm, 40), False)
+    cases['raw_to_rpm_negative'] = (partial(raw_to_rpm, MAX_VELOCITY-40), False)
+    cases['deg_to_byte'] = (partial(deg_to_byte, 202.5), False)
+    cases['convert4byte'] = (partial(convert4byte, 2304), False)
+    cases['mirror_angle'] = (partial(bare_keyboard().mirror_angle, 210.0, 12.0), False)
+    for num_samples in RECORDING_LENGTHS:
+        cases['prep_for_replay_'+str(num_samples)] = replay_case(num_samples)
+    cases['solve_homography'] = (partial(solve_homography,
+        np.array([[0,0],[0,1],[1,1],[1,0]], dtype=float), np.array(PERSPECTIVE_CORNERS, dtype=float)), False)
+    cases['gen_warp_mesh'] = (partial(gen_warp_mesh, 16/9, PERSPECTIVE_CORNERS, PERSPECTIVE_GRID), False)
+    cases['gen_warp_mesh_fine'] = (partial(gen_warp_mesh, 16/9, PERSPECTIVE_CORNERS, [400,240]), False)
+    return cases
+
+def shape_cases(win):
+    from marble_game import gen_course_shape, gen_trough_shape
+    from demo_wedge_game import gen_wedge_shape, gen_key_shape
+    cases = {}
+    for num_targets in COURSE_LENGTHS:
+        course_targets, course_times = random_course(num_targets)
+        course_y, course_angle = gen_course_path(course_targets, course_times, 0.25)
+        cases['gen_course_shape_'+str(num_targets)] = (partial(gen_course_shape,
+            win, course_y, course_angle, 0.53), False)
+    cases['gen_trough_shape'] = (partial(gen_trough_shape, win, 90, 0.75, 0.04), False)
+    cases['gen_trough_shape_fine'] = (partial(gen_trough_shape, win, 90, 0.75, 0.04, num_pts=120), False)
+    cases['gen_wedge_shape'] = (partial(gen_wedge_shape, win, 0.8), False)
+    cases['gen_key_shape'] = (partial(gen_key_shape, win), False)
+    return cases
+
+def time_case(case, fresh=False, repeats=7):
+    # per-call seconds: autoranged ~0.2 s batches, or one call per fresh setup
+    if fresh:
+        times = []
+        for repeat in range(repeats):
+            func = case()
+            start_time = time.perf_counter()
+            func()
+            times.append(time.perf_counter()-start_time)
+        return np.array(times), 1
+    timer = timeit.Timer(case)
+    number, total = timer.autorange()
+    number = max(1, int(number*0.2/max(total,1e-9)))
+    return np.array(timer.repeat(repeats, number))/number, number
+
+def run_cases(cases, repeats=7, selected=None):
+    results = {}
+    for name, (case, fresh) in cases.items():
+        if selected is not None and not any([pattern in name for pattern in selected]):
+            continue
+        times, number = time_case(case, fresh, repeats)
+        results[name] = {'best_us': 1e6*times.min(), 'median_us': 1e6*np.median(times),
+            'calls': number*repeats}
+        print('%-28s %12.3f us' % (name, results[name]['best_us']))
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    # rows of (case, baseline us, current us, ratio, status)
+    rows = []
+    for name in sorted(set(results) | set(baseline)):
+        if name not in baseline:
+            rows.append((name, None, results[name]['best_us'], None, 'new'))
+        elif name not in results:
+            rows.append((name, baseline[name]['best_us'], None, None, 'not run'))
+        else:
+            ratio = results[name]['best_us']/baseline[name]['best_us']
+            if ratio > 1+tolerance:
+                status = 'REGRESSION'
+            elif ratio < 1/(1+tolerance):
+                status = 'faster'
+            else:
+                status = 'ok'
+            rows.append((name, baseline[name]['best_us'], results[name]['best_us'], ratio, status))
+    return rows
+
+def print_report(rows, baseline_info):
+    print('\nagainst '+str(baseline_info.get('version'))+' ('+str(baseline_info.get('timestamp'))+')')
+    print('%-28s %12s %12s %7s  %s' % ('case','baseline us','current us','ratio','status'))
+    for name, base_us, current_us, ratio, status in rows:
+        print('%-28s %12s %12s %7s  %s' % (name,
+            '-' if base_us is None else '%.3f' % base_us,
+            '-' if current_us is None else '%.3f' % current_us,
+            '-' if ratio is None else '%.2f' % ratio, status))
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {'version': git_version(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'platform': platform.platform(),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'cases': {}}
+    if 'numeric' in args.groups:
+        results['cases'].update(run_cases(numeric_cases(), args.repeats, args.cases))
+    if 'shapes' in args.groups:
+        if not args.hardware_gl:
+            use_software_gl()
+        xvfb = start_virtual_display()
+        try:
+            from psychopy import visual
+            win = visual.Window(size=(1280,720), units='height', **headless_win_options())
+            results['cases'].update(run_cases(shape_cases(win), args.repeats, args.cases))
+            win.close()
+        finally:
+            stop_virtual_display(xvfb)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline saved to '+args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results['cases'], baseline['cases'], args.tolerance)
+        print_report(rows, baseline)
+        if any([row[4] == 'REGRESSION' for row in rows]):
+            sys.exit(1)
+    else:
+        print('No baseline at '+args.baseline+', store one with --save-baseline')
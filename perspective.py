@@ -0,0 +1,87 @@
+import os, zipfile, hashlib
+import numpy as np
+
+# default calibration, matches the original map_perspective.py output
+SCREEN_CORNERS_UNIT = [[-1,-1],[-1,1],[1,1],[1,-1]] # bl, tl, tr, br (x scaled by aspect)
+PERSPECTIVE_CORNERS = [[-0.25,0],[-0.75,1],[1.75,1],[1.25,0]] # texture coords at screen corners
+PERSPECTIVE_GRID = [100,60] # warp mesh points (x,y)
+CACHE_FNAME = os.path.join('config','perspective.npz')
+
+def solve_homography(src, dst):
+    # src, dst: (...,4,2) point correspondences, returns (...,3,3) with H[2,2] = 1
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    xs, ys = src[...,0], src[...,1]
+    us, vs = dst[...,0], dst[...,1]
+    ones = np.ones_like(xs)
+    zeros = np.zeros_like(xs)
+    # u = (h0*x+h1*y+h2)/(h6*x+h7*y+1), v = (h3*x+h4*y+h5)/(h6*x+h7*y+1)
+    rows_u = np.stack([xs,ys,ones,zeros,zeros,zeros,-us*xs,-us*ys],axis=-1)
+    rows_v = np.stack([zeros,zeros,zeros,xs,ys,ones,-vs*xs,-vs*ys],axis=-1)
+    a_mat = np.concatenate([rows_u,rows_v],axis=-2)
+    b_vec = np.concatenate([us,vs],axis=-1)
+    h_vec = np.linalg.solve(a_mat,b_vec[...,None])[...,0]
+    h_vec = np.concatenate([h_vec,np.ones(h_vec.shape[:-1]+(1,))],axis=-1)
+    return h_vec.reshape(h_vec.shape[:-1]+(3,3))
+
+def apply_homography(trans_mat, pts):
+    # pts: (n,2) -> (n,2)
+    pts = np.asarray(pts, dtype=np.float64)
+    res = pts@trans_mat[:,:2].T+trans_mat[:,2]
+    return res[:,:2]/res[:,2:]
+
+def gen_warp_mesh(aspect=16/9, perspective_corners=PERSPECTIVE_CORNERS,
+        grid=PERSPECTIVE_GRID):
+    # rows of [x, y, u, v, opacity], x fastest, as in the warpfile format
+    x_grid_pts, y_grid_pts = grid
+    full_screen = np.array(SCREEN_CORNERS_UNIT, dtype=np.float64)*[aspect,1]
+    trans_mat = solve_homography(full_screen, perspective_corners)
+
+    x_pts = np.linspace(-aspect,aspect,x_grid_pts)
+    y_pts = np.linspace(-1,1,y_grid_pts)
+    grid_xs, grid_ys = np.meshgrid(x_pts,y_pts)
+    mesh = np.ones((x_grid_pts*y_grid_pts,5), dtype=np.float32)
+    mesh[:,0] = grid_xs.ravel()
+    mesh[:,1] = grid_ys.ravel()
+    mesh[:,2:4] = apply_homography(trans_mat, mesh[:,:2].astype(np.float64))
+    return mesh
+
+def warp_mesh_key(aspect, perspective_corners, grid):
+    params = np.concatenate([[aspect],np.ravel(perspective_corners),np.ravel(grid)]).astype(np.float64)
+    return hashlib.sha1(params.tobytes()).hexdigest()
+
+def load_warp_mesh(aspect=16/9, perspective_corners=PERSPECTIVE_CORNERS,
+        grid=PERSPECTIVE_GRID, cache_fname=CACHE_FNAME):
+    # reuse the binary cache if it was built for the same display/calibration
+    key = warp_mesh_key(aspect, perspective_corners, grid)
+    try:
+        with np.load(cache_fname) as cache:
+            if str(cache['key']) == key:
+                return cache['mesh']
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        pass # missing, stale or damaged, regenerate
+    mesh = gen_warp_mesh(aspect, perspective_corners, grid)
+    # written aside and moved into place, so a killed or concurrent writer
+    # never leaves a partial cache behind
+    tmp_fname = cache_fname+'.'+str(os.getpid())+'.tmp'
+    try:
+        with open(tmp_fname, 'wb') as f:
+            np.savez(f, key=key, mesh=mesh)
+        os.replace(tmp_fname, cache_fname)
+    except OSError:
+        print('Could not write warp mesh cache '+cache_fname)
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+    return mesh
+
+def mesh_to_quads(mesh, grid):
+    # expand grid points into per-quad vertices, texture coords and RGBA opacity
+    cols, rows = grid
+    idx = np.arange(rows*cols).reshape(rows,cols)[:-1,:-1].ravel()
+    corners = np.stack([idx,idx+1,idx+cols+1,idx+cols],axis=-1).ravel()
+    quads = mesh[corners]
+    vertices = np.ascontiguousarray(quads[:,0:2], dtype=np.float32)
+    tcoords = np.ascontiguousarray(quads[:,2:4], dtype=np.float32)
+    opacity = np.ones((len(corners),4), dtype=np.float32)
+    opacity[:,3] = quads[:,4]
+    return vertices, tcoords, opacity
@@ -0,0 +1,165 @@
+import gc, os, sys, time, json, argparse, platform, subprocess, importlib, tracemalloc
+import numpy as np
+from headless import *
+from gc_control import *
+
+# scene name: (module, class, default config, scripted input type, keyboard config)
+SCENES = {
+    'marble': ('marble_game', 'MarbleGame', 'demo', 'kb', 'keyboard'),
+    'marble_multi': ('marble_game', 'MarbleGame', 'multi_demo', 'kb', 'keyboard_ten'),
+    'spoof': ('spoof_game', 'MarbleGame', 'spoof_demo', 'keys', None),
+    'wedge': ('demo_wedge_game', 'WedgeGame', 'wedge_demo', 'kb', 'keyboard'),
+    'spoof_wedge': ('spoof_wedge_game', 'WedgeGame', 'wedge_demo', 'keys', None),
+}
+UPDATE_STAGES = ['check_keys','update_troughs','update_marble','update_score','update_wedge','update_targets']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Headless render benchmark')
+    parser.add_argument('-s','--scenes', help='Scenes to run', nargs='+',
+        default=list(SCENES), choices=list(SCENES))
+    parser.add_argument('-n','--frames', help='Measured frames per scene', type=int, default=600)
+    parser.add_argument('-w','--warmup', help='Unmeasured warmup frames', type=int, default=60)
+    parser.add_argument('-r','--rate', help='Virtual frame rate (Hz)', type=float, default=60.0)
+    parser.add_argument('-o','--output', help='Results file (json)', default='render_benchmark.json')
+    parser.add_argument('-p','--perspective', help='Perspective mode', action='store_false', default=True)
+    parser.add_argument('--hardware-gl', help='Use the GPU driver instead of llvmpipe', action='store_true', default=False)
+    parser.add_argument('-d','--detail-level', help='Fixed detail level (frame_budget.DETAIL_LEVELS)', type=int, default=None)
+    parser.add_argument('--allocs', help='Count per-stage allocations (slower, separate pass)', action='store_true', default=False)
+    return parser.parse_args()
+
+def git_version():
+    try:
+        return subprocess.check_output(['git','describe','--always','--dirty'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def build_scene(scene, perspective=True):
+    module_name, class_name, config, input_type, kb_config = SCENES[scene]
+    game_class = getattr(importlib.import_module(module_name), class_name)
+    if input_type == 'kb':
+        from scripted_input import ScriptedKeyboard
+        source = ScriptedKeyboard(kb_config)
+        kwargs = {'kb': source}
+    else:
+        from scripted_input import ScriptedKeys
+        source = ScriptedKeys()
+        kwargs = {'key_input': source}
+    game_args = argparse.Namespace(config=config, fullscreen=False, perspective=perspective)
+    game = game_class(game_args, win_options=headless_win_options(), **kwargs)
+    return game, source
+
+def scene_stages(game, source, dt):
+    stages = [('input', lambda: source.advance(dt)),
+              ('frame_time', game.update_frame_time)]
+    stages += [(name, getattr(game, name)) for name in UPDATE_STAGES if hasattr(game, name)]
+    stages += [('draw', game.draw_frame)]
+    if getattr(game, 'frame_budget_on', False):
+        stages += [('update_detail', game.update_detail)]
+    stages += [('flip', game.win.flip)]
+    return stages
+
+def count_allocs(game, stages, dt, frames=120):
+    # per stage and frame: gc-tracked objects left behind, allocated blocks
+    # left behind and peak temporary bytes, with the collector held off
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    objects = np.zeros((frames,len(stages)))
+    blocks = np.zeros((frames,len(stages)))
+    peak_bytes = np.zeros((frames,len(stages)))
+    try:
+        for frame in range(frames):
+            for idx, (name, stage) in enumerate(stages):
+                tracemalloc.reset_peak()
+                start_bytes = tracemalloc.get_traced_memory()[0]
+                start_objects = gc.get_count()[0]
+                start_blocks = sys.getallocatedblocks()
+                stage()
+                if name == 'frame_time':
+                    game.frame_time = dt
+                blocks[frame,idx] = sys.getallocatedblocks()-start_blocks
+                objects[frame,idx] = gc.get_count()[0]-start_objects
+                peak_bytes[frame,idx] = tracemalloc.get_traced_memory()[1]-start_bytes
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return {name: {'gc_objects': objects[:,idx].mean(),
+                   'blocks': blocks[:,idx].mean(),
+                   'peak_temp_bytes': peak_bytes[:,idx].mean()}
+            for idx, (name, stage) in enumerate(stages)}
+
+def run_scene(scene, frames=600, warmup=60, rate=60.0, perspective=True, allocs=False,
+        detail_level=None):
+    from psychopy import event
+    game, source = build_scene(scene, perspective)
+    if detail_level is not None and hasattr(game, 'apply_detail'):
+        game.frame_budget_on = False
+        game.frame_budget.level = detail_level
+        game.apply_detail(game.frame_budget.detail)
+    dt = 1.0/rate
+    stages = scene_stages(game, source, dt)
+    if getattr(game, 'gc_control', False):
+        freeze_gc()
+
+    stage_cpu = np.zeros((frames,len(stages)))
+    stage_wall = np.zeros((frames,len(stages)))
+    for frame in range(warmup+frames):
+        row = frame-warmup
+        for idx, (name, stage) in enumerate(stages):
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            stage()
+            if name == 'frame_time':
+                game.frame_time = dt # fixed step, deterministic scene state
+            if row >= 0:
+                stage_wall[row,idx] = time.perf_counter()-wall_start
+                stage_cpu[row,idx] = time.process_time()-cpu_start
+
+    stage_allocs = count_allocs(game, stages, dt) if allocs else None
+    if getattr(game, 'gc_control', False):
+        release_gc()
+
+    renderer = gl_renderer()
+    game.win.close()
+    event.globalKeys.clear()
+
+    frame_wall = stage_wall.sum(axis=1)
+    return {
+        'module': SCENES[scene][0],
+        'config': SCENES[scene][2],
+        'perspective': perspective,
+        'startup_s': dict(game.startup.phases) if hasattr(game, 'startup') else None,
+        'detail_level': game.frame_budget.level if hasattr(game, 'frame_budget') else None,
+        'gl_renderer': renderer,
+        'frames': frames,
+        'fps': frames/frame_wall.sum(),
+        'frame_ms': {'mean': 1000*frame_wall.mean(),
+                     'median': 1000*np.median(frame_wall),
+                     'p95': 1000*np.percentile(frame_wall,95),
+                     'max': 1000*frame_wall.max()},
+        'stage_cpu_ms': {name: 1000*stage_cpu[:,idx].mean() for idx, (name, stage) in enumerate(stages)},
+        'stage_wall_ms': {name: 1000*stage_wall[:,idx].mean() for idx, (name, stage) in enumerate(stages)},
+        'stage_allocs': stage_allocs,
+    }
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not args.hardware_gl:
+        use_software_gl()
+    xvfb = start_virtual_display()
+    try:
+        results = {'version': git_version(),
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'platform': platform.platform(),
+                   'python': platform.python_version(),
+                   'virtual_rate': args.rate,
+                   'scenes': {}}
+        for scene in args.scenes:
+            results['scenes'][scene] = run_scene(scene, args.frames, args.warmup,
+                args.rate, args.perspective, args.allocs, args.detail_level)
+            print(scene+': '+str(round(results['scenes'][scene]['fps'],1))+' fps')
+    finally:
+        stop_virtual_display(xvfb)
+    with open(args.output,'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,240 @@
+import os, sys, time, json, ctypes, shutil, argparse, subprocess, importlib, multiprocessing
+import numpy as np
+from headless import *
+from frame_log import *
+from render_benchmark import SCENES, UPDATE_STAGES
+
+# re-render a recorded session headless at a fixed virtual frame rate, the
+# timeline split into chunks rendered in parallel (one window per worker)
+#
+# recordings: a frame log (frame_log.py) or an npz with 'time' (s), 'pos'
+# (samples x fingers, deg) and optionally 'vel' (rpm); a frame log also
+# restores the course scroll and block trial of every frame
+
+RENDER_SCENES = [scene for scene in SCENES if SCENES[scene][3] == 'kb']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline re-rendering of recorded sessions')
+    parser.add_argument('recording', help='Frame log or npz recording')
+    parser.add_argument('-s','--scene', help='Game scene', default='marble', choices=RENDER_SCENES)
+    parser.add_argument('-c','--config', help='Game config (default: the recording\'s, else the scene\'s)', default=None)
+    parser.add_argument('-r','--rate', help='Virtual frame rate (Hz)', type=float, default=60.0)
+    parser.add_argument('-o','--output', help='Output directory', default='rerender')
+    parser.add_argument('-f','--format', help='Image sequence or video', default='png', choices=['png','mp4'])
+    parser.add_argument('-j','--jobs', help='Worker processes', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', help='Seconds of recording per chunk', type=float, default=30.0)
+    parser.add_argument('--start', help='Start time (s into the recording)', type=float, default=0.0)
+    parser.add_argument('--end', help='End time (s into the recording)', type=float, default=None)
+    parser.add_argument('-p','--perspective', help='Perspective mode', action='store_false', default=True)
+    parser.add_argument('--hardware-gl', help='Use the GPU driver instead of llvmpipe', action='store_true', default=False)
+    return parser.parse_args()
+
+def load_recording(fname):
+    if fname.endswith('.npz'):
+        data = np.load(fname)
+        return {'time': data['time'], 'pos': data['pos'],
+                'vel': data['vel'] if 'vel' in data else None,
+                'course_ypos': None, 'trial': None, 'info': {}}
+    header, records = load_frame_log(fname)
+    if 'kb_pos' not in records.dtype.names:
+        raise ValueError(fname+' has no keyboard samples to re-render from')
+    return {'time': records['time'], 'pos': records['kb_pos'], 'vel': records['kb_vel'],
+            'course_ypos': records['course_ypos'], 'trial': records['trial'],
+            'info': header['info']}
+
+def sample_index(times, t):
+    # last sample at or before t
+    return min(max(int(np.searchsorted(times, t, side='right'))-1, 0), len(times)-1)
+
+def recording_trace(times, pos, vel=None):
+    # t -> (pos_deg, vel_rpm), linear between samples, for ScriptedKeyboard
+    times = np.asarray(times, dtype=float)
+    pos = np.asarray(pos, dtype=float)
+    if vel is None:
+        vel = np.gradient(pos, times, axis=0)/6 # deg/s to rpm
+    vel = np.asarray(vel, dtype=float)
+    def trace(t):
+        idx = min(sample_index(times, t), len(times)-2)
+        span = times[idx+1]-times[idx]
+        frac = min(max((t-times[idx])/span, 0.0), 1.0) if span > 0 else 0.0
+        return (pos[idx]+frac*(pos[idx+1]-pos[idx]),
+                vel[idx]+frac*(vel[idx+1]-vel[idx]))
+    return trace
+
+class FrameGrabber(object):
+    # front buffer after each flip, raw rgb, rows bottom-up
+    def __init__(self, win):
+        from pyglet import gl
+        self.gl = gl
+        self.width, self.height = [int(size) for size in win.frameBufferSize]
+        self.buffer = np.empty((self.height,self.width,3), dtype=np.uint8)
+        self.pointer = self.buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte))
+
+    def grab(self):
+        gl = self.gl
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glReadBuffer(gl.GL_FRONT)
+        gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, self.pointer)
+        return self.buffer
+
+class PngWriter(object):
+    def __init__(self, output, first_frame, size):
+        self.output = output
+        self.frame = first_frame
+
+    def write(self, image):
+        from PIL import Image
+        Image.fromarray(image[::-1]).save(os.path.join(self.output, 'frame_%06d.png' % self.frame))
+        self.frame += 1
+
+    def close(self):
+        pass
+
+class VideoWriter(object):
+    # one ffmpeg per chunk fed raw frames, chunks joined afterwards
+    def __init__(self, fname, size, rate):
+        self.fname = fname
+        self.process = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % size, '-r', str(rate),
+            '-i', '-', '-vf', 'vflip', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', fname],
+            stdin=subprocess.PIPE)
+
+    def write(self, image):
+        self.process.stdin.write(image.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+def set_course_ypos(game, course_ypos):
+    game.course_ypos = course_ypos
+    game.course_example.pos = (0, course_ypos)
+    if getattr(game, 'multi_marble', False):
+        game.lane_course.pos = (0, course_ypos)
+
+def set_trough_scroll(game, scroll):
+    # trough stripes where a continuous run would have them after this scroll
+    for idx, trough in enumerate(game.troughs):
+        ypos = (game.initial_troughs_ypos[idx]-scroll+1)%2-1
+        game.troughs_ypos[idx] = ypos
+        trough.pos = (0, ypos)
+
+def swap_trial(game, trial):
+    compiled = game.compile_trial(game.block.trials[trial])
+    game.build_course_stims(compiled)
+    game.next_course = compiled
+    game.swap_course()
+
+def render_chunk(job):
+    # worker: its own window, scene state set from the recording at the chunk
+    # start; marble roll phases restart at chunk edges, nothing else carries over
+    from psychopy import event
+    from scripted_input import ScriptedKeyboard
+    recording = load_recording(job['recording'])
+    times = recording['time']
+    module_name, class_name, config, input_type, kb_config = SCENES[job['scene']]
+    game_class = getattr(importlib.import_module(module_name), class_name)
+    kb = ScriptedKeyboard(kb_config, trace=recording_trace(times, recording['pos'], recording['vel']))
+    game_args = argparse.Namespace(config=job['config'], fullscreen=False, perspective=job['perspective'])
+    game = game_class(game_args, kb=kb, win_options=headless_win_options(),
+        config_overrides={'frame_log': None, 'frame_budget': False})
+    update_stages = [getattr(game, name) for name in UPDATE_STAGES if hasattr(game, name)]
+    has_course = hasattr(game, 'course_example')
+    if has_course:
+        game.initial_troughs_ypos = list(game.troughs_ypos)
+    grabber = FrameGrabber(game.win)
+    size = (grabber.width, grabber.height)
+    if job['format'] == 'mp4':
+        writer = VideoWriter(job['video'], size, job['rate'])
+    else:
+        writer = PngWriter(job['output'], job['first_frame'], size)
+
+    dt = 1.0/job['rate']
+    trial = -1
+    start_time = time.perf_counter()
+    for frame in range(job['first_frame'], job['end_frame']):
+        t = times[0]+job['start']+frame*dt
+        kb.time = t
+        kb.advance(0.0)
+        game.frame_time = dt
+        if has_course:
+            # scroll up to the previous frame, update_troughs adds this one
+            set_trough_scroll(game, game.trough_speed*(t-times[0]-dt))
+        if has_course and recording['course_ypos'] is not None:
+            idx = sample_index(times, t)
+            if game.block is not None and recording['trial'][idx] != trial:
+                trial = int(recording['trial'][idx])
+                if trial >= 0:
+                    swap_trial(game, trial)
+            # the recorded scroll, less this frame's step that update_troughs takes off
+            set_course_ypos(game, float(recording['course_ypos'][idx])
+                -game.trough_speed*(t-times[idx])+game.trough_speed*dt)
+        for stage in update_stages:
+            stage()
+        game.draw_frame()
+        game.win.flip()
+        writer.write(grabber.grab())
+    writer.close()
+    render_time = time.perf_counter()-start_time
+    game.win.close()
+    event.globalKeys.clear()
+    return {'first_frame': job['first_frame'], 'frames': job['end_frame']-job['first_frame'],
+            'render_s': render_time}
+
+def plan_chunks(args, recording, config):
+    duration = float(recording['time'][-1]-recording['time'][0])
+    end = duration if args.end is None else min(args.end, duration)
+    num_frames = int((end-args.start)*args.rate)
+    chunk_frames = max(1, int(args.chunk*args.rate))
+    jobs = []
+    for first_frame in range(0, num_frames, chunk_frames):
+        jobs.append({'recording': args.recording, 'scene': args.scene, 'config': config,
+            'perspective': args.perspective, 'rate': args.rate, 'start': args.start,
+            'first_frame': first_frame, 'end_frame': min(first_frame+chunk_frames, num_frames),
+            'format': args.format, 'output': args.output,
+            'video': os.path.join(args.output, 'chunk_%06d.mp4' % first_frame)})
+    return jobs
+
+def join_videos(jobs, fname):
+    list_fname = os.path.join(os.path.dirname(fname), 'chunks.txt')
+    with open(list_fname, 'w') as f:
+        for job in jobs:
+            f.write("file '"+os.path.basename(job['video'])+"'\n")
+    subprocess.check_call(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat',
+        '-safe', '0', '-i', list_fname, '-c', 'copy', fname])
+    for job in jobs:
+        os.remove(job['video'])
+    os.remove(list_fname)
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.format == 'mp4' and shutil.which('ffmpeg') is None:
+        print('ffmpeg not found, use --format png or install ffmpeg')
+        sys.exit(1)
+    recording = load_recording(args.recording)
+    config = args.config or recording['info'].get('config') or SCENES[args.scene][2]
+    os.makedirs(args.output, exist_ok=True)
+    jobs = plan_chunks(args, recording, config)
+    if not args.hardware_gl:
+        use_software_gl()
+    xvfb = start_virtual_display()
+    start_time = time.time()
+    try:
+        # spawn: workers must not inherit a gl context or pyglet state
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(max(1, min(args.jobs, len(jobs)))) as pool:
+            results = pool.map(render_chunk, jobs, chunksize=1)
+    finally:
+        stop_virtual_display(xvfb)
+    if args.format == 'mp4':
+        join_videos(jobs, os.path.join(args.output, 'session.mp4'))
+    wall_time = time.time()-start_time
+    num_frames = sum([result['frames'] for result in results])
+    summary = {'recording': args.recording, 'scene': args.scene, 'config': config,
+               'rate': args.rate, 'frames': num_frames, 'chunks': len(jobs),
+               'wall_s': wall_time, 'realtime_factor': num_frames/args.rate/wall_time,
+               'chunk_fps': [result['frames']/result['render_s'] for result in results]}
+    with open(os.path.join(args.output, 'rerender.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(str(num_frames)+' frames in '+str(round(wall_time,1))+' s, '
+        +str(round(summary['realtime_factor'],1))+'x real time')
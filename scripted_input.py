@@ -0,0 +1,109 @@
+import os, yaml
+import numpy as np
+from key_input import KeyEvent
+from target_tracker import *
+
+# stand-ins for KeyboardWrapper and the iohub keyboard, driven by a scripted
+# trace instead of a participant, for benchmarks and offline rendering
+
+def load_keyboard_config(config_fname='keyboard'):
+    with open(os.path.join('config',config_fname+'.yml')) as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+def sine_trace(num_fingers, neutral_angle=202.5, swing_angle=22.5,
+        freqs=[0.3,0.45,0.6,0.75,0.9], amplitude=0.8):
+    # deterministic per-finger sweeps; returns t -> (pos_deg, vel_rpm)
+    finger_freqs = np.array([freqs[idx%len(freqs)] for idx in range(num_fingers)])
+    phases = np.linspace(0,np.pi,num_fingers,endpoint=False)
+    amp = amplitude*swing_angle
+    def trace(t):
+        arg = 2*np.pi*finger_freqs*t+phases
+        pos = neutral_angle+amp*np.sin(arg)
+        vel = amp*2*np.pi*finger_freqs*np.cos(arg)/6 # deg/s to rpm
+        return pos, vel
+    return trace
+
+# mimics KeyboardWrapper: all_pos/all_vel per finger, commands ignored
+class ScriptedKeyboard(object):
+    def __init__(self, config_fname='keyboard', trace=None):
+        self.config = load_keyboard_config(config_fname)
+        self.map_to_screen = self.config['map_to_screen']
+        self.num_fingers = len(self.map_to_screen)
+        if trace is None:
+            trace = sine_trace(self.num_fingers, self.config['neutral_angle'],
+                self.config['swing_angle'])
+        self.trace = trace
+        self.time = 0.0
+        self.all_pos = [0.0]*self.num_fingers
+        self.all_vel = [0.0]*self.num_fingers
+        self.commands = []
+        self.tracker = TargetTracker(tick_wrap=32768) # ms ticks, as the servos
+        self.advance(0.0)
+
+    def advance(self, dt):
+        self.time += dt
+        pos, vel = self.trace(self.time)
+        self.all_pos[:] = [float(p) for p in pos]
+        self.all_vel[:] = [float(v) for v in vel]
+        if self.tracker.active:
+            self.tracker.update(int(1000*self.time)%32768, self.all_pos[self.tracker.finger])
+
+    def send_command(self, full_command):
+        self.commands.append(full_command)
+
+    def set_targets(self, table):
+        self.tracker.set_targets(table)
+
+    def clear_targets(self):
+        self.tracker.clear()
+
+    def start_guidance(self, table):
+        self.send_command({'command': 'mode_guide', 'data': table})
+
+    def set_guide_start(self, start):
+        self.send_command({'command': 'set_guide_start', 'data': start})
+
+    def get_events(self):
+        return self.tracker.pop_events()
+
+    def wait_ready(self, timeout=None):
+        return True
+
+    def startup_report(self):
+        return {}
+
+    def shutdown(self):
+        pass
+
+# mimics the iohub keyboard device: getKeys() returns press/release events
+class ScriptedKeys(object):
+    def __init__(self, schedule=[('d',0.4),(None,0.3),('a',0.7),(None,0.2),
+            ('d',0.25),('a',0.25),(None,0.5)]):
+        self.schedule = schedule
+        self.cycle_time = sum([duration for key, duration in schedule])
+        self.time = 0.0
+        self.held_key = None
+        self.events = []
+
+    def key_at(self, t):
+        t = t%self.cycle_time
+        for key, duration in self.schedule:
+            if t < duration:
+                return key
+            t -= duration
+        return None
+
+    def advance(self, dt):
+        self.time += dt
+        key = self.key_at(self.time)
+        if key != self.held_key:
+            if self.held_key is not None:
+                self.events.append(KeyEvent(self.held_key,'KEYBOARD_RELEASE',self.time))
+            if key is not None:
+                self.events.append(KeyEvent(key,'KEYBOARD_PRESS',self.time))
+            self.held_key = key
+
+    def getKeys(self):
+        events = self.events
+        self.events = []
+        return events
@@ -0,0 +1,86 @@
+import os, sys, time, json, argparse, platform, importlib, resource, multiprocessing
+from keyboard import start_lean_process
+
+# cost of starting the keyboard child from a game process: start latency,
+# child memory and imported modules, per start method, before any servo i/o
+
+# name: (start method, child started through start_lean_process)
+VARIANTS = {
+    'fork': ('fork', False),
+    'spawn_game_main': ('spawn', False),
+    'spawn_lean': ('spawn', True),
+    'forkserver_lean': ('forkserver', True),
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Keyboard child process start benchmark')
+    parser.add_argument('-m','--parent-module', help='Game module imported as the parent __main__',
+        default='marble_game')
+    parser.add_argument('-v','--variants', help='Start variants', nargs='+',
+        default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('-n','--repeats', help='Starts per variant', type=int, default=5)
+    parser.add_argument('-o','--output', help='Results file (json)', default='spawn_benchmark.json')
+    return parser.parse_args()
+
+def rss_mb():
+    # current resident set; ru_maxrss would carry the parent's peak across fork/exec
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss/2**20 if platform.system() == 'Darwin' else rss/2**10
+
+def probe_child(conn, parent_start_time):
+    # stands in for main_keyboard_loop: report and exit
+    conn.send({'start_latency': time.time()-parent_start_time,
+               'rss_mb': rss_mb(),
+               'num_modules': len(sys.modules),
+               'psychopy_loaded': 'psychopy' in sys.modules})
+    conn.close()
+
+def start_probe(method, lean, main_module):
+    ctx = multiprocessing.get_context(method)
+    recv, send = ctx.Pipe(duplex=False)
+    start_time = time.time()
+    process = ctx.Process(target=probe_child, args=(send, start_time))
+    if lean:
+        start_lean_process(process)
+    else:
+        # as if the game script were __main__
+        saved_main = sys.modules['__main__']
+        sys.modules['__main__'] = main_module
+        try:
+            process.start()
+        finally:
+            sys.modules['__main__'] = saved_main
+    result = recv.recv()
+    result['ready_time'] = time.time()-start_time
+    process.join()
+    return result
+
+def run_variant(variant, main_module, repeats=5):
+    method, lean = VARIANTS[variant]
+    results = [start_probe(method, lean, main_module) for repeat in range(repeats)]
+    summary = {name: sum([result[name] for result in results])/len(results)
+        for name in ['start_latency','ready_time','rss_mb','num_modules']}
+    summary['first_ready_time'] = results[0]['ready_time'] # includes forkserver startup
+    summary['psychopy_loaded'] = results[0]['psychopy_loaded']
+    return summary
+
+if __name__ == '__main__':
+    # the probe must pickle by an importable name, not __main__, which is swapped
+    from spawn_benchmark import probe_child
+    args = parse_args()
+    main_module = importlib.import_module(args.parent_module)
+    results = {'parent_module': args.parent_module,
+               'parent_rss_mb': rss_mb(),
+               'platform': platform.platform(),
+               'python': platform.python_version(),
+               'variants': {}}
+    for variant in args.variants:
+        results['variants'][variant] = run_variant(variant, main_module, args.repeats)
+        print(variant+': '+str(round(1000*results['variants'][variant]['ready_time'],1))+' ms, '
+            +str(round(results['variants'][variant]['rss_mb'],1))+' MB')
+    with open(args.output,'w') as f:
+        json.dump(results, f, indent=2)
@@ -1,15 +1,21 @@
-import os, yaml, argparse
+import os, math, yaml, argparse
 import numpy as np
-from scipy.interpolate import PchipInterpolator as pci
 from psychopy import core, event, visual
-from psychopy.iohub.client import launchHubServer
-from psychopy.visual.windowwarp import Warper
-
-parser = argparse.ArgumentParser(description='Marble game parameters')
-parser.add_argument('-c','--config', help='Configuration file',default='spoof_demo')
-parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
-parser.add_argument('-p','--perspective', help='Perspective mode', action='store_false', default=True)
-args = parser.parse_args()
+from key_input import *
+from warper import *
+from course import *
+from spoof_sim import spoof_physics_step
+from gc_control import *
+from frame_log import *
+from frame_budget import *
+from marbles import *
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Marble game parameters')
+    parser.add_argument('-c','--config', help='Configuration file',default='spoof_demo')
+    parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
+    parser.add_argument('-p','--perspective', help='Perspective mode', action='store_false', default=True)
+    return parser.parse_args()
 
 
 def gen_trough_shape(win, full_angle_deg=60, width=0.8, edge_width=0.04,
@@ -68,14 +74,6 @@ def gen_shadow_shape(win, radius=0.4,
         pos=(xpos,ypos), interpolate=True)
     return shape
 
-def gen_course_path(targets=[0,0,25,-35,15,-15,0,0],
-        times=[0,0.5,2,3.5,5,6.5,8,8.5], speed=0.25, step_size=0.01):
-    ypos = speed*np.array(times)
-    course_interp = pci(ypos,targets)
-    ypos_out = np.arange(ypos[0],ypos[-1]+step_size,step_size)
-    angle_out = course_interp(ypos_out)
-    return ypos_out, angle_out
-
 def gen_course_shape(win, course_y_raw, course_angle_raw,
         course_rad, course_angle_width=15,
         line_width=1.5, fill_color=[0.6,0.6,0.6], line_color=[0.6,0.6,0.6],
@@ -107,7 +105,7 @@ def gen_course_shape(win, course_y_raw, course_angle_raw,
 
 class MarbleGame:
 
-    def __init__(self):
+    def __init__(self, args, key_input=None, win_options={}):
         # load command line args
         self.args = args
 
@@ -124,17 +122,19 @@ class MarbleGame:
 
         self.win = visual.Window(size=(self.config['screen_width'], self.config['screen_height']),
                      color=self.config['bg_color'], units='height',
-                     fullscr=self.args.fullscreen, useFBO=self.perspective_on)
+                     fullscr=self.args.fullscreen, useFBO=self.perspective_on,
+                     **win_options)
 
-        self.warper = Warper(self.win,
-            warp='warpfile',
-            warpfile = 'config/perspective.data')
+        self.warper = MeshWarper(self.win,
+            perspective_corners=self.config.get('perspective_corners',PERSPECTIVE_CORNERS),
+            grid=self.config.get('perspective_grid',PERSPECTIVE_GRID))
 
         # add key controls
         event.globalKeys.add(key='q', modifiers=['alt'], func=self.quit)
         event.globalKeys.add(key='r', func=self.reset_course)
-        self.io = launchHubServer()
-        self.kb = self.io.devices.keyboard
+        if key_input is None:
+            key_input = open_key_input(self.win, self.config.get('key_backend','window'))
+        self.kb = key_input
         self.left_key = ['a']
         self.right_key = ['d']
         self.key_codes = self.left_key+self.right_key
@@ -152,10 +152,7 @@ class MarbleGame:
         self.trough_line_color = self.config['trough_line_color']
         self.trough_edge_color = self.config['trough_edge_color']
         self.course_color = self.config['course_color']
-        self.troughs = [gen_trough_shape(self.win, full_angle_deg=self.trough_full_angle,
-            width=self.trough_width, edge_width=self.trough_edge_width,
-            line_color=self.trough_line_color) for t in range(self.num_troughs)]
-        self.troughs_ypos = np.linspace(1,-1,self.num_troughs)
+        self.troughs_ypos = np.linspace(1,-1,self.num_troughs).tolist()
         self.bg_grating = visual.GratingStim(self.win, texRes=1024,
             color=self.trough_color,size=(self.trough_width,1.0),contrast=0.25)
         self.lh_trough_rect = visual.Rect(self.win, width=self.trough_edge_width, height=1,
@@ -189,6 +186,15 @@ class MarbleGame:
         self.marble_friction = self.config['marble_friction']
         self.marble_input_direction = 0
 
+        # fixed-timestep physics, rendered state interpolated between steps
+        self.physics_dt = 1.0/self.config.get('physics_rate',1000)
+        self.max_physics_steps = self.config.get('max_physics_steps',250)
+        self.physics_accumulator = 0.0
+        self.sim_angle = 0.0
+        self.sim_velocity = 0.0
+        self.prev_sim_angle = 0.0
+        self.prev_sim_velocity = 0.0
+
         self.marble_angle = self.marble_neutral_angle
         self.marble_velocity = 0
         self.marble_xpos = 0
@@ -196,6 +202,14 @@ class MarbleGame:
 
         self.marble_rota_coef = self.config['marble_rota_coef']
 
+        # pre-rendered marble textures instead of re-tessellated polygons
+        self.marble_sprite_on = self.config.get('marble_sprite', False)
+        if self.marble_sprite_on:
+            self.marble_sprite = MarbleSprite(self.win, radius=self.marble_rad,
+                trough_rad=self.marble_trough_rad, base_ypos=self.marble_base_ypos,
+                color=self.marble_color, border_color=self.marble_border_color,
+                shadow_color=self.marble_shadow_color, rota_coef=self.marble_rota_coef)
+
         # course example
         self.target_time_spacing = 1.5
         self.start_end_time_spacing = 0.5
@@ -219,17 +233,45 @@ class MarbleGame:
             self.marble_trough_rad,
             fill_color=self.course_color,
             line_color=self.course_color)
+        self.course_ypos = float(self.course_example.pos[1])
 
         # timing check
         self.clock = core.Clock()
         self.last_time = 0.0
         self.frame_time = 0.0
-        self.frame_history = np.zeros(100)
+        self.frame_history = [0.0]*100 # ring buffer
+        self.frame_history_idx = 0
+        self.frame_history_sum = 0.0
+        self.frame_count = 0
+        self.frame_msg_interval = 30 # frames between frame_msg text updates
         self.frame_msg = visual.TextBox2(win=self.win,
             text='16.6', pos=(-0.4,0.4),
             color=self.cue_color, letterHeight=0.08,
             units='height', autoDraw=False)#, autoDraw=True)
 
+        # frame budget: geometry detail and fbo render scale follow the load
+        self.frame_budget_on = self.config.get('frame_budget', False)
+        self.frame_budget = FrameBudget(self.config.get('frame_rate',60),
+            level=self.config.get('detail_level',0))
+        self.render_scale = 1.0
+        self.full_viewport = [0,0,self.win.frameBufferSize[0],self.win.frameBufferSize[1]]
+        self.render_viewport = self.full_viewport
+        self.build_detail_sets()
+        self.apply_detail(self.frame_budget.detail)
+
+        # defer cyclic garbage collection, collected every gc_interval seconds
+        self.gc_control = self.config.get('gc_control', False)
+        self.gc_interval = self.config.get('gc_interval', 30.0)
+        self.gc_time = 0.0
+
+        # per-frame state, written to file by a background thread
+        self.frame_log_name = self.config.get('frame_log', None)
+        self.frame_log = None
+        if self.frame_log_name is not None:
+            self.frame_log = FrameLogger(self.frame_log_name, frame_dtype(0),
+                info={'game': 'spoof_game', 'config': self.args.config,
+                      'trough_speed': self.trough_speed, 'marble_base_ypos': self.marble_base_ypos})
+
         # self.debug_msg = visual.TextBox2(win=self.win,
         #     text='', pos=(-0.4,0.3),
         #     color=self.cue_color, letterHeight=0.08,
@@ -264,77 +306,223 @@ class MarbleGame:
             self.marble_input_direction = 0
 
     def reset_course(self):
-        self.course_example.pos = (0,0.5)
+        self.course_ypos = 0.5
+        self.course_example.pos = (0,self.course_ypos)
 
     def update_frame_time(self):
-        self.frame_time = self.clock.getTime()-self.last_time
-        self.last_time = self.clock.getTime()
-        self.frame_history = np.roll(self.frame_history,1)
-        self.frame_history[0] = self.frame_time
-        self.frame_msg.text = str(np.round(1000*np.mean(self.frame_history),1))
+        now = self.clock.getTime()
+        self.frame_time = now-self.last_time
+        self.last_time = now
+        idx = self.frame_history_idx
+        self.frame_history_sum += self.frame_time-self.frame_history[idx]
+        self.frame_history[idx] = self.frame_time
+        self.frame_history_idx = (idx+1)%len(self.frame_history)
+        # text layout is expensive, only refresh it now and then
+        self.frame_count += 1
+        if self.frame_msg.autoDraw and self.frame_count%self.frame_msg_interval == 0:
+            self.frame_msg.text = '%.1f' % (1000*self.frame_history_sum/len(self.frame_history))
 
     def update_troughs(self):
-        self.course_example.pos = (0, self.course_example.pos[1]-self.frame_time*self.trough_speed)
-        self.troughs_ypos -= self.frame_time*self.trough_speed
+        scroll = self.frame_time*self.trough_speed
+        self.course_ypos -= scroll
+        self.course_example.pos = (0, self.course_ypos)
+        troughs_ypos = self.troughs_ypos
         for idx, trough in enumerate(self.troughs):
-            if self.troughs_ypos[idx] < -1:
-                self.troughs_ypos[idx] += 2
-            trough.pos = (0, self.troughs_ypos[idx])
+            ypos = troughs_ypos[idx]-scroll
+            if ypos < -1:
+                ypos += 2
+            troughs_ypos[idx] = ypos
+            trough.pos = (0, ypos)
+
+    def update_physics(self):
+        # consume frame time in fixed steps, leftover carried to the next frame
+        self.physics_accumulator += self.frame_time
+        num_steps = int(self.physics_accumulator/self.physics_dt)
+        if num_steps > self.max_physics_steps:
+            # stalled frame: drop the backlog rather than catching up
+            num_steps = self.max_physics_steps
+            self.physics_accumulator = num_steps*self.physics_dt
+        for step in range(num_steps):
+            self.prev_sim_angle = self.sim_angle
+            self.prev_sim_velocity = self.sim_velocity
+            self.sim_angle, self.sim_velocity = spoof_physics_step(
+                self.sim_angle, self.sim_velocity, self.marble_input_direction,
+                self.physics_dt, self.marble_input_accel,
+                self.marble_gravity_accel, self.marble_friction)
+        self.physics_accumulator -= num_steps*self.physics_dt
+
+        # render state between the last two steps
+        alpha = self.physics_accumulator/self.physics_dt
+        self.marble_angle = self.prev_sim_angle+alpha*(self.sim_angle-self.prev_sim_angle)
+        self.marble_velocity = self.prev_sim_velocity+alpha*(self.sim_velocity-self.prev_sim_velocity)
 
     def update_marble(self):
         # update angular position
-        input_add_velocity = self.marble_input_direction*self.marble_input_accel*self.frame_time
-        friction_add_velocity = self.marble_velocity*self.marble_friction*self.frame_time
-        gravity_add_velocity = self.marble_angle*self.marble_gravity_accel*self.frame_time
-        self.marble_velocity = self.marble_velocity+input_add_velocity-gravity_add_velocity-friction_add_velocity 
-
-        self.marble_angle = self.marble_angle+self.marble_velocity*self.frame_time
-
-        self.marble_xpos = self.marble_trough_rad*np.sin(np.deg2rad(self.marble_angle))
-        self.marble_ypos = self.marble_base_ypos+self.marble_trough_rad*(1-np.cos(np.deg2rad(self.marble_angle)))
+        self.update_physics()
+
+        if self.marble_sprite_on:
+            self.marble_sprite.update(self.marble_angle, self.marble_velocity,
+                self.frame_time, self.trough_speed)
+            self.marble_xpos = self.marble_sprite.xpos
+            self.marble_ypos = self.marble_sprite.ypos
+            return
+
+        angle_rad = math.radians(self.marble_angle)
+        drop = 1-math.cos(angle_rad)
+        self.marble_xpos = self.marble_trough_rad*math.sin(angle_rad)
+        self.marble_ypos = self.marble_base_ypos+self.marble_trough_rad*drop
         self.marble.pos = (self.marble_xpos,self.marble_ypos)
 
         # update marble shadow
         self.marble_shadow.pos = (self.marble_xpos,self.marble_ypos)
-        self.marble_shadow.size = (1,1+(1-np.cos(np.deg2rad(self.marble_angle))))
+        self.marble_shadow.size = (1,1+drop)
         self.marble_shadow.ori = 0.4*self.marble_angle
 
         # update rolling semicircs
         y_distance_travelled = self.trough_speed*self.frame_time
         yscale_travel_rough = y_distance_travelled/(0.4*self.marble_circ)
-        x_distance_travelled = 2*self.marble_trough_rad*np.pi*self.marble_velocity/360*self.frame_time
+        x_distance_travelled = 2*self.marble_trough_rad*math.pi*self.marble_velocity/360*self.frame_time
         xscale_travel_rough = x_distance_travelled/(0.4*self.marble_circ)
         for idx, marble_semicirc in enumerate(self.marble_semicircs):
             # self.marble_yscales[idx] -= yscale_travel_rough
-            self.marble_yscales[idx] -= np.sqrt(yscale_travel_rough**2+xscale_travel_rough**2)
+            self.marble_yscales[idx] -= math.hypot(yscale_travel_rough,xscale_travel_rough)
             if self.marble_yscales[idx] < -1:
                 self.marble_yscales[idx] += 2
-            marble_semicirc.size = (1,np.sin(np.pi/2-(self.marble_yscales[idx]-1)*np.pi/2))
+            marble_semicirc.size = (1,math.sin(math.pi/2-(self.marble_yscales[idx]-1)*math.pi/2))
             marble_semicirc.pos = (self.marble_xpos,self.marble_ypos)
             marble_semicirc.ori = self.marble_rota_coef*self.marble_velocity
 
+    def detail_levels(self):
+        # levels the budget can move to, without it only the configured one
+        if self.frame_budget_on:
+            return self.frame_budget.levels
+        return [self.frame_budget.detail]
+
+    def build_troughs(self, num_pts):
+        return [gen_trough_shape(self.win, full_angle_deg=self.trough_full_angle,
+            width=self.trough_width, edge_width=self.trough_edge_width,
+            line_color=self.trough_line_color, num_pts=num_pts) for t in range(self.num_troughs)]
+
+    def build_course(self, course_step, endcap_points):
+        course_y, course_angle = gen_course_path(self.course_targets,
+            self.course_times, self.trough_speed, step_size=course_step)
+        return gen_course_shape(self.win,
+            course_y, course_angle,
+            self.marble_trough_rad, ypos=self.course_ypos,
+            endcap_points=endcap_points,
+            fill_color=self.course_color,
+            line_color=self.course_color)
+
+    def build_grating(self, grating_res):
+        return visual.GratingStim(self.win, texRes=grating_res,
+            color=self.trough_color, size=self.bg_grating.size, contrast=0.25)
+
+    def build_detail_sets(self):
+        # geometry, gratings and warp buffers for every level in reach, built at
+        # startup so a level change only swaps references
+        self.trough_sets = {}
+        self.course_sets = {}
+        self.bg_gratings = {self.bg_grating.texRes: self.bg_grating}
+        for detail in self.detail_levels():
+            if detail['num_pts'] not in self.trough_sets:
+                self.trough_sets[detail['num_pts']] = self.build_troughs(detail['num_pts'])
+            course_key = (detail['course_step'], detail['endcap_points'])
+            if course_key not in self.course_sets:
+                self.course_sets[course_key] = self.build_course(*course_key)
+            if detail['grating_res'] not in self.bg_gratings:
+                self.bg_gratings[detail['grating_res']] = self.build_grating(detail['grating_res'])
+        if self.perspective_on:
+            self.warper.prepare_render_scales([detail['render_scale']
+                for detail in self.detail_levels()])
+
+    def apply_detail(self, detail):
+        # swap in the level's troughs, course outline and grating, and
+        # shrink/grow the fbo render area; only a level outside detail_levels
+        # (set directly) is built here
+        num_pts = detail['num_pts']
+        if num_pts not in self.trough_sets:
+            self.trough_sets[num_pts] = self.build_troughs(num_pts)
+        self.troughs = self.trough_sets[num_pts]
+        for idx, trough in enumerate(self.troughs):
+            trough.pos = (0, self.troughs_ypos[idx])
+        course_key = (detail['course_step'], detail['endcap_points'])
+        if course_key not in self.course_sets:
+            self.course_sets[course_key] = self.build_course(*course_key)
+        self.course_example = self.course_sets[course_key]
+        self.course_example.pos = (0, self.course_ypos)
+        grating_res = detail['grating_res']
+        if grating_res not in self.bg_gratings:
+            self.bg_gratings[grating_res] = self.build_grating(grating_res)
+        self.bg_grating = self.bg_gratings[grating_res]
+        if self.perspective_on:
+            self.render_scale = detail['render_scale']
+            self.warper.set_render_scale(self.render_scale)
+            self.render_viewport = [0,0,int(self.render_scale*self.full_viewport[2]),
+                int(self.render_scale*self.full_viewport[3])]
+
+    def update_detail(self):
+        # work done this frame so far, against the budget
+        work_time = self.clock.getTime()-self.last_time
+        if self.frame_budget.update(work_time, self.frame_time):
+            self.apply_detail(self.frame_budget.detail)
+
+    def draw_frame(self):
+        if self.render_scale < 1.0:
+            self.win.viewport = self.win.scissor = self.render_viewport
+            self.draw_scene()
+            self.win.viewport = self.win.scissor = self.full_viewport
+        else:
+            self.draw_scene()
+
+    def draw_scene(self):
+        self.bg_grating.draw()
+        self.lh_trough_rect.draw()
+        self.rh_trough_rect.draw()
+        for trough in self.troughs:
+            trough.draw()
+        self.course_example.draw()
+        if self.marble_sprite_on:
+            self.marble_sprite.draw()
+            return
+        self.marble_shadow.draw()
+        self.marble.draw()
+        for marble_semicirc in self.marble_semicircs:
+            marble_semicirc.draw()
+
     # main event loop
+    def log_frame(self):
+        self.frame_log.log((self.frame_count, self.last_time, self.frame_time,
+            self.course_ypos, -1, self.marble_angle, self.marble_velocity))
+
+    def update_gc(self):
+        if self.last_time-self.gc_time >= self.gc_interval:
+            self.gc_time = self.last_time
+            collect_between_trials()
+
     def run_main_loop(self):
+        if self.gc_control:
+            freeze_gc()
         while True:
             self.check_keys()
             self.update_frame_time()
-            self.bg_grating.draw()
-            self.lh_trough_rect.draw()
-            self.rh_trough_rect.draw()
             self.update_troughs()
-            for trough in self.troughs:
-                trough.draw()
-            self.course_example.draw()
             self.update_marble()
-            self.marble_shadow.draw()
-            self.marble.draw()
-            for marble_semicirc in self.marble_semicircs:
-                marble_semicirc.draw()
+            if self.gc_control:
+                self.update_gc()
+            if self.frame_log is not None:
+                self.log_frame()
+            self.draw_frame()
+            if self.frame_budget_on:
+                self.update_detail()
             self.win.flip()
 
     def quit(self):
+        if self.frame_log is not None:
+            self.frame_log.close()
+        if self.gc_control:
+            release_gc()
         core.quit()
 
 if __name__ == '__main__':
-    game = MarbleGame()
+    game = MarbleGame(parse_args())
     game.run_main_loop()
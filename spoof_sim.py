@@ -0,0 +1,165 @@
+import os, csv, time, yaml, argparse, itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from course import *
+
+# headless spoof-game dynamics: the same step as spoof_game.py, applied to
+# whole batches of parameter sets and input sequences as arrays
+
+def spoof_physics_step(angle, velocity, input_direction, dt,
+        input_accel=50, gravity_accel=2, friction=0.5):
+    # works on python floats (game) and numpy arrays (batches) alike
+    input_add_velocity = input_direction*input_accel*dt
+    friction_add_velocity = velocity*friction*dt
+    gravity_add_velocity = angle*gravity_accel*dt
+    velocity = velocity+input_add_velocity-gravity_add_velocity-friction_add_velocity
+    angle = angle+velocity*dt
+    return angle, velocity
+
+def simulate_open_loop(inputs, input_accel, gravity_accel, friction, dt=0.001):
+    # inputs: (batch, steps) of -1/0/1, params: scalars or (batch,)
+    inputs = np.atleast_2d(inputs)
+    batch, steps = inputs.shape
+    input_accel = np.broadcast_to(np.asarray(input_accel, dtype=float), (batch,))
+    gravity_accel = np.broadcast_to(np.asarray(gravity_accel, dtype=float), (batch,))
+    friction = np.broadcast_to(np.asarray(friction, dtype=float), (batch,))
+    angles = np.zeros((batch,steps))
+    angle = np.zeros(batch)
+    velocity = np.zeros(batch)
+    for step in range(steps):
+        angle, velocity = spoof_physics_step(angle, velocity, inputs[:,step], dt,
+            input_accel, gravity_accel, friction)
+        angles[:,step] = angle
+    return angles, inputs
+
+def simulate_player(course_angles, input_accel, gravity_accel, friction,
+        deadband=3.0, delay=0.2, lookahead=0.3, dt=0.001):
+    # scripted closed-loop player: presses toward the course ahead of the
+    # marble, seeing the marble angle 'delay' seconds late
+    course_angles = np.asarray(course_angles, dtype=float)
+    steps = len(course_angles)
+    input_accel = np.asarray(input_accel, dtype=float)
+    batch = input_accel.shape[0]
+    gravity_accel = np.broadcast_to(np.asarray(gravity_accel, dtype=float), (batch,))
+    friction = np.broadcast_to(np.asarray(friction, dtype=float), (batch,))
+    deadband = np.broadcast_to(np.asarray(deadband, dtype=float), (batch,))
+    delay_steps = np.broadcast_to(np.round(np.asarray(delay)/dt).astype(int), (batch,))
+    lookahead_steps = int(round(lookahead/dt))
+    goal = course_angles[np.minimum(np.arange(steps)+lookahead_steps, steps-1)]
+
+    angles = np.zeros((batch,steps))
+    inputs = np.zeros((batch,steps), dtype=np.int8)
+    angle = np.zeros(batch)
+    velocity = np.zeros(batch)
+    rows = np.arange(batch)
+    for step in range(steps):
+        # marble angle delay_steps before the latest (angles[:,step-1]), the
+        # starting angle (0) before there is one
+        seen_steps = step-1-delay_steps
+        seen = np.where(seen_steps >= 0, angles[rows,np.maximum(seen_steps,0)], 0.0)
+        error = goal[step]-seen
+        direction = np.where(error > deadband, 1, np.where(error < -deadband, -1, 0))
+        inputs[:,step] = direction
+        angle, velocity = spoof_physics_step(angle, velocity, direction, dt,
+            input_accel, gravity_accel, friction)
+        angles[:,step] = angle
+    return angles, inputs
+
+def controllability_metrics(angles, inputs, course_index, course_ys, target_ys,
+        dt=0.001, target_window=0.05):
+    # per batch row: tracking error, time on course, target hits, effort
+    inside = (course_ys >= course_index.y_start)&(course_ys <= course_index.y_end)
+    course_angles, widths = course_index.lookup_array(course_ys)
+    errors = (angles-course_angles)[:,inside]
+    on_course = np.abs(errors) <= 0.5*widths[inside]
+    metrics = {
+        'rms_error': np.sqrt(np.mean(errors**2,axis=1)),
+        'max_error': np.max(np.abs(errors),axis=1),
+        'fraction_on_course': np.mean(on_course,axis=1),
+        'num_hits': np.zeros(angles.shape[0], dtype=int),
+        'effort': np.mean(inputs != 0,axis=1),
+        'input_switches': np.sum(np.diff(inputs,axis=1) != 0,axis=1),
+    }
+    for target_y in target_ys:
+        window = inside&(np.abs(course_ys-target_y) <= target_window)
+        if window.any():
+            abs_errors = np.abs(angles[:,window]-course_angles[window])
+            metrics['num_hits'] += np.min(abs_errors-0.5*widths[window],axis=1) <= 0
+    return metrics
+
+def simulate_chunk(chunk):
+    # one process-pool job: a block of parameter rows against one course
+    params, course, dt = chunk
+    course_index = CourseIndex(course['y_raw'], course['angle_raw'], course['angle_width'])
+    steps = int(course['duration']/dt)
+    course_ys = course['speed']*dt*np.arange(1,steps+1)
+    course_angles, widths = course_index.lookup_array(course_ys)
+    angles, inputs = simulate_player(course_angles, params['input_accel'],
+        params['gravity_accel'], params['friction'], params['deadband'],
+        params['delay'], course['lookahead'], dt)
+    return controllability_metrics(angles, inputs, course_index, course_ys,
+        course['target_ys'], dt)
+
+def param_grid(**ranges):
+    # cartesian product of value lists -> dict of equal-length arrays
+    names = list(ranges)
+    combos = np.array(list(itertools.product(*[ranges[name] for name in names])), dtype=float)
+    return {name: combos[:,idx] for idx, name in enumerate(names)}
+
+def run_sweep(params, course, dt=0.001, chunk_size=256, workers=1):
+    num_rows = len(params['input_accel'])
+    chunks = [({name: values[start:start+chunk_size] for name, values in params.items()}, course, dt)
+        for start in range(0, num_rows, chunk_size)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(simulate_chunk, chunks))
+    else:
+        results = [simulate_chunk(chunk) for chunk in chunks]
+    return {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+
+def spoof_course(config, targets=[25,-35,15,-15,30], target_time_spacing=1.5,
+        start_end_time_spacing=0.5, course_angle_width=15, lookahead=0.3):
+    # same course as spoof_game.py
+    speed = config['trough_speed']
+    course_targets, course_times = build_course(targets, target_time_spacing, start_end_time_spacing)
+    y_raw, angle_raw = gen_course_path(course_targets, course_times, speed)
+    return {'y_raw': y_raw, 'angle_raw': angle_raw, 'angle_width': course_angle_width,
+            'speed': speed, 'duration': course_times[-1], 'lookahead': lookahead,
+            'target_ys': speed*course_times[2:-2]}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Headless spoof physics parameter sweep')
+    parser.add_argument('-c','--config', help='Configuration file', default='spoof_demo')
+    parser.add_argument('--accel', help='marble_input_accel values', type=float, nargs='+',
+        default=list(np.linspace(10,100,10)))
+    parser.add_argument('--gravity', help='marble_gravity_accel values', type=float, nargs='+',
+        default=list(np.linspace(0,5,6)))
+    parser.add_argument('--friction', help='marble_friction values', type=float, nargs='+',
+        default=list(np.linspace(0,2,5)))
+    parser.add_argument('--deadband', help='Player deadband values (deg)', type=float, nargs='+', default=[2.0,5.0])
+    parser.add_argument('--delay', help='Player delay values (s)', type=float, nargs='+', default=[0.15,0.25])
+    parser.add_argument('--dt', help='Physics step (s)', type=float, default=0.001)
+    parser.add_argument('-j','--workers', help='Worker processes', type=int, default=os.cpu_count())
+    parser.add_argument('-o','--output', help='Results table (csv)', default='spoof_sweep.csv')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(os.path.join('config',args.config+'.yml')) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    course = spoof_course(config)
+    params = param_grid(input_accel=args.accel, gravity_accel=args.gravity,
+        friction=args.friction, deadband=args.deadband, delay=args.delay)
+
+    start_time = time.time()
+    metrics = run_sweep(params, course, args.dt, workers=args.workers)
+    print(str(len(params['input_accel']))+' parameter sets in '
+        +str(round(time.time()-start_time,2))+' s')
+
+    columns = list(params)+list(metrics)
+    order = np.argsort(metrics['rms_error'])
+    with open(args.output,'w',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in order:
+            writer.writerow([params[name][row] for name in params]+[metrics[name][row] for name in metrics])
@@ -1,12 +1,13 @@
 import os, yaml, argparse
 import numpy as np
 from psychopy import core, event, visual
-from psychopy.iohub.client import launchHubServer
+from key_input import *
 
-parser = argparse.ArgumentParser(description='Marble game parameters')
-parser.add_argument('-c','--config', help='Configuration file',default='wedge_demo')
-parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
-args = parser.parse_args()
+def parse_args():
+    parser = argparse.ArgumentParser(description='Marble game parameters')
+    parser.add_argument('-c','--config', help='Configuration file',default='wedge_demo')
+    parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
+    return parser.parse_args()
 
 def gen_key_shape(win, width=0.1, height=0.05,
         corner_rad=0.02, line_width=2.5, corner_pts=5,
@@ -66,7 +67,7 @@ def gen_wedge_shape(win, task_rad=1.0, width=0.1, height=0.05,
 
 class WedgeGame:
 
-    def __init__(self):
+    def __init__(self, args, key_input=None, win_options={}):
         # load command line args
         self.args = args
 
@@ -81,12 +82,13 @@ class WedgeGame:
 
         self.win = visual.Window(size=(self.config['screen_width'], self.config['screen_height']),
                      color=self.config['bg_color'], units='height',
-                     fullscr=self.args.fullscreen)
+                     fullscr=self.args.fullscreen, **win_options)
 
         # add key controls
         event.globalKeys.add(key='q', modifiers=['alt'], func=self.quit)
-        self.io = launchHubServer()
-        self.kb = self.io.devices.keyboard
+        if key_input is None:
+            key_input = open_key_input(self.win, self.config.get('key_backend','window'))
+        self.kb = key_input
         self.left_key = ['a']
         self.right_key = ['d']
         self.key_codes = self.left_key+self.right_key
@@ -188,14 +190,17 @@ class WedgeGame:
         self.wedge.ori = self.task_ori
         self.wedge.pos = (task_xpos, task_ypos)
 
+    def draw_frame(self):
+        for target in self.targets:
+            target.draw()
+        self.wedge.draw()
+
     def run_main_loop(self):
         while self.game_running:
             self.update_frame_time()
             self.check_keys()
             self.update_wedge()
-            for target in self.targets:
-                target.draw()
-            self.wedge.draw()
+            self.draw_frame()
             self.win.flip()
 
     def quit(self):
@@ -203,5 +208,5 @@ class WedgeGame:
         core.quit()
 
 if __name__ == '__main__':
-    game = WedgeGame()
+    game = WedgeGame(parse_args())
     game.run_main_loop()
@@ -0,0 +1,26 @@
+import time
+
+# wall-clock phases of game startup, printed as a table before the first frame
+class StartupTimer(object):
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.phases = []
+
+    def mark(self, name):
+        # time since the previous mark is booked to this phase
+        now = time.perf_counter()
+        self.phases.append((name, now-self.last_time))
+        self.last_time = now
+
+    def total(self):
+        return self.last_time-self.start_time
+
+    def report(self, background={}):
+        # background: phases that ran alongside (e.g. keyboard child stages)
+        lines = ['startup: '+str(round(self.total(),3))+' s']
+        for name, duration in self.phases:
+            lines.append('  '+name.ljust(24)+str(round(duration,3)).rjust(8))
+        for name, duration in background.items():
+            lines.append('  (bg) '+name.ljust(19)+str(round(duration,3)).rjust(8))
+        return '\n'.join(lines)
@@ -0,0 +1,32 @@
+from psychopy import visual
+
+# stims that don't change during a trial, drawn once and captured into a
+# texture; each frame then costs one textured quad instead of a draw per stim
+#
+# the capture is the full window (background included), so the layer goes
+# first in a frame; invalidate() after changing any of its stims
+
+class StaticLayer(object):
+    def __init__(self, win, stims=[]):
+        self.win = win
+        self.stims = list(stims)
+        self.image = None
+        self.num_builds = 0
+
+    def set_stims(self, stims):
+        self.stims = list(stims)
+        self.invalidate()
+
+    def invalidate(self):
+        self.image = None
+
+    def prepare(self):
+        # rebuild outside any reduced viewport, the capture is window-sized
+        if self.image is None:
+            self.image = visual.BufferImageStim(self.win, stim=self.stims)
+            self.num_builds += 1
+            self.win.clearBuffer()
+
+    def draw(self):
+        self.prepare()
+        self.image.draw()
@@ -0,0 +1,150 @@
+import os, sys, time, json, yaml, argparse, subprocess
+
+# several keyboard-plus-display stations on one host: each station is its own
+# game process (and keyboard child) with its own config, serial port and
+# display, render and keyboard i/o pinned to dedicated cores; the games write
+# a health file every second and the launcher prints them side by side
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run several stations on one host')
+    parser.add_argument('-m','--manifest', help='Station manifest', default=os.path.join('config','stations.yml'))
+    parser.add_argument('-s','--stations', help='Only these stations', nargs='+', default=None)
+    parser.add_argument('-fs','--fullscreen', help='Fullscreen mode', action='store_true', default=False)
+    parser.add_argument('-i','--interval', help='Seconds between health reports', type=float, default=5.0)
+    parser.add_argument('--status-dir', help='Directory for the station health files', default='station_status')
+    parser.add_argument('--dry-run', help='Print the station commands only', action='store_true', default=False)
+    return parser.parse_args()
+
+def load_manifest(fname):
+    with open(fname) as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def check_names(stations):
+    # status files, logs and the warp mesh cache are named after the station
+    names = [station['name'] for station in stations]
+    repeated = sorted(set([name for name in names if names.count(name) > 1]))
+    if repeated:
+        raise ValueError('Station names used more than once: '+', '.join(repeated))
+
+def assign_cores(stations, cores, reserved=[0]):
+    # fixed cores from the manifest first, then one free core each for render
+    # and keyboard i/o; a core is never handed to two stations
+    used = set(reserved)
+    for station in stations:
+        for key in ['render_cores','keyboard_cores']:
+            if station.get(key):
+                overlap = used & set(station[key])
+                if overlap:
+                    raise ValueError(station['name']+' '+key+' '+str(sorted(overlap))+' already in use')
+                used |= set(station[key])
+    free = [core for core in cores if core not in used]
+    for station in stations:
+        for key in ['render_cores','keyboard_cores']:
+            if not(station.get(key)):
+                if not(free):
+                    raise ValueError('Not enough cores for '+str(len(stations))+' stations ('
+                        +str(len(cores))+' available, '+str(len(reserved))+' reserved)')
+                station[key] = [free.pop(0)]
+    return stations
+
+def station_command(station, status_file, fullscreen=False):
+    command = [sys.executable, station.get('script', 'marble_game.py'),
+        '-c', station.get('game', 'demo'), '-k', station.get('keyboard', 'keyboard'),
+        '--screen', str(station.get('screen', 0)), '--status', status_file,
+        '--run-name', station['name'],
+        '--cores']+[str(core) for core in station['render_cores']]
+    command += ['--kb-cores']+[str(core) for core in station['keyboard_cores']]
+    if station.get('port'):
+        command += ['--port', station['port']]
+    if fullscreen:
+        command.append('-fs')
+    return command
+
+def station_env(station):
+    env = dict(os.environ)
+    if station.get('display'):
+        env['DISPLAY'] = station['display']
+    return env
+
+def read_status(status_file):
+    try:
+        with open(status_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def station_health(status, min_loop_hz=None):
+    if status is None:
+        return 'starting'
+    problems = []
+    if status['dropped'] or status['mean_frame_ms'] > status['budget_ms']:
+        problems.append('frames')
+    if min_loop_hz is not None and status['kb_loop_hz'] is not None and status['kb_loop_hz'] < min_loop_hz:
+        problems.append('keyboard')
+    return 'slow '+'+'.join(problems) if problems else 'ok'
+
+def print_report(stations, processes, status_files, min_loop_hz=None):
+    print('%-12s %6s %8s %8s %8s %8s %10s %6s %6s  %s' % ('station','pid','frames','mean ms',
+        'max ms','dropped','kb loop hz','render','kb','health'))
+    for station in stations:
+        name = station['name']
+        status = read_status(status_files[name])
+        returncode = processes[name].poll()
+        if returncode is not None:
+            health = 'exited ('+str(returncode)+')'
+        else:
+            health = station_health(status, min_loop_hz)
+        status = status or {}
+        print('%-12s %6s %8s %8s %8s %8s %10s %6s %6s  %s' % (name, processes[name].pid,
+            status.get('frames','-'),
+            '%.2f' % status['mean_frame_ms'] if 'mean_frame_ms' in status else '-',
+            '%.2f' % status['max_frame_ms'] if 'max_frame_ms' in status else '-',
+            status.get('dropped','-'),
+            '%.0f' % status['kb_loop_hz'] if status.get('kb_loop_hz') is not None else '-',
+            ','.join([str(core) for core in station['render_cores']]),
+            ','.join([str(core) for core in station['keyboard_cores']]), health))
+
+if __name__ == '__main__':
+    args = parse_args()
+    manifest = load_manifest(args.manifest)
+    stations = manifest['stations']
+    if args.stations is not None:
+        stations = [station for station in stations if station['name'] in args.stations]
+    try:
+        check_names(stations)
+        stations = assign_cores(stations, available_cores(), manifest.get('reserved_cores', [0]))
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    min_loop_hz = manifest.get('min_loop_hz', None)
+    os.makedirs(args.status_dir, exist_ok=True)
+    status_files = {station['name']: os.path.join(args.status_dir, station['name']+'.json')
+        for station in stations}
+
+    processes = {}
+    for station in stations:
+        command = station_command(station, status_files[station['name']], args.fullscreen)
+        print(station['name']+': '+' '.join(command))
+        if args.dry_run:
+            continue
+        if os.path.exists(status_files[station['name']]):
+            os.remove(status_files[station['name']])
+        processes[station['name']] = subprocess.Popen(command, env=station_env(station))
+    if args.dry_run:
+        sys.exit(0)
+
+    try:
+        while any([process.poll() is None for process in processes.values()]):
+            time.sleep(args.interval)
+            print_report(stations, processes, status_files, min_loop_hz)
+    except KeyboardInterrupt:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            process.wait()
@@ -0,0 +1,101 @@
+# target acquisition on one finger's angle, run per servo sample in the
+# keyboard process; times are ms since the table was set, from servo ticks
+#
+# events: (kind, target_idx, time_ms, value)
+#   'start'     None  0     first servo tick after set_targets
+#   'enter'     idx   t     angle at entry
+#   'acquire'   idx   t     dwell so far (ms), once per entry when it reaches dwell_ms
+#   'exit'      idx   t     dwell (ms)
+#   'overshoot' idx   t     peak excursion past the far edge (deg), t at the peak
+
+class TargetTracker(object):
+    def __init__(self, tick_wrap=None):
+        self.tick_wrap = tick_wrap # servo tick counter period
+        self.clear()
+
+    def clear(self):
+        self.active = False
+        self.targets = []
+        self.events = []
+
+    def set_targets(self, table):
+        # table: {'finger': idx, 'targets': [[lo,hi],...] in finger degrees,
+        #         'dwell_ms': 300, 'overshoot_hysteresis': 0.5}
+        self.finger = table['finger']
+        self.targets = [(min(lo,hi),max(lo,hi)) for lo, hi in table['targets']]
+        self.dwell_ms = table.get('dwell_ms',300)
+        self.hysteresis = table.get('overshoot_hysteresis',0.5)
+        self.events = []
+        self.last_tick = None
+        self.time_ms = 0
+        self.prev_angle = None
+        self.inside = None
+        self.entry_time = 0
+        self.entry_dir = 0
+        self.acquired = False
+        self.overshoot_target = None
+        self.active = True
+
+    def find_target(self, angle):
+        for idx, (lo, hi) in enumerate(self.targets):
+            if lo <= angle <= hi:
+                return idx
+        return None
+
+    def update(self, tick, angle):
+        if self.last_tick is None:
+            self.events.append(('start', None, 0, tick))
+        else:
+            dt = tick-self.last_tick
+            if dt < 0 and self.tick_wrap:
+                dt += self.tick_wrap
+            self.time_ms += dt
+        self.last_tick = tick
+        target = self.find_target(angle)
+
+        # overshoot ends at the turnaround or on entering any target
+        if self.overshoot_target is not None:
+            excursion = (angle-self.overshoot_edge)*self.overshoot_dir
+            if excursion > self.overshoot_peak:
+                self.overshoot_peak = excursion
+                self.overshoot_time = self.time_ms
+            if target is not None or excursion < self.overshoot_peak-self.hysteresis:
+                self.events.append(('overshoot', self.overshoot_target,
+                    self.overshoot_time, self.overshoot_peak))
+                self.overshoot_target = None
+
+        if target != self.inside:
+            if self.inside is not None:
+                self.events.append(('exit', self.inside, self.time_ms, self.time_ms-self.entry_time))
+                lo, hi = self.targets[self.inside]
+                # left through the side opposite the approach
+                if target is None and self.entry_dir > 0 and angle > hi:
+                    self.start_overshoot(self.inside, hi, 1, angle)
+                elif target is None and self.entry_dir < 0 and angle < lo:
+                    self.start_overshoot(self.inside, lo, -1, angle)
+            if target is not None:
+                if self.prev_angle is None or angle == self.prev_angle:
+                    self.entry_dir = 0
+                else:
+                    self.entry_dir = 1 if angle > self.prev_angle else -1
+                self.entry_time = self.time_ms
+                self.acquired = False
+                self.events.append(('enter', target, self.time_ms, angle))
+            self.inside = target
+        if (target is not None and not(self.acquired)
+                and self.time_ms-self.entry_time >= self.dwell_ms):
+            self.acquired = True
+            self.events.append(('acquire', target, self.time_ms, self.time_ms-self.entry_time))
+        self.prev_angle = angle
+
+    def start_overshoot(self, target, edge, direction, angle):
+        self.overshoot_target = target
+        self.overshoot_edge = edge
+        self.overshoot_dir = direction
+        self.overshoot_peak = (angle-edge)*direction
+        self.overshoot_time = self.time_ms
+
+    def pop_events(self):
+        events = self.events
+        self.events = []
+        return events
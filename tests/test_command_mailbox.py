@@ -0,0 +1,44 @@
+import os, sys, threading, multiprocessing
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from command_mailbox import *
+
+COMMANDS = ['mode_guide','stop_recording','shutdown']
+
+def mailbox_loop(mailbox, results):
+    # the keyboard loop's command check, without the servos
+    write_seq = mailbox.write_seq
+    while True:
+        while write_seq.value != mailbox.read_seq:
+            command, data = mailbox.receive()
+            if command == 'shutdown':
+                return
+            if command == 'mode_guide':
+                data = data['angles'].shape
+            results.put((command, data))
+
+def test_large_piped_payload():
+    # a guide table well over the pipe buffer (~64 KB), through a spawned child
+    ctx = multiprocessing.get_context('spawn')
+    mailbox = CommandMailbox(ctx, COMMANDS)
+    results = ctx.Queue()
+    child = ctx.Process(target=mailbox_loop, args=(mailbox, results), daemon=True)
+    child.start()
+    try:
+        angles = np.zeros((1700,5))
+        assert angles.nbytes > 65536
+        # sent from a thread so a blocked send fails the test instead of hanging it
+        sender = threading.Thread(target=mailbox.send, args=('mode_guide',
+            {'angles': angles, 'rate': 100}), daemon=True)
+        sender.start()
+        sender.join(timeout=10)
+        assert not(sender.is_alive())
+        assert mailbox.send('stop_recording', 250)
+        assert results.get(timeout=10) == ('mode_guide', (1700,5))
+        assert results.get(timeout=10) == ('stop_recording', 250)
+        mailbox.send('shutdown')
+        child.join(timeout=10)
+        assert child.exitcode == 0
+    finally:
+        if child.is_alive():
+            child.terminate()
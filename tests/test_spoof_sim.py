@@ -0,0 +1,18 @@
+import os, sys, yaml
+import numpy as np
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from spoof_sim import *
+
+def test_less_delay_tracks_no_worse():
+    # the scripted player with the demo physics, one row per delay
+    with open(os.path.join(ROOT,'config','spoof_demo.yml')) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    delays = [0.2,0.1,0.05,0.0]
+    params = {'input_accel': np.full(len(delays), config['marble_input_accel'], dtype=float),
+        'gravity_accel': np.full(len(delays), config['marble_gravity_accel'], dtype=float),
+        'friction': np.full(len(delays), config['marble_friction'], dtype=float),
+        'deadband': np.full(len(delays), 3.0), 'delay': np.array(delays)}
+    metrics = simulate_chunk((params, spoof_course(config), 0.001))
+    rms_error = metrics['rms_error']
+    assert np.all(np.diff(rms_error) <= 0), rms_error
@@ -0,0 +1,25 @@
+import os, sys
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trajectory_analysis import *
+
+def lagged_recording(lag=0.08, duration=300.0, rate=1000.0):
+    # slow course-like sweeps, the follower the same motion lag s later
+    times = np.arange(0, duration, 1/rate)
+    def sweep(t):
+        return 20*np.sin(2*np.pi*0.2*t)+5*np.sin(2*np.pi*0.7*t)
+    return times, np.stack([sweep(times), sweep(times-lag)], axis=1)
+
+def mirror_lag(times, pos, chunk):
+    stats = TrajectoryStats(2, rate=200.0, pairs=[(0,1)], max_lag=0.5)
+    for start in range(0, len(times), chunk):
+        stats.add_motion(times[start:start+chunk], pos[start:start+chunk])
+    return {row['finger']: row for row in stats.finger_rows()}[1]
+
+def test_mirror_lag_independent_of_chunk():
+    times, pos = lagged_recording()
+    rows = [mirror_lag(times, pos, chunk) for chunk in [len(times),65536,10000,2000,333]]
+    for row in rows:
+        assert abs(row['mirror_lag_ms']-80) < 1e-6, row
+        assert abs(row['mirror_corr']-rows[0]['mirror_corr']) < 1e-9
+        assert abs(row['tremor_power_frac']-rows[0]['tremor_power_frac']) < 1e-9
@@ -0,0 +1,315 @@
+import os, csv, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import signal
+from course import *
+from block import *
+from frame_log import *
+from scripted_input import load_keyboard_config
+
+# per-finger trajectory metrics over recorded sessions: keyboard recordings
+# (KeyboardWrapper.save_recording) or game frame logs, both memory-mapped and
+# read a chunk at a time, sessions spread over a process pool
+
+TREMOR_BAND = (4.0, 12.0) # Hz
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Trajectory metrics over recorded sessions')
+    parser.add_argument('sessions', help='Keyboard recordings or frame logs', nargs='+')
+    parser.add_argument('-k','--keyboard', help='Keyboard config (finger ids, mirror pairs)', default='keyboard')
+    parser.add_argument('-r','--rate', help='Resampling rate (Hz), grid on multiples of 1/rate', type=float, default=200.0)
+    parser.add_argument('--chunk', help='Samples read per chunk', type=int, default=65536)
+    parser.add_argument('--max-lag', help='Largest mirror lag searched (s)', type=float, default=0.5)
+    parser.add_argument('-j','--workers', help='Worker processes', type=int, default=os.cpu_count())
+    parser.add_argument('-o','--output', help='Summary table (csv)', default='trajectory_summary.csv')
+    return parser.parse_args()
+
+def mirror_pairs(kb_config):
+    # (leader, follower) finger indices in recording order (rh ids, then lh)
+    all_ids = kb_config['rh_ids']+kb_config['lh_ids']
+    return [(all_ids.index(rh_id), all_ids.index(lh_id))
+        for rh_id, lh_id in kb_config['mirror_map_rh'].items()]
+
+def session_courses(info):
+    # course index per block trial (-1: the game's single example course)
+    courses = {-1: TRIAL_DEFAULTS}
+    if info.get('block'):
+        for idx, trial in enumerate(load_block(info['block'])['trials']):
+            courses[idx] = trial
+    speed = info['trough_speed']
+    indexes = {}
+    for trial, course in courses.items():
+        course_targets, course_times = build_course(course['targets'],
+            course['target_time_spacing'], course['start_end_time_spacing'])
+        course_y, course_angle = gen_course_path(course_targets, course_times, speed)
+        indexes[trial] = CourseIndex(course_y, course_angle, course['course_angle_width'])
+    return indexes
+
+def lagged_products(b, a, max_lag):
+    # sum over t of b[t+k]*a[t] for k in -max_lag..max_lag, 0 past the overlap
+    out = np.zeros(2*max_lag+1)
+    span = min(max_lag, len(a)-1)
+    if span < 0:
+        return out
+    full = signal.correlate(b, a, mode='full', method='fft')
+    center = len(a)-1
+    out[max_lag-span:max_lag+span+1] = full[center-span:center+span+1]
+    return out
+
+# running totals for one session, fed chunk by chunk
+class TrajectoryStats(object):
+    def __init__(self, num_fingers, rate=200.0, pairs=[], max_lag=0.5):
+        self.num_fingers = num_fingers
+        self.rate = rate
+        self.dt = 1.0/rate
+        self.pairs = pairs
+        self.max_lag_samples = int(max_lag*rate)
+        self.nperseg = int(2*rate) # 0.5 Hz bins
+        # carried across chunks: last raw sample, last resampled grid samples
+        self.last_time = None
+        self.last_pos = None
+        self.next_tick = None
+        self.history = None
+        self.num_samples = 0
+        self.speed_sum = np.zeros(num_fingers)
+        self.speed_max = np.zeros(num_fingers)
+        self.jerk_sq_sum = np.zeros(num_fingers)
+        self.jerk_count = 0
+        self.psd_sum = None
+        self.num_psd = 0
+        self.psd_pending = np.zeros((0,num_fingers)) # samples of an unfinished segment
+        # mirror xcorr: raw lagged products over the session, the first and
+        # last max_lag velocities and the velocity sums to take the means off
+        num_lags = 2*self.max_lag_samples+1
+        self.xcorr_sum = np.zeros((len(pairs),num_lags))
+        self.vel_head = np.zeros((0,num_fingers))
+        self.vel_tail = np.zeros((0,num_fingers))
+        self.vel_sum = np.zeros(num_fingers)
+        self.vel_sq_sum = np.zeros(num_fingers)
+        self.path_sq_sum = {}
+        self.path_count = {}
+        self.path_on_count = {}
+
+    def resample(self, times, pos):
+        # linear onto grid ticks k/rate, continuing from the previous chunk
+        if self.last_time is not None:
+            times = np.concatenate([[self.last_time], times])
+            pos = np.concatenate([self.last_pos[None,:], pos])
+        self.last_time = times[-1]
+        self.last_pos = pos[-1]
+        if self.next_tick is None:
+            self.next_tick = int(np.ceil(times[0]*self.rate))
+        last_tick = int(np.floor(times[-1]*self.rate))
+        if last_tick < self.next_tick:
+            return np.zeros((0,self.num_fingers))
+        grid = np.arange(self.next_tick, last_tick+1)*self.dt
+        self.next_tick = last_tick+1
+        return np.stack([np.interp(grid, times, pos[:,finger])
+            for finger in range(self.num_fingers)], axis=1)
+
+    def add_motion(self, times, pos):
+        grid_pos = self.resample(times, pos)
+        num_new = len(grid_pos)
+        if num_new == 0:
+            return
+        # derivatives over the carried history so chunk edges are seamless
+        if self.history is not None:
+            extended = np.concatenate([self.history, grid_pos])
+        else:
+            extended = grid_pos
+        self.history = extended[-3:]
+        vel = np.diff(extended, axis=0)*self.rate
+        jerk = np.diff(vel, n=2, axis=0)*self.rate*self.rate
+        vel = vel[-num_new:]
+        jerk = jerk[-num_new:]
+        speed = np.abs(vel)
+        self.num_samples += len(vel)
+        self.speed_sum += speed.sum(axis=0)
+        if len(speed):
+            self.speed_max = np.maximum(self.speed_max, speed.max(axis=0))
+        self.jerk_sq_sum += (jerk*jerk).sum(axis=0)
+        self.jerk_count += len(jerk)
+        self.add_spectrum(vel)
+        self.add_xcorr(vel)
+
+    def add_spectrum(self, vel):
+        # welch psd of velocity per finger, segments laid over the whole session
+        # (not per chunk) and averaged by segment count
+        vel = np.concatenate([self.psd_pending, vel])
+        step = self.nperseg-self.nperseg//2 # welch's default overlap
+        if len(vel) < self.nperseg:
+            self.psd_pending = vel
+            return
+        num_segments = 1+(len(vel)-self.nperseg)//step
+        used = self.nperseg+(num_segments-1)*step
+        freqs, psd = signal.welch(vel[:used], fs=self.rate, nperseg=self.nperseg, axis=0)
+        self.psd_pending = vel[num_segments*step:]
+        if self.psd_sum is None:
+            self.freqs = freqs
+            self.psd_sum = np.zeros_like(psd)
+        self.psd_sum += num_segments*psd
+        self.num_psd += num_segments
+
+    def add_xcorr(self, vel):
+        # follower against leader; this chunk against itself and the carried
+        # tail, less the tail against itself (counted with its own chunk), so
+        # the sums don't depend on where the chunks split
+        max_lag = self.max_lag_samples
+        tail = self.vel_tail
+        extended = np.concatenate([tail, vel])
+        for idx, (leader, follower) in enumerate(self.pairs):
+            self.xcorr_sum[idx] += (lagged_products(extended[:,follower], extended[:,leader], max_lag)
+                -lagged_products(tail[:,follower], tail[:,leader], max_lag))
+        self.vel_tail = extended[max(len(extended)-max_lag,0):]
+        if len(self.vel_head) < max_lag:
+            self.vel_head = np.concatenate([self.vel_head, vel])[:max_lag]
+        self.vel_sum += vel.sum(axis=0)
+        self.vel_sq_sum += (vel*vel).sum(axis=0)
+
+    def mirror_xcorr(self, idx):
+        # session means off the raw sums, per lag over the samples that overlap
+        # there; positive lag: follower behind. Returns (xcorr, norm)
+        leader, follower = self.pairs[idx]
+        max_lag = self.max_lag_samples
+        num = self.num_samples
+        lags = np.arange(-max_lag, max_lag+1)
+        shift = np.abs(lags)
+        def edge_sums(samples, finger, from_end):
+            # sums of the first (or last) 0..max_lag samples
+            values = samples[::-1,finger] if from_end else samples[:,finger]
+            return np.concatenate([[0.0], np.cumsum(values)])[shift]
+        sum_l, sum_f = self.vel_sum[leader], self.vel_sum[follower]
+        lead_sum = sum_l-np.where(lags >= 0, edge_sums(self.vel_tail, leader, True),
+            edge_sums(self.vel_head, leader, False))
+        follow_sum = sum_f-np.where(lags >= 0, edge_sums(self.vel_head, follower, False),
+            edge_sums(self.vel_tail, follower, True))
+        mean_l, mean_f = sum_l/num, sum_f/num
+        xcorr = (self.xcorr_sum[idx]-mean_f*lead_sum-mean_l*follow_sum
+            +(num-shift)*mean_f*mean_l)
+        energy_l = self.vel_sq_sum[leader]-num*mean_l*mean_l
+        energy_f = self.vel_sq_sum[follower]-num*mean_f*mean_f
+        return xcorr, np.sqrt(max(energy_l*energy_f, 0.0))
+
+    def add_path(self, finger, course_ys, marble_angles, trials, course_indexes):
+        # marble against the course it was on, frame samples (no resampling)
+        for trial in np.unique(trials):
+            index = course_indexes.get(int(trial))
+            if index is None:
+                continue
+            mask = trials == trial
+            ys = course_ys[mask]
+            inside = (ys >= index.y_start)&(ys <= index.y_end)
+            if not(inside.any()):
+                continue
+            angles, widths = index.lookup_array(ys[inside])
+            errors = marble_angles[mask][inside]-angles
+            self.path_sq_sum[finger] = self.path_sq_sum.get(finger,0.0)+(errors*errors).sum()
+            self.path_count[finger] = self.path_count.get(finger,0)+len(errors)
+            self.path_on_count[finger] = (self.path_on_count.get(finger,0)
+                +int((np.abs(errors) <= 0.5*widths).sum()))
+
+    def finger_rows(self):
+        rows = []
+        lags = np.arange(-self.max_lag_samples, self.max_lag_samples+1)*self.dt
+        fingers = list(range(self.num_fingers))
+        fingers += [finger for finger in self.path_count if finger not in fingers]
+        for finger in fingers:
+            row = {'finger': finger}
+            if finger >= 0 and self.num_samples:
+                row['samples'] = self.num_samples
+                row['duration_s'] = self.num_samples*self.dt
+                row['mean_speed'] = self.speed_sum[finger]/self.num_samples
+                row['peak_speed'] = self.speed_max[finger]
+                row['rms_jerk'] = (np.sqrt(self.jerk_sq_sum[finger]/self.jerk_count)
+                    if self.jerk_count else None)
+            if finger >= 0 and self.num_psd:
+                psd = self.psd_sum[:,finger]/self.num_psd
+                band = (self.freqs >= TREMOR_BAND[0])&(self.freqs <= TREMOR_BAND[1])
+                total = psd[1:].sum() # without the dc bin
+                row['tremor_power_frac'] = psd[band].sum()/total if total > 0 else None
+                row['tremor_peak_hz'] = self.freqs[band][np.argmax(psd[band])]
+            for idx, (leader, follower) in enumerate(self.pairs):
+                if finger != follower or self.num_samples <= 2*self.max_lag_samples:
+                    continue
+                xcorr, norm = self.mirror_xcorr(idx)
+                if norm > 0:
+                    best = np.argmax(xcorr)
+                    row['mirror_leader'] = leader
+                    row['mirror_lag_ms'] = 1000*lags[best]
+                    row['mirror_corr'] = xcorr[best]/norm
+            if self.path_count.get(finger):
+                row['path_rms_error'] = np.sqrt(self.path_sq_sum[finger]/self.path_count[finger])
+                row['path_fraction_on_course'] = self.path_on_count[finger]/self.path_count[finger]
+            rows.append(row)
+        return rows
+
+def analyze_session(job):
+    fname, kb_config, rate, chunk, max_lag = job
+    header, records = load_frame_log(fname)
+    info = header['info']
+    names = records.dtype.names
+    pos_field = 'pos' if 'pos' in names else 'kb_pos' if 'kb_pos' in names else None
+    num_fingers = records.dtype[pos_field].shape[0] if pos_field else 0
+    pairs = [pair for pair in mirror_pairs(kb_config) if max(pair) < num_fingers]
+    stats = TrajectoryStats(num_fingers, rate, pairs, max_lag)
+
+    # frame logs: which finger drove which marble, and the courses they ran on
+    course_indexes = None
+    if 'course_ypos' in names and 'trough_speed' in info:
+        course_indexes = session_courses(info)
+        if info.get('multi_marble'):
+            lane_fingers = np.argsort(kb_config['map_to_screen'])
+        elif num_fingers:
+            display_finger = 1 if info.get('display_hand','lh') == 'lh' else 0
+        else:
+            display_finger = -1 # keyboard-free game, marble only
+
+    for start in range(0, len(records), chunk):
+        samples = records[start:start+chunk]
+        if 'time_ms' in names:
+            times = samples['time_ms']/1000.0
+        else:
+            times = np.asarray(samples['time'], dtype=float)
+        if num_fingers:
+            stats.add_motion(times, np.asarray(samples[pos_field], dtype=float))
+        if course_indexes is not None:
+            course_ys = info['marble_base_ypos']-np.asarray(samples['course_ypos'], dtype=float)
+            trials = np.asarray(samples['trial'])
+            if info.get('multi_marble'):
+                for lane, finger in enumerate(lane_fingers):
+                    stats.add_path(int(finger), course_ys,
+                        np.asarray(samples['lane_angles'][:,lane], dtype=float), trials, course_indexes)
+            else:
+                stats.add_path(display_finger, course_ys,
+                    np.asarray(samples['marble_angle'], dtype=float), trials, course_indexes)
+
+    rows = stats.finger_rows()
+    for row in rows:
+        row['session'] = os.path.basename(fname)
+    return rows
+
+COLUMNS = ['session','finger','samples','duration_s','mean_speed','peak_speed','rms_jerk',
+    'tremor_power_frac','tremor_peak_hz','mirror_leader','mirror_lag_ms','mirror_corr',
+    'path_rms_error','path_fraction_on_course']
+
+def analyze_sessions(fnames, kb_config, rate=200.0, chunk=65536, max_lag=0.5, workers=1):
+    jobs = [(fname, kb_config, rate, chunk, max_lag) for fname in fnames]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers,len(jobs))) as pool:
+            results = list(pool.map(analyze_session, jobs))
+    else:
+        results = [analyze_session(job) for job in jobs]
+    return [row for rows in results for row in rows]
+
+if __name__ == '__main__':
+    args = parse_args()
+    kb_config = load_keyboard_config(args.keyboard)
+    start_time = time.time()
+    rows = analyze_sessions(args.sessions, kb_config, args.rate, args.chunk,
+        args.max_lag, args.workers)
+    print(str(len(args.sessions))+' sessions in '+str(round(time.time()-start_time,2))+' s')
+    with open(args.output,'w',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow([row.get(name,'') for name in COLUMNS])
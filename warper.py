@@ -0,0 +1,73 @@
+from psychopy.visual.windowwarp import Warper, GL
+from perspective import *
+
+# psychopy Warper fed from an in-memory mesh instead of a text warpfile
+class MeshWarper(Warper):
+    def __init__(self, win, perspective_corners=PERSPECTIVE_CORNERS,
+            grid=PERSPECTIVE_GRID, cache_fname=CACHE_FNAME, mesh=None):
+        self.perspective_corners = perspective_corners
+        self.mesh_grid = grid
+        self.cache_fname = cache_fname
+        self.render_scale = 1.0
+        self.scale_buffers = {} # render scale -> (vertex, texcoord, opacity) buffers
+        w, h = win.size
+        if mesh is None: # not preloaded by the caller
+            mesh = load_warp_mesh(w/h, perspective_corners, grid, cache_fname)
+        self.mesh = mesh
+        super(MeshWarper, self).__init__(win, warp='mesh')
+
+    def changeProjection(self, warp, warpfile=None, eyepoint=(0.5, 0.5),
+            flipHorizontal=False, flipVertical=False):
+        if warp != 'mesh':
+            super(MeshWarper, self).changeProjection(warp, warpfile, eyepoint,
+                flipHorizontal, flipVertical)
+            return
+        self.warp = warp
+        self.warpfile = None
+        self.eyepoint = list(eyepoint)
+        self.flipHorizontal = flipHorizontal
+        self.flipVertical = flipVertical
+        self.clear_scale_buffers() # built for the old mesh
+        self.projectionMesh()
+
+    def projectionMesh(self):
+        self.xgrid, self.ygrid = self.mesh_grid
+        vertices, tcoords, opacity = mesh_to_quads(self.mesh, self.mesh_grid)
+        if self.render_scale != 1.0:
+            tcoords = tcoords*self.render_scale
+        self.nverts = len(vertices)
+        self.createVertexAndTextureBuffers(vertices, tcoords, opacity)
+        self.scale_buffers[self.render_scale] = (self.gl_vb, self.gl_tb, self.gl_color)
+
+    def clear_scale_buffers(self):
+        for buffers in self.scale_buffers.values():
+            for buffer in buffers:
+                if buffer is not None:
+                    GL.glDeleteBuffers(1, buffer)
+        self.scale_buffers = {}
+
+    def recalibrate(self, perspective_corners=None, grid=None):
+        # new corners/grid or a resized window: rebuild mesh and buffers
+        if perspective_corners is not None:
+            self.perspective_corners = perspective_corners
+        if grid is not None:
+            self.mesh_grid = grid
+        w, h = self.win.size
+        self.mesh = load_warp_mesh(w/h, self.perspective_corners, self.mesh_grid, self.cache_fname)
+        self.changeProjection('mesh')
+
+    def set_render_scale(self, scale):
+        # scene drawn into the lower-left scale*size of the fbo, stretched back out
+        if scale != self.render_scale:
+            self.render_scale = scale
+            if scale in self.scale_buffers:
+                self.gl_vb, self.gl_tb, self.gl_color = self.scale_buffers[scale]
+            else:
+                self.projectionMesh()
+
+    def prepare_render_scales(self, scales):
+        # buffers for every scale up front, a scale change then only swaps handles
+        current = self.render_scale
+        for scale in scales:
+            self.set_render_scale(scale)
+        self.set_render_scale(current)